@@ -8,14 +8,18 @@ import csv
 import io
 import textwrap
 import logging
-import warnings
+import math
+import socket
 import time
+import random
+import zlib
 from PIL import Image, ImageDraw, ImageFont
 from datetime import datetime, timezone, timedelta
 from email.utils import parsedate_to_datetime
-from typing import List, Dict, Any, Optional, Union, cast
-from urllib.parse import urljoin
+from typing import List, Dict, Any, Optional, Tuple, Union, cast
+from urllib.parse import urljoin, urlsplit, urlunsplit, parse_qsl, urlencode
 from contextlib import asynccontextmanager
+from concurrent.futures import BrokenExecutor, Executor, ProcessPoolExecutor, ThreadPoolExecutor
 
 from fastapi import FastAPI, Query, Body, HTTPException, Request
 from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse, RedirectResponse
@@ -24,7 +28,8 @@ import httpx
 import feedparser
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from dotenv import load_dotenv
-from bs4 import BeautifulSoup, XMLParsedAsHTMLWarning
+from lxml import etree
+import lxml.html
 
 # PDF
 from reportlab.lib.pagesizes import A4
@@ -32,7 +37,6 @@ from reportlab.pdfgen import canvas
 from reportlab.lib.units import cm
 
 # ---------------- Init & logging ----------------
-warnings.filterwarnings("ignore", category=XMLParsedAsHTMLWarning)
 load_dotenv(override=True)
 DB_PATH = "signals.db"
 
@@ -44,10 +48,9 @@ logging.basicConfig(level=logging.INFO, filename='app.log',
                     format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# ограничиваем параллелизм LLM
-semaphore = asyncio.Semaphore(2)
-# сериализуем весь пайплайн (ingest+analyze+insert)
-pipeline_lock = asyncio.Lock()
+# ingest (и обслуживание) и анализ очереди сериализуются отдельно — новый опрос фидов не ждёт долгий анализ
+ingest_lock = asyncio.Lock()
+analysis_lock = asyncio.Lock()
 
 # ---------------- DB ----------------
 def db():
@@ -121,6 +124,39 @@ def db():
         source TEXT,
         raw JSON
     )""")
+    # Состояние фидов: conditional GET + водяной знак последней записи
+    conn.execute("""CREATE TABLE IF NOT EXISTS feed_state(
+        url TEXT PRIMARY KEY,
+        etag TEXT,
+        last_modified TEXT,
+        body_hash TEXT,
+        last_guid TEXT,
+        last_published TEXT,
+        checked_at TEXT,
+        changed_at TEXT
+    )""")
+    # Миграция: колонки адаптивного расписания опроса фидов
+    for col in ("rate_per_hour REAL", "poll_interval_s REAL", "next_poll_at TEXT", "last_poll_at TEXT", "fail_count INTEGER DEFAULT 0"):
+        try:
+            conn.execute(f"ALTER TABLE feed_state ADD COLUMN {col}")
+        except sqlite3.OperationalError:
+            pass  # колонка уже существует
+    # Здоровье фидов: задержки, статусы, счётчики ошибок и circuit breaker
+    conn.execute("""CREATE TABLE IF NOT EXISTS feed_health(
+        url TEXT PRIMARY KEY,
+        sector TEXT,
+        last_status INTEGER,
+        last_error TEXT,
+        last_latency_ms REAL,
+        avg_latency_ms REAL,
+        last_entries INTEGER DEFAULT 0,
+        consecutive_failures INTEGER DEFAULT 0,
+        total_ok INTEGER DEFAULT 0,
+        total_fail INTEGER DEFAULT 0,
+        last_ok_at TEXT,
+        last_checked_at TEXT,
+        circuit_open_until TEXT
+    )""")
     conn.execute("""CREATE TABLE IF NOT EXISTS curation(
         signal_id TEXT PRIMARY KEY,
         starred INTEGER DEFAULT 0,
@@ -129,6 +165,120 @@ def db():
         FOREIGN KEY(signal_id) REFERENCES signals(id)
     )""")
 
+    # Сжатые сырые payload'ы (ingested.raw / signals.raw больше не заполняются)
+    conn.execute("""CREATE TABLE IF NOT EXISTS raw_payloads(
+        id TEXT,
+        kind TEXT,
+        codec TEXT,
+        size INTEGER,
+        data BLOB,
+        PRIMARY KEY(id, kind)
+    )""")
+
+    # Кэш ответов LLM: ключ — хеш (провайдер, модель, параметры, промпт), ответ сжат как raw_payloads
+    conn.execute("""CREATE TABLE IF NOT EXISTS llm_cache(
+        key TEXT PRIMARY KEY,
+        provider TEXT,
+        model TEXT,
+        created_at REAL,
+        last_used REAL,
+        codec TEXT,
+        size INTEGER,
+        data BLOB
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache(last_used)")
+
+    # Учёт токенов: одна строка на сетевой вызов LLM (попадания в llm_cache сюда не пишутся)
+    conn.execute("""CREATE TABLE IF NOT EXISTS llm_usage(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts REAL,
+        provider TEXT,
+        model TEXT,
+        site TEXT,
+        prompt_tokens INTEGER,
+        cached_tokens INTEGER,
+        completion_tokens INTEGER,
+        latency_ms INTEGER,
+        items INTEGER DEFAULT 1
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_usage_ts ON llm_usage(ts)")
+    try:
+        conn.execute("ALTER TABLE llm_usage ADD COLUMN items INTEGER DEFAULT 1")  # новостей в запросе
+    except sqlite3.OperationalError:
+        pass  # колонка уже существует
+
+    # Очередь анализа: задача на каждую запись ingested; аренда (lease) защищает от двойной обработки,
+    # упавшие задачи повторяются с экспоненциальной паузой, после ANALYSIS_MAX_ATTEMPTS — dead
+    conn.execute("""CREATE TABLE IF NOT EXISTS analysis_jobs(
+        item_id TEXT PRIMARY KEY,
+        status TEXT,
+        attempts INTEGER DEFAULT 0,
+        created_at REAL,
+        next_attempt_at REAL,
+        lease_owner TEXT,
+        lease_until REAL,
+        last_error TEXT,
+        updated_at REAL
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_jobs_ready ON analysis_jobs(status, next_attempt_at)")
+
+    # Аналитика по языкам: signals.analysis хранила одну версию, и ru/en перезаписывали друг друга
+    conn.execute("""CREATE TABLE IF NOT EXISTS signal_analysis(
+        signal_id TEXT,
+        language TEXT,
+        analysis TEXT,
+        model TEXT,
+        created_at REAL,
+        PRIMARY KEY(signal_id, language)
+    )""")
+
+    # Неудачные попытки заранее сгенерировать аналитику: пауза перед повтором и предел попыток
+    conn.execute("""CREATE TABLE IF NOT EXISTS analysis_precompute_failures(
+        signal_id TEXT PRIMARY KEY,
+        attempts INTEGER,
+        next_attempt_at REAL,
+        last_error TEXT
+    )""")
+
+    # Пульс процессов с планировщиком (воркер или all): API видит, жив ли воркер
+    conn.execute("""CREATE TABLE IF NOT EXISTS worker_heartbeats(
+        worker_id TEXT PRIMARY KEY,
+        role TEXT,
+        started_at REAL,
+        heartbeat_at REAL,
+        ingesting INTEGER,
+        draining INTEGER
+    )""")
+
+    # Секторы статьи: одна статья (id = article_id) может входить в несколько секторов
+    conn.execute("""CREATE TABLE IF NOT EXISTS article_sectors(
+        article_id TEXT,
+        sector TEXT,
+        PRIMARY KEY(article_id, sector)
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_article_sectors_sector ON article_sectors(sector)")
+
+    # MinHash LSH-индекс заголовков сигналов: нормализованные токены + ключи полос для поиска кандидатов
+    conn.execute("""CREATE TABLE IF NOT EXISTS near_dup_index(
+        signal_id TEXT PRIMARY KEY,
+        ts TEXT,
+        tokens TEXT
+    )""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS near_dup_bands(
+        band_key INTEGER,
+        signal_id TEXT
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_near_dup_bands_key ON near_dup_bands(band_key)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_near_dup_bands_signal ON near_dup_bands(signal_id)")
+    # Почти-дубликаты, прикреплённые к существующему сигналу вместо повторного анализа
+    conn.execute("""CREATE TABLE IF NOT EXISTS signal_duplicates(
+        item_id TEXT PRIMARY KEY,
+        signal_id TEXT,
+        similarity REAL,
+        ts TEXT
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_signal_duplicates_signal ON signal_duplicates(signal_id)")
+
     # Создаем индексы для производительности
     conn.execute("CREATE INDEX IF NOT EXISTS idx_signals_ts_published ON signals(ts_published DESC)")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_signals_sector_ts ON signals(sector, ts_published DESC)")
@@ -141,8 +291,7 @@ def db():
 def safe_execute(conn, sql, params=(), retries=5, sleep=0.5):
     for i in range(retries):
         try:
-            conn.execute(sql, params)
-            return
+            return conn.execute(sql, params)
         except sqlite3.OperationalError as e:
             if ("locked" in str(e).lower() or "busy" in str(e).lower()) and i < retries - 1:
                 time.sleep(sleep * (i + 1))
@@ -152,6 +301,214 @@ def safe_execute(conn, sql, params=(), retries=5, sleep=0.5):
             logger.error(f"Database error: {e}")
             raise
 
+# ---------------- Raw payloads ----------------
+# Сырые данные нужны только для отладки: храним сжатыми в отдельной таблице и читаем по запросу
+RAW_CODEC = os.getenv("RAW_CODEC", "zlib")  # zlib | zstd (если установлен zstandard)
+RAW_INGEST_FIELDS = ("id", "link", "title", "published", "updated", "summary", "author")
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+def pack_raw(obj: Any) -> Tuple[str, int, bytes]:
+    data = json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if RAW_CODEC == "zstd" and zstandard is not None:
+        return "zstd", len(data), zstandard.ZstdCompressor(level=10).compress(data)
+    return "zlib", len(data), zlib.compress(data, 9)
+
+def unpack_raw(codec: str, blob: bytes) -> Any:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is not installed")
+        data = zstandard.ZstdDecompressor().decompress(blob)
+    else:
+        data = zlib.decompress(blob)
+    return json.loads(data.decode("utf-8"))
+
+def raw_payload_rows(items: List[Tuple[str, str, Any]]) -> List[Tuple[Any, ...]]:
+    """(id, kind, obj) -> строки для INSERT INTO raw_payloads"""
+    rows = []
+    for item_id, kind, obj in items:
+        codec, size, blob = pack_raw(obj)
+        rows.append((item_id, kind, codec, size, blob))
+    return rows
+
+def store_raw_payloads(conn, items: List[Tuple[str, str, Any]]):
+    conn.executemany("INSERT OR REPLACE INTO raw_payloads(id, kind, codec, size, data) VALUES(?,?,?,?,?)",
+                     raw_payload_rows(items))
+
+def load_raw_payload(conn, item_id: str, kind: str) -> Optional[Any]:
+    row = conn.execute("SELECT codec, data FROM raw_payloads WHERE id=? AND kind=?", (item_id, kind)).fetchone()
+    if row:
+        return unpack_raw(row[0], row[1])
+    # Старые записи: сырой JSON ещё лежит в колонке raw
+    table = "ingested" if kind == "ingest" else "signals"
+    legacy = conn.execute(f"SELECT raw FROM {table} WHERE id=?", (item_id,)).fetchone()
+    if legacy and legacy[0]:
+        try:
+            return json.loads(legacy[0])
+        except ValueError:
+            return legacy[0]
+    return None
+
+INGEST_WRITE_CHUNK = int(os.getenv("INGEST_WRITE_CHUNK", "500"))
+
+def bulk_insert_ingested(conn, rows: List[Tuple[Any, ...]], retries=5, sleep=0.5) -> set:
+    """Пакетная вставка в ingested (executemany, по транзакции на чанк).
+
+    rows: (id, ts_utc, sector, title, link, source, raw_dict); raw уходит в raw_payloads.
+
+    Возвращает множество id, которых до вставки не было. Проверка ключей, вставка и постановка
+    задач в analysis_jobs идут в одной BEGIN IMMEDIATE транзакции, поэтому ответ точный даже при параллельных писателях.
+    """
+    new_ids: set = set()
+    if not rows:
+        return new_ids
+    conn.commit()  # закрываем неявную транзакцию, чтобы начать свою
+    for start in range(0, len(rows), INGEST_WRITE_CHUNK):
+        chunk = rows[start:start + INGEST_WRITE_CHUNK]
+        ids = list({r[0] for r in chunk})
+        for i in range(retries):
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                placeholders = ",".join("?" for _ in ids)
+                existing = {r[0] for r in conn.execute(f"SELECT id FROM ingested WHERE id IN ({placeholders})", ids)}
+                fresh = [r for r in chunk if r[0] not in existing]
+                conn.executemany(
+                    "INSERT OR IGNORE INTO ingested(id, ts_utc, sector, title, link, source) VALUES(?,?,?,?,?,?)",
+                    [r[:6] for r in fresh]
+                )
+                store_raw_payloads(conn, [(r[0], "ingest", r[6]) for r in fresh if r[6]])
+                # задача на анализ — в той же транзакции: запись ingested без задачи не остаётся даже при сбое
+                enqueue_jobs(conn, [r[0] for r in fresh])
+                conn.commit()
+                new_ids.update(r[0] for r in fresh)
+                break
+            except sqlite3.OperationalError as e:
+                conn.rollback()
+                if ("locked" in str(e).lower() or "busy" in str(e).lower()) and i < retries - 1:
+                    time.sleep(sleep * (i + 1))
+                    continue
+                raise
+            except Exception:
+                conn.rollback()  # ни ingested, ни raw_payloads, ни задач из несостоявшейся транзакции
+                raise
+    return new_ids
+
+def add_article_sectors(conn, memberships) -> None:
+    """Членство статей в секторах (article_id, SECTOR); повторы игнорируются"""
+    if memberships:
+        conn.executemany("INSERT OR IGNORE INTO article_sectors(article_id, sector) VALUES(?,?)", list(memberships))
+
+# ---------------- HTTP clients ----------------
+FEED_TIMEOUT = float(os.getenv("FEED_TIMEOUT", "15"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+HTTP_FEED_MAX_CONNECTIONS = int(os.getenv("HTTP_FEED_MAX_CONNECTIONS", "20"))
+HTTP_LLM_MAX_CONNECTIONS = int(os.getenv("HTTP_LLM_MAX_CONNECTIONS", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "1") == "1"
+
+try:
+    import h2  # noqa: F401  (httpx[http2])
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Отдельные пулы: фиды не должны занимать соединения LLM-провайдеров и наоборот
+HTTP_POOLS: Dict[str, Dict[str, Any]] = {
+    "feeds": {"timeout": FEED_TIMEOUT, "max_connections": HTTP_FEED_MAX_CONNECTIONS, "follow_redirects": True},
+    "llm": {"timeout": LLM_TIMEOUT, "max_connections": HTTP_LLM_MAX_CONNECTIONS, "follow_redirects": False},
+    "misc": {"timeout": 10, "max_connections": 5, "follow_redirects": True},
+}
+
+class HTTPClients:
+    """Реестр долгоживущих httpx-клиентов (keep-alive, HTTP/2) со счётчиками переиспользования соединений"""
+
+    def __init__(self):
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._loops: Dict[str, Any] = {}
+        self._closing: set = set()  # задачи закрытия клиентов от прежних event loop
+        self.stats: Dict[str, Dict[str, int]] = {
+            name: {"requests": 0, "connections_opened": 0, "tls_handshakes": 0} for name in HTTP_POOLS
+        }
+
+    def _build(self, name: str) -> httpx.AsyncClient:
+        cfg = HTTP_POOLS[name]
+        stats = self.stats[name]
+
+        async def trace(event: str, info: Dict[str, Any]):
+            if event == "connection.connect_tcp.complete":
+                stats["connections_opened"] += 1
+            elif event == "connection.start_tls.complete":
+                stats["tls_handshakes"] += 1
+
+        async def on_request(request: httpx.Request):
+            stats["requests"] += 1
+            request.extensions["trace"] = trace
+
+        return httpx.AsyncClient(
+            timeout=cfg["timeout"],
+            follow_redirects=cfg["follow_redirects"],
+            http2=HTTP2_ENABLED and HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_connections=cfg["max_connections"],
+                                max_keepalive_connections=cfg["max_connections"],
+                                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY),
+            event_hooks={"request": [on_request]},
+        )
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        """Возвращает клиент пула; создаёт лениво (скрипты вызывают пайплайн без lifespan)"""
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(name)
+        if client is None or client.is_closed or self._loops.get(name) is not loop:
+            if client is not None and not client.is_closed:
+                self._discard(name, client, self._loops.get(name))
+            client = self._build(name)
+            self._clients[name] = client
+            self._loops[name] = loop
+        return client
+
+    def _discard(self, name: str, client: httpx.AsyncClient, old_loop: Any):
+        """Клиент от другого event loop (скрипты с несколькими asyncio.run): закрываем его пул, а не бросаем"""
+        if old_loop is not None and old_loop.is_running() and not old_loop.is_closed():
+            asyncio.run_coroutine_threadsafe(client.aclose(), old_loop)
+            return
+        # loop уже остановлен: соединения к нему не вернуть — закрываем сокеты из текущего, ошибки только логируем
+        async def close():
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.debug(f"HTTP client {name} from a finished event loop: close issue: {e!r}")
+        task = asyncio.get_running_loop().create_task(close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+        logger.info(f"HTTP client {name}: event loop changed, old pool closed")
+
+    async def start(self):
+        for name in HTTP_POOLS:
+            self.get(name)
+        logger.info("HTTP clients started (http2=%s)", HTTP2_ENABLED and HTTP2_AVAILABLE)
+
+    async def aclose(self):
+        for name, client in list(self._clients.items()):
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning(f"HTTP client {name} close issue: {e}")
+        self._clients.clear()
+        self._loops.clear()
+
+    def report(self) -> Dict[str, Any]:
+        out = {}
+        for name, st in self.stats.items():
+            reused = max(st["requests"] - st["connections_opened"], 0)
+            out[name] = dict(st, reused=reused,
+                             reuse_ratio=round(reused / st["requests"], 3) if st["requests"] else 0.0)
+        return out
+
+http_clients = HTTPClients()
+
 # ---------------- Sources ----------------
 SECTOR_FEEDS = {
     "TREASURY": [
@@ -297,6 +654,37 @@ DEFAULT_SECTORS = ["TREASURY", "CRYPTO", "BIOTECH", "SEMIS", "ENERGY", "FINTECH"
 def hash_id(s: str) -> str:
     return hashlib.sha256(s.encode("utf-8")).hexdigest()[:32]
 
+# Параметры трекинга: не меняют статью, но делают ссылки из разных фидов разными
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "dclid", "msclkid", "yclid", "igshid", "mc_cid", "mc_eid", "_hsenc", "_hsmi",
+    "mkt_tok", "cmpid", "ncid", "ocid", "smid", "ref", "ref_src", "taid", "guccounter",
+    "guce_referrer", "guce_referrer_sig", "at_medium", "at_campaign", "sr_share",
+}
+
+def canonical_url(url: str) -> str:
+    """Каноническая ссылка статьи: схема и хост в нижнем регистре, без фрагмента и трекинг-параметров"""
+    url = (url or "").strip()
+    if not url:
+        return ""
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and (scheme, parts.port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{parts.port}"
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if not k.lower().startswith("utm_") and k.lower() not in TRACKING_PARAMS]
+    path = parts.path or "/"  # "https://host" и "https://host/" — один адрес
+    if len(path) > 1 and path.endswith("/"):
+        path = path.rstrip("/") or "/"
+    return urlunsplit((scheme, host, path, urlencode(sorted(query)), ""))
+
+def article_id(link: str, title: str = "") -> str:
+    """Идентификатор статьи, не зависящий от сектора: одна статья — одна запись и один анализ"""
+    return hash_id(canonical_url(link) or title)
+
 def extract_domain(url: str) -> str:
     """Извлекает домен из URL"""
     try:
@@ -384,6 +772,7 @@ class Signal(BaseModel):
     title_clean: str
     title_ru: str = ""  # Русский перевод заголовка
     sector: str
+    sectors: List[str] = []  # все секторы статьи (основной + членства)
     label: str
     region: str
     tickers: List[str] = []
@@ -409,17 +798,18 @@ LABEL_SET = "regulatory,litigation,product_launch,earnings,macro,fraud,policy,mn
 SECTOR_SET = "TREASURY,CRYPTO,BIOTECH,SEMIS,ENERGY,FINTECH,DEFENSE,REAL_ESTATE,COMMODITIES,EMERGING_MARKETS,AUTOMOTIVE,HEALTHCARE,RETAIL,TECHNOLOGY,TRANSPORTATION,MEDIA,AGRICULTURE,UTILITIES,SPORTS,LUXURY"
 
 REGION_SET = "US,EU,CN,JP,UK,CA,AU,BR,IN,RU,SA,TR,EM,UA"
-PROMPT_TMPL = (
-    "Ты — редактор новостного дайджеста SAA ALLIANCE. Твоя задача — за 1 выпуск собрать и оформить лаконичный, проверенный дайджест по технологиям и криптовалютам в строгом формате.\n\n"
-    "Входные данные:\n{text}\n\n"
+PROMPT_HEAD = "Ты — редактор новостного дайджеста SAA ALLIANCE. Твоя задача — за 1 выпуск собрать и оформить лаконичный, проверенный дайджест по технологиям и криптовалютам в строгом формате.\n\n"
+PROMPT_DEDUP_RULE = "• Анти-дубликаты: объединяй заметки про одно и то же событие\n"
+PROMPT_RULES = (
     "Жёсткие правила отбора:\n"
     "• Только свежие материалы: публикации, датированные сегодня или максимум −2 дня\n"
     "• Качество и разнообразие: не более 1 материала с одного домена на раздел\n"
-    "• Анти-дубликаты: объединяй заметки про одно и то же событие\n"
+    "{dedup}"
     "• Ясные числа: если упоминаешь сумму/метрику, укажи число и единицы\n"
     "• Никаких оборванных фраз: описание — законченное одно предложение (макс. 22–28 слов)\n"
     "• Нейтральность: факты — нейтрально; тон (бычий/медвежий/нейтральный) выводится из фактов отдельно\n\n"
-    "Верни JSON с полями:\n"
+)
+PROMPT_FIELDS = (
     "title_ru: русский заголовок (до 90 знаков, без кликбейта)\n"
     "summary: 1 предложение, 22–28 слов, только подтвержденные факты на русском\n"
     f"label: {LABEL_SET}\n"
@@ -431,11 +821,73 @@ PROMPT_TMPL = (
     "what: что произошло (1 предложение на русском)\n"
     "why_matters: почему важно (1-2 буллета на русском)\n"
     "action_window: intraday/1-3d/>1w\n"
-    "analysis: SAA Alliance анализ влияния на рынок, отрасль, риски, возможности (100-150 слов НА РУССКОМ)\n\n"
-    "Только JSON, без лишних слов."
+    "analysis: SAA Alliance анализ влияния на рынок, отрасль, риски, возможности (100-150 слов НА РУССКОМ)\n"
+)
+# Промпт разбит на статический префикс (system: роль, правила, схема ответа) и переменный хвост (user: новости).
+# Провайдеры кэшируют совпадающий префикс запроса (OpenAI — от 1024 токенов, DeepSeek — любой длины),
+# поэтому всё неизменное идёт первым и байт-в-байт одинаково от вызова к вызову.
+PROMPT_SYSTEM = (
+    PROMPT_HEAD +
+    PROMPT_RULES.replace("{dedup}", PROMPT_DEDUP_RULE) +
+    "Верни JSON с полями:\n" +
+    PROMPT_FIELDS +
+    "\nТолько JSON, без лишних слов."
+)
+PROMPT_USER_TMPL = "Входные данные:\n{text}"
+
+PROMPT_BATCH_SYSTEM = (
+    PROMPT_HEAD +
+    # в пакете каждая новость анализируется отдельно — объединять нельзя, иначе потеряем id
+    PROMPT_RULES.replace("{dedup}", "• Каждую новость анализируй отдельно, даже если события похожи\n") +
+    "Во входных данных несколько новостей, у каждой в квадратных скобках её id.\n"
+    "Для КАЖДОЙ новости верни объект с полем id (как во входных данных) и полями:\n" +
+    PROMPT_FIELDS +
+    '\nОтвет — только JSON-объект вида {"items": [{"id": "1", ...}, ...]}, по одному элементу на каждую новость, без лишних слов.'
 )
 
-def extract_json(s: str) -> Dict[str, Any]:
+def build_batch_prompt(texts: List[Tuple[str, str]]) -> str:
+    """Переменная часть пакетного промпта (инструкции — в PROMPT_BATCH_SYSTEM)"""
+    news = "\n\n".join(f"[{key}] {text}" for key, text in texts)
+    return f"Входные данные — {len(texts)} новостей:\n{news}"
+
+# Компактная схема ответа пайплайна: короткие ключи, коды вместо перечислений и без длинного analysis —
+# его генерирует /generate-analysis при открытии новости (большинство новостей не открывают никогда).
+# Время ответа растёт с числом выходных токенов, а analysis на 100-150 слов был большей их частью.
+LLM_OUTPUT_SCHEMA = os.getenv("LLM_OUTPUT_SCHEMA", "compact")  # compact | full (прежние поля с analysis)
+LLM_COMPACT_MAX_TOKENS = int(os.getenv("LLM_COMPACT_MAX_TOKENS", "250"))  # max_tokens на одну новость
+LABEL_CODES = LABEL_SET.split(",")
+REGION_CODES = REGION_SET.split(",")
+ACTION_WINDOW_CODES = ["intraday", "1-3d", ">1w"]
+
+PROMPT_COMPACT_FIELDS = (
+    "t: русский заголовок (до 90 знаков, без кликбейта)\n"
+    "s: 1 предложение, 22–28 слов, только подтвержденные факты на русском\n"
+    "l: код метки — " + ", ".join(f"{i}={name}" for i, name in enumerate(LABEL_CODES)) + "\n"
+    "i: impact 0-100 (масштаб события + надёжность источников + конкретные цифры + вероятность последствий)\n"
+    "c: confidence 0-100\n"
+    "se: sentiment -1/0/1 (1 — рост цен/принятие, -1 — падение цен/ликвидации, 0 — протоколы/обновления)\n"
+    f"r: регион — {REGION_SET}\n"
+    "k: список тикеров, если нет — []\n"
+    "w: окно реакции рынка — 0=intraday, 1=1-3d, 2=>1w\n"
+)
+PROMPT_COMPACT_SYSTEM = (
+    PROMPT_HEAD +
+    PROMPT_RULES.replace("{dedup}", PROMPT_DEDUP_RULE) +
+    "Верни JSON-объект с ключами:\n" +
+    PROMPT_COMPACT_FIELDS +
+    '\nТолько JSON в одну строку, без лишних слов. Пример: {"t":"...","s":"...","l":4,"i":60,"c":70,"se":1,"r":"US","k":["BTC"],"w":1}'
+)
+PROMPT_COMPACT_BATCH_SYSTEM = (
+    PROMPT_HEAD +
+    PROMPT_RULES.replace("{dedup}", "• Каждую новость анализируй отдельно, даже если события похожи\n") +
+    "Во входных данных несколько новостей, у каждой в квадратных скобках её id.\n"
+    "Для КАЖДОЙ новости верни объект с ключом id (как во входных данных) и ключами:\n" +
+    PROMPT_COMPACT_FIELDS +
+    '\nОтвет — только JSON в одну строку вида {"items":[{"id":"1","t":"...",...},...]}, по одному элементу на каждую новость, без лишних слов.'
+)
+
+def parse_json_answer(s: str) -> Any:
+    """JSON из ответа модели (весь текст или первый {...} в нём); None — JSON нет"""
     try:
         return json.loads(s)
     except Exception:
@@ -445,6 +897,11 @@ def extract_json(s: str) -> Dict[str, Any]:
                 return json.loads(m.group(0))
             except Exception:
                 pass
+    return None
+
+def extract_json(s: str) -> Dict[str, Any]:
+    parsed = parse_json_answer(s)
+    if parsed is None:
         return {
             "summary": s[:200],
             "label": "other",
@@ -457,6 +914,545 @@ def extract_json(s: str) -> Dict[str, Any]:
             "why_matters": "Влияние на рынок не определено",
             "action_window": ">1w"
         }
+    return parsed
+
+def extract_json_items(s: str) -> Dict[str, Dict[str, Any]]:
+    """Разбирает пакетный ответ {"items": [...]} (или голый массив) в словарь id -> объект"""
+    data: Any = None
+    try:
+        data = json.loads(s)
+    except Exception:
+        m = re.search(r'[\[{].*[\]}]', s, re.S)
+        if m:
+            try:
+                data = json.loads(m.group(0))
+            except Exception:
+                pass
+    if isinstance(data, dict):
+        data = data.get("items", [])
+    if not isinstance(data, list):
+        return {}
+    return {str(obj["id"]): obj for obj in data if isinstance(obj, dict) and obj.get("id") is not None}
+
+def llm_result_from_dict(parsed: Dict[str, Any], impact: int = 25, confidence: int = 50) -> LLMResult:
+    # Конвертируем списки в строки если нужно
+    why_matters = parsed.get("why_matters", "")
+    if isinstance(why_matters, list):
+        why_matters = " ".join(why_matters)
+
+    return LLMResult(
+        title_ru=parsed.get("title_ru", ""),
+        summary=parsed.get("summary", ""),
+        label=parsed.get("label", "other"),
+        impact=int(parsed.get("impact", impact)),
+        confidence=int(parsed.get("confidence", confidence)),
+        sentiment=int(parsed.get("sentiment", 0)),
+        region=parsed.get("region", "US"),
+        tickers=parsed.get("tickers", []),
+        what=parsed.get("what", ""),
+        why_matters=why_matters,
+        action_window=parsed.get("action_window", ">1w"),
+        analysis=parsed.get("analysis", ""),
+        latency="fast"
+    )
+
+def _compact_int(obj: Dict[str, Any], key: str, lo: int, hi: int, default: Optional[int] = None) -> int:
+    value = obj.get(key, default)
+    if isinstance(value, str) and re.fullmatch(r"[+-]?\d+", value.strip()):
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) or value != int(value):
+        raise ValueError(f"{key}: expected integer, got {value!r}")
+    if not lo <= int(value) <= hi:
+        raise ValueError(f"{key}: {value} out of range {lo}..{hi}")
+    return int(value)
+
+def _compact_code(obj: Dict[str, Any], key: str, codes: List[str], default: Optional[int] = None) -> str:
+    value = obj.get(key, default)
+    if isinstance(value, str) and value.strip() in codes:
+        return value.strip()  # модель написала имя вместо кода — тоже допустимое значение
+    return codes[_compact_int({key: value}, key, 0, len(codes) - 1)]
+
+def llm_result_from_compact(parsed: Any) -> LLMResult:
+    """Строгий декодер компактной схемы: неизвестный код, неверный тип или нет обязательного ключа — ValueError
+    (без подстановки «other/impact 25»: такой ответ считается ошибкой провайдера)"""
+    if not isinstance(parsed, dict):
+        raise ValueError("expected JSON object")
+    summary = parsed.get("s")
+    if not isinstance(summary, str) or not summary.strip():
+        raise ValueError("s: summary is missing")
+    title_ru = parsed.get("t", "")
+    if not isinstance(title_ru, str):
+        raise ValueError(f"t: expected string, got {title_ru!r}")
+    region = parsed.get("r", "US")
+    if not isinstance(region, str) or region.strip().upper() not in REGION_CODES:
+        raise ValueError(f"r: unknown region {region!r}")
+    tickers = parsed.get("k", [])
+    if not isinstance(tickers, list) or not all(isinstance(t, str) for t in tickers):
+        raise ValueError(f"k: expected list of strings, got {tickers!r}")
+    return LLMResult(
+        title_ru=title_ru.strip(),
+        summary=summary.strip(),
+        label=_compact_code(parsed, "l", LABEL_CODES),
+        impact=_compact_int(parsed, "i", 0, 100),
+        confidence=_compact_int(parsed, "c", 0, 100),
+        sentiment=_compact_int(parsed, "se", -1, 1, default=0),
+        region=region.strip().upper(),
+        tickers=[t.strip().upper() for t in tickers if t.strip()],
+        action_window=_compact_code(parsed, "w", ACTION_WINDOW_CODES, default=2),
+        latency="fast"
+    )
+
+# ---------------- Provider rate limits ----------------
+# Лимитер на провайдера: token bucket по запросам и токенам в минуту (ёмкость берём из заголовков
+# x-ratelimit-*), пауза по Retry-After и AIMD-регулятор числа одновременных запросов:
+# +1/limit за каждый быстрый успешный ответ, ×0.5 при 429/5xx/таймауте.
+LLM_CONCURRENCY = {
+    "openai": int(os.getenv("OPENAI_CONCURRENCY", "4")),
+    "deepseek": int(os.getenv("DEEPSEEK_CONCURRENCY", "4")),
+}
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_LATENCY_TARGET_S = float(os.getenv("LLM_LATENCY_TARGET_S", "20"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE_S = float(os.getenv("LLM_BACKOFF_BASE_S", "1"))
+LLM_BACKOFF_MAX_S = float(os.getenv("LLM_BACKOFF_MAX_S", "60"))
+LLM_OUTPUT_TOKENS = int(os.getenv("LLM_OUTPUT_TOKENS", "700"))  # оценка ответа, если max_tokens не задан
+
+class LLMRateLimited(Exception):
+    """Провайдер продолжает отвечать 429 после всех повторов"""
+
+def parse_duration(value: str) -> Optional[float]:
+    """'1s', '6m0s', '20ms', '0.5' -> секунды"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ms|s|m|h)', value)
+    if not parts:
+        return None
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(n) * scale[unit] for n, unit in parts)
+
+def parse_retry_after(headers) -> Optional[float]:
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    seconds = parse_duration(value)
+    if seconds is not None:
+        return seconds
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    """Ведро на минуту; capacity=0 — лимит неизвестен (не ограничиваем, пока провайдер не сообщит)"""
+
+    def __init__(self, per_minute: float = 0):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if self.capacity:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        if not self.capacity:
+            return 0.0
+        amount = min(amount, self.capacity)  # запрос больше ёмкости ждёт полного ведра
+        return 0.0 if self.level >= amount else (amount - self.level) * 60 / self.capacity
+
+    def take(self, amount: float):
+        if self.capacity:
+            self.level -= amount
+
+    def sync(self, limit: Optional[float], remaining: Optional[float], reset_s: Optional[float], now: float):
+        """Подстраиваемся под x-ratelimit-limit-* / remaining-* / reset-*"""
+        if limit:
+            if not self.capacity:
+                # лимит стал известен только сейчас — ведро начинаем с сообщённого остатка
+                self.level = float(remaining) if remaining is not None else float(limit)
+            self.capacity = float(limit)
+        if remaining is not None and self.capacity:
+            self._refill(now)
+            self.level = min(self.level, float(remaining))
+            if remaining <= 0 and reset_s:
+                # до сброса окна ведро пустое
+                self.level = -reset_s * self.capacity / 60
+
+class ProviderLimiter:
+    def __init__(self, name: str):
+        self.name = name
+        self.requests = TokenBucket(float(os.getenv(f"{name.upper()}_RPM", "0")))
+        self.tokens = TokenBucket(float(os.getenv(f"{name.upper()}_TPM", "0")))
+        self.limit = float(max(LLM_CONCURRENCY.get(name, 2), 1))
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.stats = {"requests": 0, "ok": 0, "rate_limited": 0, "errors": 0, "retries": 0, "cancelled": 0, "waited_s": 0.0}
+
+    async def acquire(self, tokens: int):
+        started = time.monotonic()
+        while True:
+            now = time.monotonic()
+            wait = self.blocked_until - now
+            if wait <= 0:
+                wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    self.requests.take(1)
+                    self.tokens.take(tokens)
+                    self.in_flight += 1
+                    self.stats["requests"] += 1
+                    self.stats["waited_s"] += now - started
+                    return
+            await asyncio.sleep(min(max(wait, 0.05), 1.0))
+
+    def update_from_headers(self, headers):
+        now = time.monotonic()
+
+        def num(key):
+            try:
+                return float(headers[key]) if key in headers else None
+            except ValueError:
+                return None
+
+        self.requests.sync(num("x-ratelimit-limit-requests"), num("x-ratelimit-remaining-requests"),
+                           parse_duration(headers.get("x-ratelimit-reset-requests", "")), now)
+        self.tokens.sync(num("x-ratelimit-limit-tokens"), num("x-ratelimit-remaining-tokens"),
+                         parse_duration(headers.get("x-ratelimit-reset-tokens", "")), now)
+
+    def release(self, ok: bool, latency: float = 0.0, congested: bool = False, retry_after: Optional[float] = None,
+                tokens_estimated: int = 0, tokens_used: Optional[int] = None):
+        now = time.monotonic()
+        self.in_flight = max(self.in_flight - 1, 0)
+        if tokens_used is not None:
+            self.tokens.take(tokens_used - tokens_estimated)  # поправка оценки на фактический расход
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, now + retry_after * random.uniform(1.0, 1.2))
+        if ok:
+            self.stats["ok"] += 1
+            if latency <= LLM_LATENCY_TARGET_S:
+                self.limit = min(self.limit + 1 / self.limit, LLM_MAX_CONCURRENCY)
+            return
+        self.stats["errors"] += 1
+        if congested and now - self.last_decrease > 2.0:
+            # не чаще раза в пару секунд: пачка одновременных 429 — это один сигнал перегрузки
+            self.limit = max(self.limit / 2, 1.0)
+            self.last_decrease = now
+
+    def cancel(self):
+        """Запрос отменён (hedged/quorum) — освобождаем слот без влияния на AIMD"""
+        self.in_flight = max(self.in_flight - 1, 0)
+        self.stats["cancelled"] += 1
+
+    def report(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return dict(self.stats, waited_s=round(self.stats["waited_s"], 2), concurrency=round(self.limit, 2),
+                    in_flight=self.in_flight, blocked_for_s=round(max(self.blocked_until - now, 0), 1),
+                    rpm=self.requests.capacity or None, tpm=self.tokens.capacity or None)
+
+_provider_limiters: Dict[str, ProviderLimiter] = {}
+
+def provider_limiter(provider: str) -> ProviderLimiter:
+    limiter = _provider_limiters.get(provider)
+    if limiter is None:
+        limiter = _provider_limiters[provider] = ProviderLimiter(provider)
+    return limiter
+
+def backoff_delay(attempt: int) -> float:
+    return min(LLM_BACKOFF_MAX_S, LLM_BACKOFF_BASE_S * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+# ---------------- LLM cache ----------------
+# Одинаковый запрос (orphan-повторы, повторные клики «Анализ», скрипты, рестарты) не должен стоить токенов:
+# ответы хранятся в SQLite по хешу запроса, с TTL и LRU-вытеснением по суммарному размеру.
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_TTL_HOURS = float(os.getenv("LLM_CACHE_TTL_HOURS", "168"))
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "64"))
+
+LLM_CACHE_STATS: Dict[str, int] = {"hits": 0, "misses": 0, "bypassed": 0, "stored": 0, "evicted": 0,
+                                   "bytes_served": 0, "bytes_stored": 0}
+
+def llm_cache_key(provider: str, payload: Dict[str, Any]) -> str:
+    # payload содержит модель, температуру, max_tokens и сообщения — всё, что влияет на ответ
+    return hashlib.sha256(json.dumps([provider, payload], sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def llm_cache_get(key: str) -> Optional[str]:
+    conn = None
+    try:
+        conn = db()
+        row = conn.execute("SELECT created_at, codec, data FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if not row:
+            return None
+        now = time.time()
+        if now - row[0] > LLM_CACHE_TTL_HOURS * 3600:
+            conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            conn.commit()
+            return None
+        conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+        conn.commit()
+        return unpack_raw(row[1], row[2])
+    except Exception as e:
+        logger.warning(f"LLM cache read failed: {e}")
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+def llm_cache_discard(provider: str, payload: Dict[str, Any]):
+    """Удаляет закэшированный ответ (например, не прошедший проверку), чтобы повтор ушёл к провайдеру"""
+    conn = None
+    try:
+        conn = db()
+        conn.execute("DELETE FROM llm_cache WHERE key = ?", (llm_cache_key(provider, payload),))
+        conn.commit()
+    except Exception as e:
+        logger.warning(f"LLM cache delete failed: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+def llm_cache_put(key: str, provider: str, model: str, content: str):
+    conn = None
+    try:
+        conn = db()
+        codec, size, blob = pack_raw(content)
+        now = time.time()
+        conn.execute("INSERT OR REPLACE INTO llm_cache(key, provider, model, created_at, last_used, codec, size, data) VALUES(?,?,?,?,?,?,?,?)",
+                     (key, provider, model, now, now, codec, len(blob), blob))
+        LLM_CACHE_STATS["stored"] += 1
+        LLM_CACHE_STATS["bytes_stored"] += len(blob)
+        # Вытеснение: сначала просроченные, затем давно не использованные — пока не уложимся в лимит
+        limit = int(LLM_CACHE_MAX_MB * 1024 * 1024)
+        total = conn.execute("SELECT IFNULL(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total > limit:
+            expired = conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - LLM_CACHE_TTL_HOURS * 3600,)).rowcount
+            LLM_CACHE_STATS["evicted"] += max(expired, 0)
+            total = conn.execute("SELECT IFNULL(SUM(size), 0) FROM llm_cache").fetchone()[0]
+            victims = []
+            for victim, victim_size in conn.execute("SELECT key, size FROM llm_cache ORDER BY last_used ASC"):
+                if total <= limit:
+                    break
+                victims.append((victim,))
+                total -= victim_size
+            conn.executemany("DELETE FROM llm_cache WHERE key = ?", victims)
+            LLM_CACHE_STATS["evicted"] += len(victims)
+        conn.commit()
+    except Exception as e:
+        logger.warning(f"LLM cache write failed: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+# ---------------- LLM usage ----------------
+# usage из ответа провайдера (prompt / cached / completion) пишется на каждый вызов с меткой места вызова (site):
+# analyze, analyze_batch, on_demand, on_demand_stream, ... — отчёт в /llm/usage.
+LLM_USAGE_ENABLED = os.getenv("LLM_USAGE_ENABLED", "1") == "1"
+LLM_USAGE_RETENTION_DAYS = int(os.getenv("LLM_USAGE_RETENTION_DAYS", "30"))
+
+def parse_prices(spec: str) -> Dict[str, Tuple[float, float, float]]:
+    """'model=input/output[/cached],...' ($ за 1M токенов) -> {model: (input, output, cached)}"""
+    prices: Dict[str, Tuple[float, float, float]] = {}
+    for part in spec.split(","):
+        model, _, values = part.strip().partition("=")
+        try:
+            nums = [float(v) for v in values.split("/")]
+        except ValueError:
+            continue
+        if model and len(nums) >= 2:
+            prices[model] = (nums[0], nums[1], nums[2] if len(nums) > 2 else nums[0])
+    return prices
+
+# Цены для оценки стоимости в /llm/usage и /llm/cascade; модели без цены считаются бесплатными
+LLM_PRICES = parse_prices(os.getenv("LLM_PRICES", "gpt-4o=2.5/10/1.25,gpt-4o-mini=0.15/0.6/0.075,deepseek-chat=0.27/1.1/0.07"))
+
+def usage_cost(model: str, prompt: int, cached: int, completion: int) -> float:
+    price_in, price_out, price_cached = LLM_PRICES.get(model, (0.0, 0.0, 0.0))
+    return ((prompt - cached) * price_in + cached * price_cached + completion * price_out) / 1_000_000
+
+def usage_tokens(usage: Optional[Dict[str, Any]]) -> Tuple[int, int, int]:
+    """(prompt, cached, completion) из usage; cached: OpenAI — prompt_tokens_details, DeepSeek — prompt_cache_hit_tokens"""
+    if not usage:
+        return 0, 0, 0
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or usage.get("prompt_cache_hit_tokens") or 0
+    return int(usage.get("prompt_tokens") or 0), int(cached), int(usage.get("completion_tokens") or 0)
+
+def record_llm_usage(provider: str, model: str, site: str, usage: Optional[Dict[str, Any]], latency: float, items: int = 1):
+    if not LLM_USAGE_ENABLED:
+        return
+    prompt, cached, completion = usage_tokens(usage)
+    conn = None
+    try:
+        conn = db()
+        conn.execute("""INSERT INTO llm_usage(ts, provider, model, site, prompt_tokens, cached_tokens, completion_tokens, latency_ms, items)
+                        VALUES(?,?,?,?,?,?,?,?,?)""",
+                     (time.time(), provider, model, site, prompt, cached, completion, int(latency * 1000), items))
+        conn.commit()
+    except Exception as e:
+        logger.warning(f"LLM usage write failed: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+async def llm_send(provider: str, url: str, api_key: str, payload: Dict[str, Any], stream: bool = False) -> Tuple[httpx.Response, float, int]:
+    """POST через лимитер провайдера с повторами (429/5xx/сеть).
+
+    Возвращает (ответ, момент отправки, оценка токенов); слот лимитера остаётся занятым —
+    вызывающий освобождает его через release()/cancel(), дочитав ответ (при stream=True — и закрыв его)."""
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+    client = http_clients.get("llm")
+    limiter = provider_limiter(provider)
+    estimated = estimate_tokens(json.dumps(payload.get("messages", []), ensure_ascii=False)) + int(payload.get("max_tokens") or LLM_OUTPUT_TOKENS)
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        await limiter.acquire(estimated)
+        started = time.monotonic()
+        try:
+            r = await client.send(client.build_request("POST", url, headers=headers, json=payload), stream=stream)
+        except asyncio.CancelledError:
+            limiter.cancel()
+            raise
+        except (httpx.TimeoutException, httpx.TransportError) as e:
+            limiter.release(ok=False, congested=True)
+            if attempt < LLM_MAX_RETRIES:
+                limiter.stats["retries"] += 1
+                logger.warning(f"LLM {provider}: {e!r}, retry {attempt + 1}/{LLM_MAX_RETRIES}")
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+            raise
+        except Exception:
+            # DecodingError, TooManyRedirects и т.п.: слот не должен остаться занятым
+            limiter.release(ok=False)
+            raise
+        limiter.update_from_headers(r.headers)
+        if r.status_code < 400:
+            return r, started, estimated
+        if stream:
+            try:
+                await r.aread()
+            except asyncio.CancelledError:
+                limiter.cancel()
+                raise
+            except Exception:
+                limiter.release(ok=False)
+                raise
+            finally:
+                await r.aclose()
+        if r.status_code == 429 or r.status_code >= 500:
+            retry_after = parse_retry_after(r.headers)
+            if r.status_code == 429:
+                limiter.stats["rate_limited"] += 1
+                retry_after = retry_after or backoff_delay(attempt)
+            limiter.release(ok=False, congested=True, retry_after=retry_after)
+            if attempt < LLM_MAX_RETRIES:
+                limiter.stats["retries"] += 1
+                logger.warning(f"LLM {provider}: HTTP {r.status_code}, retry {attempt + 1}/{LLM_MAX_RETRIES}")
+                if not retry_after:
+                    await asyncio.sleep(backoff_delay(attempt))
+                continue
+            if r.status_code == 429:
+                raise LLMRateLimited(f"{provider}: rate limited after {LLM_MAX_RETRIES} retries")
+        else:
+            limiter.release(ok=False)
+        r.raise_for_status()
+    raise RuntimeError("unreachable")
+
+async def chat_completion(provider: str, url: str, api_key: str, payload: Dict[str, Any], bypass_cache: bool = False,
+                          site: str = "other", items: int = 1) -> str:
+    """POST chat/completions через пул llm с кэшем ответов; возвращает content (ошибки HTTP пробрасываются)"""
+    key = llm_cache_key(provider, payload)
+    if LLM_CACHE_ENABLED and not bypass_cache:
+        cached = llm_cache_get(key)
+        if cached is not None:
+            LLM_CACHE_STATS["hits"] += 1
+            LLM_CACHE_STATS["bytes_served"] += len(cached.encode("utf-8"))
+            return cached
+        LLM_CACHE_STATS["misses"] += 1
+    else:
+        LLM_CACHE_STATS["bypassed"] += 1
+    r, started, estimated = await llm_send(provider, url, api_key, payload)
+    limiter = provider_limiter(provider)
+    parsed = False
+    try:
+        # не-JSON ответ (HTML прокси и т.п.) или чужая структура — ошибка, но слот лимитера освобождается всегда
+        data = r.json()
+        usage = data.get("usage") or {}
+        content = data["choices"][0]["message"].get("content") or ""
+        parsed = True
+    finally:
+        latency = time.monotonic() - started
+        if parsed:
+            used = usage.get("total_tokens")
+            limiter.release(ok=True, latency=latency, tokens_estimated=estimated, tokens_used=int(used) if used else None)
+        else:
+            limiter.release(ok=False)
+    record_llm_usage(provider, payload.get("model", ""), site, usage, latency, items)
+    # пустые ответы не кэшируем; bypass обновляет запись свежим ответом
+    if LLM_CACHE_ENABLED and content.strip():
+        llm_cache_put(key, provider, payload.get("model", ""), content)
+    return content
+
+async def stream_chat_completion(provider: str, url: str, api_key: str, payload: Dict[str, Any], bypass_cache: bool = False,
+                                 site: str = "other"):
+    """То же, что chat_completion, но отдаёт текст кусками по мере генерации (stream: true, SSE провайдера).
+
+    Кэш общий с chat_completion: ключ считается по исходному payload, готовый ответ из кэша отдаётся одним куском."""
+    key = llm_cache_key(provider, payload)
+    if LLM_CACHE_ENABLED and not bypass_cache:
+        cached = llm_cache_get(key)
+        if cached is not None:
+            LLM_CACHE_STATS["hits"] += 1
+            LLM_CACHE_STATS["bytes_served"] += len(cached.encode("utf-8"))
+            yield cached
+            return
+        LLM_CACHE_STATS["misses"] += 1
+    else:
+        LLM_CACHE_STATS["bypassed"] += 1
+    limiter = provider_limiter(provider)
+    # include_usage: последний чанк несёт usage (с пустым choices)
+    streamed = dict(payload, stream=True, stream_options={"include_usage": True})
+    r, started, estimated = await llm_send(provider, url, api_key, streamed, stream=True)
+    parts: List[str] = []
+    usage: Optional[Dict[str, Any]] = None
+    complete = False
+    try:
+        async for line in r.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            chunk = line[5:].strip()
+            if chunk == "[DONE]":
+                break
+            try:
+                event = json.loads(chunk)
+                usage = event.get("usage") or usage
+                delta = (event.get("choices") or [{}])[0].get("delta", {}).get("content") or ""
+            except (ValueError, AttributeError, TypeError):
+                continue
+            if delta:
+                parts.append(delta)
+                yield delta
+        complete = True
+    finally:
+        await r.aclose()
+        if complete:
+            latency = time.monotonic() - started
+            used = (usage or {}).get("total_tokens")
+            limiter.release(ok=True, latency=latency, tokens_estimated=estimated, tokens_used=int(used) if used else None)
+            record_llm_usage(provider, payload.get("model", ""), site, usage, latency)
+        else:
+            limiter.cancel()
+    content = "".join(parts)
+    if LLM_CACHE_ENABLED and content.strip():
+        llm_cache_put(key, provider, payload.get("model", ""), content)
 
 # ---------------- LLM adapters ----------------
 OPENAI_URL = "https://api.openai.com/v1/chat/completions"
@@ -464,213 +1460,955 @@ OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")  # GPT-4o для основн
 DEEPSEEK_URL = "https://api.deepseek.com/v1/chat/completions"
 DEEPSEEK_MODEL = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
 
+def pipeline_payload(model: str, user_content: str, batch_size: int = 0) -> Dict[str, Any]:
+    """Запрос пайплайна по схеме LLM_OUTPUT_SCHEMA; batch_size > 0 — пакетный промпт на batch_size новостей"""
+    compact = LLM_OUTPUT_SCHEMA == "compact"
+    if compact:
+        system = PROMPT_COMPACT_BATCH_SYSTEM if batch_size else PROMPT_COMPACT_SYSTEM
+    else:
+        system = PROMPT_BATCH_SYSTEM if batch_size else PROMPT_SYSTEM
+    payload: Dict[str, Any] = {"model": model, "messages": [
+        {"role": "system", "content": system},
+        {"role": "user", "content": user_content}
+    ], "temperature": 0.2}
+    if compact or batch_size:
+        payload["response_format"] = {"type": "json_object"}
+    if compact:
+        # потолок ответа: ~100-150 токенов на новость в компактной схеме, с запасом; обрезанный JSON не пройдёт декодер
+        payload["max_tokens"] = LLM_COMPACT_MAX_TOKENS * max(batch_size, 1)
+    return payload
+
+def pipeline_result(provider: str, payload: Dict[str, Any], content: str, impact: int, confidence: int) -> LLMResult:
+    """Ответ на одиночный запрос пайплайна -> LLMResult; невалидный ответ удаляется из кэша"""
+    try:
+        if LLM_OUTPUT_SCHEMA == "compact":
+            return llm_result_from_compact(json.loads(content))
+        if not isinstance(parse_json_answer(content), dict):
+            # ответ без JSON: разбор по умолчанию, как и раньше, но повтор должен спросить модель заново
+            llm_cache_discard(provider, payload)
+        return llm_result_from_dict(extract_json(content), impact=impact, confidence=confidence)
+    except (ValueError, TypeError):
+        llm_cache_discard(provider, payload)  # иначе повтор получит тот же ответ из кэша
+        raise
+
 async def call_openai(text: str) -> LLMResult:
-    async with semaphore:
-        api_key = os.environ.get('OPENAI_API_KEY','')
-        if not api_key:
-            logger.warning("OpenAI API key not set, skipping OpenAI analysis")
-            return LLMResult(summary="OpenAI not configured", label="other", impact=25, confidence=50, latency="fast")
-        headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-        payload = {"model": OPENAI_MODEL, "messages": [
-            {"role":"system","content":"Return only JSON."},
-            {"role":"user","content": PROMPT_TMPL.format(text=text)}
-        ], "temperature": 0.2}
-        async with httpx.AsyncClient(timeout=60) as client:
-            try:
-                r = await client.post(OPENAI_URL, headers=headers, json=payload)
-                r.raise_for_status()
-                data = r.json()
-                content = data["choices"][0]["message"]["content"]
-            except Exception as e:
-                logger.error(f"OpenAI request failed: {e}")
-                content = "{}"
-        parsed = extract_json(content)
-        
-        # Конвертируем списки в строки если нужно
-        why_matters = parsed.get("why_matters", "")
-        if isinstance(why_matters, list):
-            why_matters = " ".join(why_matters)
-        
-        return LLMResult(
-            title_ru=parsed.get("title_ru", ""),
-            summary=parsed.get("summary", ""),
-            label=parsed.get("label", "other"),
-            impact=int(parsed.get("impact", 25)),
-            confidence=int(parsed.get("confidence", 50)),
-            sentiment=int(parsed.get("sentiment", 0)),
-            region=parsed.get("region", "US"),
-            tickers=parsed.get("tickers", []),
-            what=parsed.get("what", ""),
-            why_matters=why_matters,
-            action_window=parsed.get("action_window", ">1w"),
-            analysis=parsed.get("analysis", ""),
-            latency="fast"
-        )
+    api_key = os.environ.get('OPENAI_API_KEY','')
+    if not api_key:
+        logger.warning("OpenAI API key not set, skipping OpenAI analysis")
+        return LLMResult(summary="OpenAI not configured", label="other", impact=25, confidence=50, latency="fast")
+    payload = pipeline_payload(OPENAI_MODEL, PROMPT_USER_TMPL.format(text=text))
+    try:
+        content = await chat_completion("openai", OPENAI_URL, api_key, payload, site="analyze")
+    except Exception as e:
+        # ошибка — не анализ: не превращаем её в сигнал "other/impact 25"
+        logger.error(f"OpenAI request failed: {e}")
+        raise
+    return pipeline_result("openai", payload, content, impact=25, confidence=50)
 
 async def call_deepseek(text: str) -> LLMResult:
-    async with semaphore:
-        api_key = os.environ.get('DEEPSEEK_API_KEY','')
-        if not api_key:
-            logger.warning("DeepSeek API key not set, skipping DeepSeek analysis")
-            return LLMResult(summary="DeepSeek not configured", label="other", impact=35, confidence=60, latency="fast")
-        headers = {"Authorization": f"Bearer {api_key}", "Content-Type":"application/json"}
-        payload = {"model": DEEPSEEK_MODEL, "messages": [
-            {"role":"system","content":"Return only JSON."},
-            {"role":"user","content": PROMPT_TMPL.format(text=text)}
-        ], "temperature": 0.2, "stream": False}
-        async with httpx.AsyncClient(timeout=60) as client:
-            try:
-                r = await client.post(DEEPSEEK_URL, headers=headers, json=payload)
-                r.raise_for_status()
-                data = r.json()
-                content = data["choices"][0]["message"].get("content") or ""
-            except Exception as e:
-                logger.error(f"DeepSeek request failed: {e}")
-                content = "{}"
-        parsed = extract_json(content)
-        
-        # Конвертируем списки в строки если нужно
-        why_matters = parsed.get("why_matters", "")
-        if isinstance(why_matters, list):
-            why_matters = " ".join(why_matters)
-        
-        return LLMResult(
-            title_ru=parsed.get("title_ru", ""),
-            summary=parsed.get("summary", ""),
-            label=parsed.get("label", "other"),
-            impact=int(parsed.get("impact", 35)),
-            confidence=int(parsed.get("confidence", 60)),
-            sentiment=int(parsed.get("sentiment", 0)),
-            region=parsed.get("region", "US"),
-            tickers=parsed.get("tickers", []),
-            what=parsed.get("what", ""),
-            why_matters=why_matters,
-            action_window=parsed.get("action_window", ">1w"),
-            analysis=parsed.get("analysis", ""),
-            latency="fast"
+    api_key = os.environ.get('DEEPSEEK_API_KEY','')
+    if not api_key:
+        logger.warning("DeepSeek API key not set, skipping DeepSeek analysis")
+        return LLMResult(summary="DeepSeek not configured", label="other", impact=35, confidence=60, latency="fast")
+    payload = pipeline_payload(DEEPSEEK_MODEL, PROMPT_USER_TMPL.format(text=text))
+    try:
+        content = await chat_completion("deepseek", DEEPSEEK_URL, api_key, payload, site="analyze")
+    except Exception as e:
+        # ошибка — не анализ: не превращаем её в сигнал "other/impact 35"
+        logger.error(f"DeepSeek request failed: {e}")
+        raise
+    return pipeline_result("deepseek", payload, content, impact=35, confidence=60)
+
+ALL_PROVIDERS = {"openai": call_openai, "deepseek": call_deepseek}
+# По умолчанию только OpenAI для качественного анализа; LLM_PROVIDERS=openai,deepseek — для hedged/quorum
+PROVIDERS = {name: ALL_PROVIDERS[name] for name in os.getenv("LLM_PROVIDERS", "openai").split(",") if name in ALL_PROVIDERS} or {"openai": call_openai}
+
+# Пакетный режим: несколько новостей в одном запросе, инструкции отправляются один раз.
+# Размер пакета ограничен и числом новостей, и оценкой токенов (вход + ожидаемый ответ).
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "8"))
+LLM_BATCH_MAX_TOKENS = int(os.getenv("LLM_BATCH_MAX_TOKENS", "12000"))
+LLM_BATCH_OUTPUT_TOKENS = int(os.getenv("LLM_BATCH_OUTPUT_TOKENS", "700"))  # ответ на одну новость (схема full)
+
+def estimate_tokens(text: str) -> int:
+    # грубо: ~3 символа на токен для смеси русского и английского
+    return len(text) // 3 + 1
+
+async def _call_batch(name: str, url: str, api_key: str, model: str, texts: Dict[str, str],
+                      site: str = "analyze_batch") -> Dict[str, LLMResult]:
+    """Один запрос на пакет; возвращает только прошедшие проверку результаты (id -> LLMResult)"""
+    if not api_key or not texts:
+        return {}
+    keys = {str(i + 1): item_id for i, item_id in enumerate(texts)}
+    payload = pipeline_payload(model, build_batch_prompt([(key, texts[item_id]) for key, item_id in keys.items()]), batch_size=len(texts))
+    try:
+        content = await chat_completion(name.lower(), url, api_key, payload, site=site, items=len(texts))
+    except LLMRateLimited:
+        raise  # по одной повторять бессмысленно — провайдер и так перегружен
+    except Exception as e:
+        logger.error(f"{name} batch request failed ({len(texts)} items): {e}")
+        return {}
+    out: Dict[str, LLMResult] = {}
+    for key, parsed in extract_json_items(content).items():
+        item_id = keys.get(key)
+        if not item_id or item_id in out:
+            continue
+        try:
+            if LLM_OUTPUT_SCHEMA == "compact":
+                out[item_id] = llm_result_from_compact(parsed)
+            elif parsed.get("summary") and parsed.get("label") is not None:
+                out[item_id] = llm_result_from_dict(parsed)
+        except (ValueError, TypeError) as e:
+            logger.warning(f"{name} batch: invalid result for item {key}: {e}")
+    if len(out) < len(keys):
+        # частично битый пакет не кэшируем: повтор того же пакета спросит модель заново
+        llm_cache_discard(name.lower(), payload)
+    return out
+
+async def call_openai_batch(texts: Dict[str, str]) -> Dict[str, LLMResult]:
+    return await _call_batch("OpenAI", OPENAI_URL, os.environ.get('OPENAI_API_KEY', ''), OPENAI_MODEL, texts)
+
+async def call_deepseek_batch(texts: Dict[str, str]) -> Dict[str, LLMResult]:
+    return await _call_batch("DeepSeek", DEEPSEEK_URL, os.environ.get('DEEPSEEK_API_KEY', ''), DEEPSEEK_MODEL, texts)
+
+BATCH_PROVIDERS = {"openai": call_openai_batch, "deepseek": call_deepseek_batch}
+
+# ---------------- Execution policies ----------------
+# Как опрашивать провайдеры из PROVIDERS:
+#   all    — ждём всех (как раньше), хвост задержки определяет самый медленный;
+#   hedged — запускаем первого, второго подключаем, если первый не ответил за свой p90, берём первый валидный ответ;
+#   quorum — запускаем всех и возвращаемся, как только k провайдеров сошлись в label и диапазоне impact.
+# p90 берётся из гистограмм задержек по провайдерам (отдельно для одиночных и пакетных запросов).
+LLM_POLICY = os.getenv("LLM_POLICY", "all")
+LLM_QUORUM = int(os.getenv("LLM_QUORUM", "2"))
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.9"))
+LLM_HEDGE_DEFAULT_DELAY_S = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY_S", "15"))
+LLM_HEDGE_MIN_SAMPLES = 20
+IMPACT_BAND = 25  # 0-24, 25-49, 50-74, 75-100
+
+class LatencyHistogram:
+    """Гистограмма задержек с логарифмическими корзинами (0.1 с … ~200 с)"""
+    BOUNDS = [round(0.1 * 1.5 ** i, 3) for i in range(20)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.total = 0
+
+    def record(self, seconds: float):
+        for i, bound in enumerate(self.BOUNDS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.total:
+            return None
+        target, seen = q * self.total, 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self.BOUNDS[min(i, len(self.BOUNDS) - 1)]
+        return self.BOUNDS[-1]
+
+    def report(self) -> Dict[str, Any]:
+        return {"count": self.total, "p50": self.quantile(0.5), "p90": self.quantile(0.9), "p99": self.quantile(0.99)}
+
+LLM_LATENCY: Dict[Tuple[str, str], LatencyHistogram] = {}
+
+def latency_histogram(provider: str, kind: str) -> LatencyHistogram:
+    return LLM_LATENCY.setdefault((provider, kind), LatencyHistogram())
+
+def hedge_delay(provider: str, kind: str) -> float:
+    hist = latency_histogram(provider, kind)
+    if hist.total < LLM_HEDGE_MIN_SAMPLES:
+        return LLM_HEDGE_DEFAULT_DELAY_S
+    return hist.quantile(LLM_HEDGE_QUANTILE) or LLM_HEDGE_DEFAULT_DELAY_S
+
+ProviderResults = Dict[str, Union[LLMResult, BaseException]]  # item_id -> результат одного провайдера
+
+def _has_valid(res: ProviderResults) -> bool:
+    return any(isinstance(r, LLMResult) for r in res.values())
+
+def _quorum_reached(by_provider: Dict[str, ProviderResults], item_ids: List[str]) -> bool:
+    from collections import Counter
+    for item_id in item_ids:
+        votes = Counter(
+            (r.label, min(r.impact, 99) // IMPACT_BAND)
+            for res in by_provider.values()
+            for r in [res.get(item_id)] if isinstance(r, LLMResult)
         )
+        if not votes or votes.most_common(1)[0][1] < LLM_QUORUM:
+            return False
+    return True
 
-PROVIDERS = {"openai": call_openai}  # Только OpenAI для качественного анализа
+async def run_providers(make_call, item_ids: List[str], kind: str) -> Dict[str, ProviderResults]:
+    """Опрашивает PROVIDERS согласно LLM_POLICY; make_call(name) -> {item_id: LLMResult | exception}"""
+    names = list(PROVIDERS)
 
-# ---------------- Ingest ----------------
-async def is_rss_available(url: str) -> bool:
-    async with httpx.AsyncClient(follow_redirects=True, timeout=10) as client:
+    async def timed(name: str) -> ProviderResults:
+        started = time.monotonic()
         try:
-            r = await client.get(url, headers={"User-Agent": "Mozilla/5.0"})
-            if r.status_code != 200:
-                return False
-            text = (r.text or "").strip()
-            ct = (r.headers.get("Content-Type") or "").lower()
-            if ("xml" in ct) or ("rss" in ct) or text.startswith(("<?xml", "<rss", "<feed")):
-                return True
-            # Fallback: иногда Content-Type = text/html, но внутри RSS
-            parsed = feedparser.parse(text)
-            return bool(parsed.entries)
+            res = await make_call(name)
+        except asyncio.CancelledError:
+            # отменённый медленный запрос — нижняя оценка его задержки, тоже учитываем
+            latency_histogram(name, kind).record(time.monotonic() - started)
+            raise
         except Exception as e:
-            logger.warning("is_rss_available error for %s: %s", url, e)
-            return False
+            return {item_id: e for item_id in item_ids}
+        if _has_valid(res):
+            latency_histogram(name, kind).record(time.monotonic() - started)
+        return res
+
+    if LLM_POLICY not in ("hedged", "quorum") or len(names) == 1:
+        return dict(zip(names, await asyncio.gather(*[timed(name) for name in names])))
+
+    results: Dict[str, ProviderResults] = {}
+    tasks: Dict[asyncio.Task, str] = {}
+    waiting = list(names)
+
+    def launch():
+        name = waiting.pop(0)
+        tasks[asyncio.create_task(timed(name))] = name
+
+    launch()
+    if LLM_POLICY == "quorum":
+        while waiting:
+            launch()
+    try:
+        while tasks:
+            timeout = None
+            if LLM_POLICY == "hedged" and waiting:
+                timeout = hedge_delay(list(tasks.values())[-1], kind)
+            done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                logger.info(f"LLM HEDGE: {list(tasks.values())} slower than p{int(LLM_HEDGE_QUANTILE * 100)}, launching {waiting[0]}")
+                launch()
+                continue
+            for task in done:
+                results[tasks.pop(task)] = task.result()
+            if LLM_POLICY == "hedged":
+                winner = next((name for name, res in results.items() if _has_valid(res)), None)
+                if winner:
+                    return {winner: results[winner]}
+                if waiting and not tasks:
+                    launch()  # первый провайдер упал — сразу запускаем следующий
+            elif _quorum_reached(results, item_ids):
+                return results
+        return results
+    finally:
+        for task in tasks:
+            task.cancel()
+
+# ---------------- Parsing pool ----------------
+# feedparser и HTML-экстракторы — тяжёлый синхронный CPU: выполняем вне event loop, чтобы API не замирал
+# thread имеет смысл только для парсеров, отпускающих GIL (lxml); feedparser/html.parser — чистый Python
+PARSE_EXECUTOR = os.getenv("PARSE_EXECUTOR", "process")  # process | thread
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+PARSE_QUEUE_LIMIT = int(os.getenv("PARSE_QUEUE_LIMIT", str(PARSE_WORKERS * 4)))
+PARSE_MAX_ENTRIES = 50  # больше из одного фида не используем
+
+def parse_feed_bytes(body: bytes) -> List[Dict[str, Any]]:
+    """Парсит фид и возвращает записи простыми dict (пригодно для передачи между процессами)"""
+    feed = feedparser.parse(body)
+    entries = []
+    for e in feed.entries[:PARSE_MAX_ENTRIES]:
+        published_parsed = e.get("published_parsed")
+        updated_parsed = e.get("updated_parsed")
+        entries.append({
+            "id": e.get("id"),
+            "link": e.get("link"),
+            "title": e.get("title"),
+            "published": e.get("published"),
+            "updated": e.get("updated"),
+            "published_parsed": tuple(published_parsed) if published_parsed else None,
+            "updated_parsed": tuple(updated_parsed) if updated_parsed else None,
+            "raw": {k: str(e.get(k)) for k in RAW_INGEST_FIELDS if e.get(k)},
+        })
+    return entries
+
+# Потоковый парсер: читаем фид кусками и останавливаемся, как только набрали нужное
+FEED_MAX_ENTRIES = int(os.getenv("FEED_MAX_ENTRIES", "10"))
+FEED_MAX_BYTES = int(os.getenv("FEED_MAX_BYTES", str(2 * 1024 * 1024)))
+FEED_HASH_BYTES = 64 * 1024  # хешируем «голову» фида: новые записи всегда наверху
+
+def _parse_feed_date(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        dt = parsedate_to_datetime(value)  # RSS: RFC 822
+    except (TypeError, ValueError, IndexError):
+        try:
+            dt = datetime.fromisoformat(value.replace("Z", "+00:00"))  # Atom: ISO 8601
+        except ValueError:
+            return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+class FeedStreamParser:
+    """Инкрементальный RSS/Atom парсер поверх lxml.XMLPullParser с ранней остановкой.
+
+    Останавливается, когда набрано max_entries записей, встретилась запись старше cutoff
+    или уже обработанная (last_guid). Если документ не похож на фид — not_feed=True,
+    и вызывающий код откатывается на feedparser.
+    """
 
-async def parse_html_news(url: str) -> List[Dict[str, Any]]:
-    async with httpx.AsyncClient(follow_redirects=True, timeout=15) as client:
+    FEED_ROOTS = {"rss", "feed", "RDF"}
+    ENTRY_TAGS = {"item", "entry"}
+
+    def __init__(self, max_entries: int, cutoff: Optional[datetime] = None, last_guid: Optional[str] = None):
+        self.max_entries = max_entries
+        self.cutoff = cutoff
+        self.last_guid = last_guid
+        self.entries: List[Dict[str, Any]] = []
+        self.done = False
+        self.not_feed = False
+        self._root_seen = False
+        self._parser = etree.XMLPullParser(events=("start", "end"), recover=True,
+                                           resolve_entities=False, no_network=True)
+
+    def feed(self, chunk: bytes) -> bool:
+        """Скармливает очередной кусок; True — дальше читать не нужно"""
+        if self.done:
+            return True
         try:
-            r = await client.get(url, headers={"User-Agent": "Mozilla/5.0"})
-            r.raise_for_status()
-            soup = BeautifulSoup(r.text, "html.parser")
-            news = []
-            for item in soup.select("article, .news-item, .post, .news, li"):
-                h = item.select_one("h1, h2, h3, .title, a")
-                title_text = (h.get_text(strip=True) if h else item.get_text(strip=True))[:200]
-                a = item.select_one("a")
-                href = a.get("href") if a and a.has_attr("href") else ""
-                if isinstance(href, list):
-                    href = href[0] if href else ""
-                href = str(href)
-                link = urljoin(str(url), href) if href else str(url)
-                if title_text and link:
-                    sector_guess = "ukraine" if any(d in url for d in
-                        ["mof.gov.ua","bank.gov.ua","naftogaz","ux.ua","president.gov.ua","nssmc.gov.ua"]) else \
-                                   ("russia" if any(d in url for d in ["minfin.gov.ru","moex.com","cbr.ru"]) else "ukraine")
-                    uid = hash_id((link or title_text) + "html")
-                    news.append({
-                        "id": uid, "sector": sector_guess, "title": title_text,
-                        "link": link, "ts_utc": datetime.now(timezone.utc).isoformat(), "source": url
-                    })
-            return news[:50]
+            self._parser.feed(chunk)
+        except etree.XMLSyntaxError:
+            self.not_feed = not self.entries
+            self.done = True
+            return True
+        self._drain()
+        return self.done
+
+    def close(self) -> List[Dict[str, Any]]:
+        if not self.done:
+            try:
+                self._parser.close()
+                self._drain()
+            except etree.XMLSyntaxError:
+                pass
+        if not self._root_seen:
+            self.not_feed = True
+        return self.entries
+
+    def _drain(self):
+        for event, el in self._parser.read_events():
+            if self.done:
+                return
+            if not isinstance(el.tag, str):
+                continue  # комментарии / processing instructions
+            name = etree.QName(el).localname
+            if event == "start":
+                if not self._root_seen:
+                    self._root_seen = True
+                    if name not in self.FEED_ROOTS:
+                        self.not_feed = True
+                        self.done = True
+                continue
+            if name not in self.ENTRY_TAGS:
+                continue
+            entry = self._entry(el)
+            # Освобождаем память: разобранные записи больше не нужны
+            el.clear()
+            parent = el.getparent()
+            while parent is not None and el.getprevious() is not None:
+                del parent[0]
+            guid = entry["id"] or entry["link"]
+            if self.last_guid and guid == self.last_guid:
+                self.done = True
+                return
+            pub = _parse_feed_date(entry["published"] or entry["updated"])
+            if pub and self.cutoff and pub < self.cutoff:
+                self.done = True
+                return
+            if pub:
+                entry["published_parsed" if entry["published"] else "updated_parsed"] = tuple(pub.timetuple())
+            self.entries.append(entry)
+            if len(self.entries) >= self.max_entries:
+                self.done = True
+                return
+
+    @staticmethod
+    def _entry(el) -> Dict[str, Any]:
+        fields: Dict[str, str] = {}
+        link = ""
+        for child in el:
+            if not isinstance(child.tag, str):
+                continue
+            name = etree.QName(child).localname
+            if name == "link":
+                # Atom: <link rel="alternate" href="..."/>, RSS: <link>...</link>
+                href = child.get("href")
+                if href and child.get("rel", "alternate") == "alternate" and not link:
+                    link = href
+                elif not href and child.text and not link:
+                    link = child.text.strip()
+                continue
+            if name not in fields and (child.text or "").strip():
+                fields[name] = child.text.strip()
+        entry = {
+            "id": fields.get("guid") or fields.get("id"),
+            "link": link,
+            "title": fields.get("title", ""),
+            "published": fields.get("pubDate") or fields.get("published") or fields.get("date"),
+            "updated": fields.get("updated"),
+            "published_parsed": None,
+            "updated_parsed": None,
+        }
+        raw = {
+            "id": entry["id"], "link": link, "title": entry["title"],
+            "published": entry["published"], "updated": entry["updated"],
+            "summary": (fields.get("description") or fields.get("summary") or "")[:2000],
+            "author": fields.get("author") or fields.get("creator"),
+        }
+        entry["raw"] = {k: v for k, v in raw.items() if k in RAW_INGEST_FIELDS and v}
+        return entry
+
+class ParsePool:
+    """Пул процессов (или потоков) для парсинга с ограниченной очередью задач"""
+
+    def __init__(self):
+        self._executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._loop = None
+        self.stats = {"tasks": 0, "failed": 0, "busy_s": 0.0}
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if PARSE_EXECUTOR == "thread":
+                self._executor = ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix="parse")
+            else:
+                self._executor = ProcessPoolExecutor(max_workers=PARSE_WORKERS)
+            logger.info("Parse pool started: %s x%d", PARSE_EXECUTOR, PARSE_WORKERS)
+        return self._executor
+
+    async def run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._slots = asyncio.Semaphore(PARSE_QUEUE_LIMIT)
+            self._loop = loop
+        assert self._slots is not None
+        # Ограничиваем число задач в очереди пула: лишние ждут здесь, не раздувая память executor'а
+        async with self._slots:
+            started = time.monotonic()
+            try:
+                return await loop.run_in_executor(self._get_executor(), fn, *args)
+            except BrokenExecutor:
+                # Воркер упал (OOM/segfault в парсере) — пересоздадим пул при следующем вызове
+                self.stats["failed"] += 1
+                self._executor = None
+                raise
+            finally:
+                self.stats["tasks"] += 1
+                self.stats["busy_s"] += time.monotonic() - started
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+parse_pool = ParsePool()
+
+# ---------------- HTML scrape adapters ----------------
+# Источники без RSS: per-site XPath-экстракторы поверх lxml.html (C-парсер, на порядок быстрее html.parser).
+# Ключ — домен без www (как в extract_domain). Страница из SECTOR_FEEDS, которая отдаёт HTML,
+# разбирается адаптером своего домена; записи идут по тому же пути, что и RSS.
+SCRAPE_ADAPTERS: Dict[str, Dict[str, Any]] = {
+    "cftc.gov": {
+        "item": "//div[contains(@class,'views-row')] | //table[contains(@class,'views-table')]//tr[td]",
+        "link": ".//a[contains(@href,'/PressRoom/PressReleases/')][1]",
+        "date": ".//time/@datetime | .//*[contains(@class,'date')]//text()",
+    },
+    "opec.org": {
+        "item": "//div[contains(@class,'article')] | //ul[contains(@class,'press')]/li",
+        "link": ".//a[contains(@href,'/press')][1]",
+        "date": ".//*[contains(@class,'date')]//text()",
+    },
+    "lbma.org.uk": {
+        "item": "//article | //div[contains(@class,'news-item')]",
+        "link": ".//a[contains(@href,'/news')][1]",
+        "date": ".//time/@datetime | .//*[contains(@class,'date')]//text()",
+    },
+}
+SCRAPE_MAX_ITEMS = 20
+SCRAPE_DATE_FORMATS = ("%B %d, %Y", "%b %d, %Y", "%d %B %Y", "%d %b %Y", "%m/%d/%Y", "%d.%m.%Y", "%Y-%m-%d")
+
+def _parse_scraped_date(value: str) -> Optional[datetime]:
+    value = " ".join((value or "").split())
+    if not value:
+        return None
+    dt = _parse_feed_date(value)
+    if dt:
+        return dt
+    for fmt in SCRAPE_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).replace(tzinfo=timezone.utc)
+        except ValueError:
+            continue
+    return None
+
+def scrape_html(domain: str, body: bytes, url: str, last_guid: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Извлекает новости со страницы адаптером домена; останавливается на уже виденной ссылке"""
+    adapter = SCRAPE_ADAPTERS[domain]
+    doc = lxml.html.fromstring(body, base_url=url)
+    doc.make_links_absolute(url, resolve_base_href=True)
+    entries: List[Dict[str, Any]] = []
+    seen = set()
+    for node in doc.xpath(adapter["item"]):
+        links = node.xpath(adapter["link"])
+        if not links:
+            continue
+        a = links[0]
+        link = (a.get("href") or "").split("#")[0]
+        title = " ".join(a.text_content().split())[:200]
+        if not link or not title or link in seen:
+            continue
+        if last_guid and link == last_guid:
+            break
+        seen.add(link)
+        published = None
+        if adapter.get("date"):
+            for value in node.xpath(adapter["date"]):
+                dt = _parse_scraped_date(str(value))
+                if dt:
+                    published = dt
+                    break
+        entries.append({
+            "id": link,
+            "link": link,
+            "title": title,
+            "published": published.isoformat() if published else None,
+            "updated": None,
+            "published_parsed": tuple(published.timetuple()) if published else None,
+            "updated_parsed": None,
+            "raw": {"id": link, "link": link, "title": title, "published": published.isoformat() if published else None},
+        })
+        if len(entries) >= SCRAPE_MAX_ITEMS:
+            break
+    return entries
+
+# ---------------- Ingest ----------------
+FEED_HEADERS = {"User-Agent": "Mozilla/5.0"}
+# Параллельная загрузка фидов: общий лимит и лимит на один хост
+INGEST_MAX_CONCURRENCY = int(os.getenv("INGEST_MAX_CONCURRENCY", "20"))
+INGEST_PER_HOST_CONCURRENCY = int(os.getenv("INGEST_PER_HOST_CONCURRENCY", "2"))
+
+def looks_like_feed(text: str, content_type: str) -> bool:
+    """Быстрая проверка по заголовкам/началу тела, что ответ — RSS/Atom"""
+    ct = (content_type or "").lower()
+    head = (text or "").lstrip()[:200]
+    return ("xml" in ct) or ("rss" in ct) or head.startswith(("<?xml", "<rss", "<feed"))
+
+def load_feed_states(conn, urls: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Загружает сохранённое состояние фидов (ETag, Last-Modified, хеш, водяной знак)"""
+    states: Dict[str, Dict[str, Any]] = {}
+    rows = conn.execute(
+        "SELECT url, etag, last_modified, body_hash, last_guid, last_published FROM feed_state"
+    ).fetchall()
+    wanted = set(urls)
+    for r in rows:
+        if r[0] in wanted:
+            states[r[0]] = {"etag": r[1], "last_modified": r[2], "body_hash": r[3],
+                            "last_guid": r[4], "last_published": r[5]}
+    return states
+
+def save_feed_state(conn, url: str, state: Dict[str, Any], changed: bool):
+    now = datetime.now(timezone.utc).isoformat()
+    safe_execute(conn, """INSERT INTO feed_state(url, etag, last_modified, body_hash, last_guid, last_published, checked_at, changed_at)
+        VALUES(?,?,?,?,?,?,?,?)
+        ON CONFLICT(url) DO UPDATE SET
+            etag=excluded.etag, last_modified=excluded.last_modified, body_hash=excluded.body_hash,
+            last_guid=excluded.last_guid, last_published=excluded.last_published,
+            checked_at=excluded.checked_at, changed_at=COALESCE(excluded.changed_at, feed_state.changed_at)""",
+        (url, state.get("etag"), state.get("last_modified"), state.get("body_hash"),
+         state.get("last_guid"), state.get("last_published"), now, now if changed else None))
+
+# Адаптивный опрос: частые фиды чаще, тихие реже, с джиттером и backoff при ошибках
+POLL_MIN_MINUTES = float(os.getenv("POLL_MIN_MINUTES", "10"))
+POLL_MAX_MINUTES = float(os.getenv("POLL_MAX_MINUTES", "360"))
+POLL_DEFAULT_MINUTES = float(os.getenv("POLL_DEFAULT_MINUTES", "60"))
+POLL_TARGET_ITEMS = float(os.getenv("POLL_TARGET_ITEMS", "3"))  # сколько новых записей ждём за один опрос
+POLL_JITTER = float(os.getenv("POLL_JITTER", "0.15"))
+POLL_RATE_ALPHA = 0.3  # вес нового наблюдения в EWMA скорости публикаций
+
+def next_poll_interval(rate_per_hour: Optional[float], fail_count: int) -> float:
+    """Интервал до следующего опроса (секунды) по выученной скорости публикаций фида"""
+    if rate_per_hour is None:
+        minutes = POLL_DEFAULT_MINUTES
+    elif rate_per_hour > 0:
+        minutes = POLL_TARGET_ITEMS / rate_per_hour * 60
+    else:
+        minutes = POLL_MAX_MINUTES
+    minutes = min(max(minutes, POLL_MIN_MINUTES), POLL_MAX_MINUTES)
+    if fail_count:
+        minutes = min(minutes * (2 ** min(fail_count, 6)), POLL_MAX_MINUTES)
+    return minutes * 60 * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+
+def schedule_next_poll(conn, url: str, new_items: int, failed: bool):
+    """Обновляет EWMA скорости публикаций фида и время следующего опроса"""
+    now = datetime.now(timezone.utc)
+    row = conn.execute("SELECT rate_per_hour, last_poll_at, fail_count FROM feed_state WHERE url=?", (url,)).fetchone()
+    rate, last_poll_at, fail_count = (row[0], row[1], row[2] or 0) if row else (None, None, 0)
+    if failed:
+        fail_count += 1
+    else:
+        fail_count = 0
+        hours = POLL_DEFAULT_MINUTES / 60
+        if last_poll_at:
+            try:
+                hours = max((now - datetime.fromisoformat(last_poll_at)).total_seconds() / 3600, 1 / 60)
+            except ValueError:
+                pass
+        observed = new_items / hours
+        rate = observed if rate is None else POLL_RATE_ALPHA * observed + (1 - POLL_RATE_ALPHA) * rate
+    interval = next_poll_interval(rate, fail_count)
+    safe_execute(conn, """INSERT INTO feed_state(url, rate_per_hour, poll_interval_s, next_poll_at, last_poll_at, fail_count)
+        VALUES(?,?,?,?,?,?)
+        ON CONFLICT(url) DO UPDATE SET
+            rate_per_hour=excluded.rate_per_hour, poll_interval_s=excluded.poll_interval_s,
+            next_poll_at=excluded.next_poll_at, last_poll_at=excluded.last_poll_at, fail_count=excluded.fail_count""",
+        (url, rate, interval, (now + timedelta(seconds=interval)).isoformat(), now.isoformat(), fail_count))
+
+# Circuit breaker: после N ошибок подряд фид пропускается, повторная проба с экспоненциальной паузой
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "3"))
+CIRCUIT_BASE_MINUTES = float(os.getenv("CIRCUIT_BASE_MINUTES", "15"))
+CIRCUIT_MAX_MINUTES = float(os.getenv("CIRCUIT_MAX_MINUTES", "1440"))
+
+def load_open_circuits(conn) -> Dict[str, str]:
+    """URL -> circuit_open_until для фидов, которые сейчас нельзя опрашивать"""
+    now = datetime.now(timezone.utc)
+    out = {}
+    for url, until in conn.execute("SELECT url, circuit_open_until FROM feed_health WHERE circuit_open_until IS NOT NULL"):
+        try:
+            if datetime.fromisoformat(until) > now:
+                out[url] = until
+        except ValueError:
+            continue
+    return out
+
+def record_feed_health(conn, res: Dict[str, Any]):
+    """Записывает результат опроса фида и открывает/закрывает circuit breaker"""
+    now = datetime.now(timezone.utc)
+    ok = not res["error"] and res["status"] in (200, 304)
+    latency_ms = round(res.get("elapsed", 0.0) * 1000, 1)
+    row = conn.execute("SELECT consecutive_failures, avg_latency_ms FROM feed_health WHERE url=?", (res["url"],)).fetchone()
+    failures, avg_latency = (row[0] or 0, row[1]) if row else (0, None)
+    avg_latency = latency_ms if avg_latency is None else round(0.8 * avg_latency + 0.2 * latency_ms, 1)
+    open_until = None
+    if ok:
+        failures = 0
+    else:
+        failures += 1
+        if failures >= CIRCUIT_FAILURE_THRESHOLD:
+            minutes = min(CIRCUIT_BASE_MINUTES * (2 ** (failures - CIRCUIT_FAILURE_THRESHOLD)), CIRCUIT_MAX_MINUTES)
+            open_until = (now + timedelta(minutes=minutes)).isoformat()
+            logger.warning("CIRCUIT OPEN: %s | failures=%d | re-probe in %.0f min", res["url"], failures, minutes)
+    error = res["error"] or (None if ok else f"HTTP {res['status']}")
+    safe_execute(conn, """INSERT INTO feed_health(url, sector, last_status, last_error, last_latency_ms, avg_latency_ms, last_entries,
+            consecutive_failures, total_ok, total_fail, last_ok_at, last_checked_at, circuit_open_until)
+        VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?)
+        ON CONFLICT(url) DO UPDATE SET
+            sector=excluded.sector, last_status=excluded.last_status, last_error=excluded.last_error,
+            last_latency_ms=excluded.last_latency_ms, avg_latency_ms=excluded.avg_latency_ms,
+            last_entries=excluded.last_entries, consecutive_failures=excluded.consecutive_failures,
+            total_ok=feed_health.total_ok + excluded.total_ok, total_fail=feed_health.total_fail + excluded.total_fail,
+            last_ok_at=COALESCE(excluded.last_ok_at, feed_health.last_ok_at),
+            last_checked_at=excluded.last_checked_at, circuit_open_until=excluded.circuit_open_until""",
+        (res["url"], res["sector"], res["status"], error, latency_ms, avg_latency, len(res["entries"]),
+         failures, 1 if ok else 0, 0 if ok else 1, now.isoformat() if ok else None, now.isoformat(), open_until))
+
+def entry_published(e) -> Optional[datetime]:
+    parsed = e.get("published_parsed") or e.get("updated_parsed")
+    return datetime(*parsed[:6], tzinfo=timezone.utc) if parsed else None
+
+async def fetch_feed(client: httpx.AsyncClient, sector: str, url: str, state: Dict[str, Any],
+                     global_sem: asyncio.Semaphore, host_sems: Dict[str, asyncio.Semaphore]) -> Dict[str, Any]:
+    """Скачивает фид один раз (conditional GET) и парсит его из того же ответа"""
+    host = extract_domain(url)
+    host_sem = host_sems.setdefault(host, asyncio.Semaphore(INGEST_PER_HOST_CONCURRENCY))
+    result: Dict[str, Any] = {"sector": sector, "url": url, "status": None, "entries": [], "error": None,
+                              "unchanged": False, "state": dict(state)}
+    headers = dict(FEED_HEADERS)
+    if state.get("etag"):
+        headers["If-None-Match"] = state["etag"]
+    if state.get("last_modified"):
+        headers["If-Modified-Since"] = state["last_modified"]
+    # Ранняя остановка: записи старше начала текущих суток (UTC) или старше водяного знака нам не нужны
+    cutoff = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    if state.get("last_published"):
+        try:
+            cutoff = max(cutoff, datetime.fromisoformat(state["last_published"]))
+        except ValueError:
+            pass
+    async with global_sem, host_sem:
+        started = time.monotonic()
+        try:
+            async with client.stream("GET", url, headers=headers) as r:
+                result["status"] = r.status_code
+                if r.status_code != 200:
+                    # Дочитываем (обычно пустое) тело, чтобы соединение вернулось в keep-alive пул
+                    await r.aread()
+                if r.status_code == 304:
+                    result["unchanged"] = True
+                elif r.status_code == 200:
+                    result["state"]["etag"] = r.headers.get("ETag")
+                    result["state"]["last_modified"] = r.headers.get("Last-Modified")
+                    await read_feed_stream(r, state, result, cutoff)
         except Exception as e:
-            logger.error(f"Error parsing {url}: {e}")
-            return []
+            result["error"] = str(e)
+        result["elapsed"] = time.monotonic() - started
+    return result
+
+async def read_feed_stream(r: httpx.Response, state: Dict[str, Any], result: Dict[str, Any], cutoff: datetime):
+    """Читает тело кусками: сверяет хеш «головы», парсит потоково, останавливается как только хватит"""
+    parser = FeedStreamParser(FEED_MAX_ENTRIES, cutoff=cutoff, last_guid=state.get("last_guid"))
+    chunks = r.aiter_bytes()
+    consumed: List[bytes] = []
+    head = b""
+    total = 0
+
+    async for chunk in chunks:
+        consumed.append(chunk)
+        total += len(chunk)
+        head += chunk
+        if len(head) >= FEED_HASH_BYTES:
+            break
+    is_feed = looks_like_feed(head[:200].decode("latin-1"), r.headers.get("Content-Type", ""))
+
+    if is_feed:
+        body_hash = hashlib.sha256(head[:FEED_HASH_BYTES]).hexdigest()
+        if body_hash == state.get("body_hash"):
+            # Сервер не поддерживает conditional GET, но начало фида не изменилось
+            result["unchanged"] = True
+            return
+        result["state"]["body_hash"] = body_hash
+        if not parser.feed(head):
+            async for chunk in chunks:
+                consumed.append(chunk)
+                total += len(chunk)
+                if parser.feed(chunk):
+                    break
+                if total >= FEED_MAX_BYTES:
+                    logger.info("Feed truncated at %d bytes: %s", total, result["url"])
+                    break
+        result["entries"] = parser.close()
+        result["bytes_read"] = total
+        if not parser.not_feed:
+            return
 
-async def ingest_once(sectors: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    # HTML-страница или битый XML: дочитываем тело целиком (до FEED_MAX_BYTES)
+    if total < FEED_MAX_BYTES:
+        async for chunk in chunks:
+            consumed.append(chunk)
+            total += len(chunk)
+            if total >= FEED_MAX_BYTES:
+                logger.info("Page truncated at %d bytes: %s", total, result["url"])
+                break
+    result["bytes_read"] = total
+    body = b"".join(consumed)
+    if not is_feed:
+        # У HTML «голова» — навигация и шапка, поэтому хешируем всю страницу
+        body_hash = hashlib.sha256(body).hexdigest()
+        if body_hash == state.get("body_hash"):
+            result["unchanged"] = True
+            return
+        result["state"]["body_hash"] = body_hash
+    host = extract_domain(result["url"])
+    if host in SCRAPE_ADAPTERS:
+        result["entries"] = await parse_pool.run(scrape_html, host, body, result["url"], state.get("last_guid"))
+        result["scraped"] = True
+    else:
+        # RSS внутри text/html, битый XML и т.п. — откат на feedparser в пуле
+        result["entries"] = await parse_pool.run(parse_feed_bytes, body)
+
+async def is_rss_available(url: str) -> bool:
+    client = http_clients.get("feeds")
+    try:
+        r = await client.get(url, headers=FEED_HEADERS, timeout=10)
+        if r.status_code != 200:
+            return False
+        text = (r.text or "").strip()
+        if looks_like_feed(text, r.headers.get("Content-Type", "")):
+            return True
+        # Fallback: иногда Content-Type = text/html, но внутри RSS
+        return bool(await parse_pool.run(parse_feed_bytes, r.content))
+    except Exception as e:
+        logger.warning("is_rss_available error for %s: %s", url, e)
+        return False
+
+async def parse_html_news(url: str, sector: str = "") -> List[Dict[str, Any]]:
+    """Разовый скрейп страницы через адаптер сайта (для отладки адаптеров)"""
+    host = extract_domain(url)
+    if host not in SCRAPE_ADAPTERS:
+        logger.warning("No scrape adapter for %s", host)
+        return []
+    client = http_clients.get("feeds")
+    try:
+        r = await client.get(url, headers=FEED_HEADERS)
+        r.raise_for_status()
+        entries = await parse_pool.run(scrape_html, host, r.content, url, None)
+        return [{
+            "id": article_id(e["link"], e["title"]), "sector": sector, "title": e["title"], "link": e["link"],
+            "published": e["published"] or datetime.now(timezone.utc).isoformat(), "source": url,
+        } for e in entries]
+    except Exception as e:
+        logger.error(f"Error parsing {url}: {e}")
+        return []
+
+async def ingest_once(sectors: Optional[List[str]] = None, feeds: Optional[List[Tuple[str, str]]] = None) -> List[Dict[str, Any]]:
+    """Собирает новые записи; feeds — явный список (sector, url), иначе все фиды секторов"""
     sectors = sectors or DEFAULT_SECTORS
     out = []
-    seen_items = set()  # Для дедупликации
+    seen_items = set()  # Для дедупликации (по article_id)
+    memberships = set()  # (article_id, SECTOR)
+    if feeds is not None:
+        targets = list(feeds)
+    else:
+        targets = [(sector, url) for sector in sectors for url in SECTOR_FEEDS.get(sector, [])]
 
-    # Создаем отдельное соединение для ingest
     conn = None
     try:
         conn = db()
-        for sector in sectors:
-            for url in SECTOR_FEEDS.get(sector, []):
+        states = load_feed_states(conn, [url for _, url in targets])
+        open_circuits = load_open_circuits(conn)
+        if open_circuits:
+            skipped = [url for _, url in targets if url in open_circuits]
+            targets = [(sector, url) for sector, url in targets if url not in open_circuits]
+            if skipped:
+                logger.info("INGEST: skipping %d feeds with open circuit", len(skipped))
+                # следующий опрос — не раньше пробы circuit breaker, иначе фид «созревает» на каждом тике
+                conn.executemany("""INSERT INTO feed_state(url, next_poll_at) VALUES(?,?)
+                                    ON CONFLICT(url) DO UPDATE SET next_poll_at=excluded.next_poll_at""",
+                                 [(url, open_circuits[url]) for url in set(skipped)])
+                conn.commit()
+
+        # ШАГ 1: параллельно скачиваем все фиды (каждый ровно один раз)
+        global_sem = asyncio.Semaphore(INGEST_MAX_CONCURRENCY)
+        host_sems: Dict[str, asyncio.Semaphore] = {}
+        client = http_clients.get("feeds")
+        started = time.monotonic()
+        fetched = await asyncio.gather(*[
+            fetch_feed(client, sector, url, states.get(url, {}), global_sem, host_sems)
+            for sector, url in targets
+        ])
+        unchanged = sum(1 for res in fetched if res["unchanged"])
+        logger.info("INGEST FETCH: %d feeds in %.1fs (unchanged=%d)", len(fetched), time.monotonic() - started, unchanged)
+
+        # ШАГ 2: отбираем свежие записи из всех фидов (запись в БД — одним пакетом ниже)
+        pending: List[Tuple[Any, ...]] = []
+        candidates: List[Dict[str, Any]] = []
+        feed_updates: List[Tuple[str, Dict[str, Any], List[str]]] = []
+        for res in fetched:
+            sector, url, state = res["sector"], res["url"], res["state"]
+            record_feed_health(conn, res)
+            if res["error"]:
+                logger.error(f"Error processing {url}: {res['error']}")
+                schedule_next_poll(conn, url, 0, failed=True)
+                continue
+            if res["unchanged"]:
+                logger.debug("RSS unchanged: %s", url)
+                save_feed_state(conn, url, state, changed=False)
+                schedule_next_poll(conn, url, 0, failed=False)
+                continue
+            if res["status"] != 200:
+                schedule_next_poll(conn, url, 0, failed=True)
+                continue
+            if not res["entries"]:
+                save_feed_state(conn, url, state, changed=False)
+                schedule_next_poll(conn, url, 0, failed=False)
+                continue
+            feed_ids: List[str] = []
+            logger.info("RSS ok: %s | entries=%d | %.2fs", url, len(res["entries"]), res["elapsed"])
+
+            # Водяной знак: обрабатываем только записи новее последней увиденной
+            last_guid = state.get("last_guid")
+            last_published = None
+            if state.get("last_published"):
                 try:
-                    if await is_rss_available(url):
-                        async with httpx.AsyncClient(follow_redirects=True, timeout=15) as client:
-                            r = await client.get(url, headers={"User-Agent": "Mozilla/5.0"})
-                            feed = feedparser.parse(r.text)
-                            logger.info("RSS ok: %s | entries=%d", url, len(feed.entries))
-                        # Берем только 10 последних новостей из каждого фида (не 50!)
-                        for e in feed.entries[:10]:
-                            link = e.get("link") or ""
-                            title = e.get("title") or ""
-                            ts = e.get("published") or e.get("updated") or datetime.now(timezone.utc).isoformat()
-
-                            # ФИЛЬТР: Берем только новости за сегодня
-                            try:
-                                # Парсим дату публикации
-                                if e.get("published_parsed"):
-                                    pub_date = datetime(*e.published_parsed[:6], tzinfo=timezone.utc)
-                                elif e.get("updated_parsed"):
-                                    pub_date = datetime(*e.updated_parsed[:6], tzinfo=timezone.utc)
-                                else:
-                                    # Если дата не указана - считаем что это сегодня
-                                    pub_date = datetime.now(timezone.utc)
-                                
-                                # Проверяем что новость за сегодня (текущий день UTC)
-                                today = datetime.now(timezone.utc).date()
-                                news_date = pub_date.date()
-                                
-                                if news_date < today:
-                                    # Пропускаем старые новости
-                                    logger.debug(f"SKIP OLD: {news_date} < {today} | {title[:60]}")
-                                    continue
-                                    
-                            except Exception as e_date:
-                                # Если не смогли распарсить дату - пропускаем
-                                logger.warning(f"Date parse error for {title[:60]}: {e_date}")
-                                continue
-
-                            # Дедупликация по URL + заголовок
-                            item_key = f"{link}_{title[:50]}"
-                            if item_key in seen_items:
-                                continue
-                            seen_items.add(item_key)
-
-                            uid = hash_id((link or title) + sector)
-                            try:
-                                safe_execute(conn,
-                                    "INSERT OR IGNORE INTO ingested(id, ts_utc, sector, title, link, source, raw) VALUES(?,?,?,?,?,?,?)",
-                                    (uid, ts, sector, title, link, url, json.dumps({k: str(e.get(k)) for k in e.keys()}))
-                                )
-                                if conn.total_changes:  # вставилось
-                                    logger.info("INGEST INSERT: %s | %s", sector, (title or link)[:120])
-                                out.append({"id": uid, "sector": sector, "title": title, "link": link, "published": ts, "source": url})
-                            except sqlite3.OperationalError as e:
-                                logger.error(f"Ingest insert locked (RSS): {e}")
-                                continue
-                except Exception as e:
-                    logger.error(f"Error processing {url}: {e}")
-                    continue
+                    last_published = datetime.fromisoformat(state["last_published"])
+                except ValueError:
+                    pass
+            if res.get("scraped") and not last_guid:
+                # Первый скрейп страницы: у HTML-списков часто нет дат, поэтому только запоминаем
+                # верхнюю ссылку как водяной знак — дальше будут выдаваться лишь новые пункты
+                first = res["entries"][0]
+                state["last_guid"] = first.get("id") or first.get("link")
+                feed_updates.append((url, state, []))
+                continue
+            newest = [entry_published(e) for e in res["entries"][:FEED_MAX_ENTRIES]]
+            newest = [d for d in newest if d]
+            first = res["entries"][0]
+            state["last_guid"] = first.get("id") or first.get("link") or last_guid
+            if newest:
+                top = max(newest)
+                if last_published is None or top > last_published:
+                    state["last_published"] = top.isoformat()
+            try:
+                # Берем только FEED_MAX_ENTRIES (10) последних новостей из каждого фида (не 50!)
+                for e in res["entries"][:FEED_MAX_ENTRIES]:
+                    link = e.get("link") or ""
+                    title = e.get("title") or ""
+                    ts = e.get("published") or e.get("updated") or datetime.now(timezone.utc).isoformat()
+
+                    # Дошли до уже обработанной записи — дальше только старые
+                    guid = e.get("id") or link
+                    if last_guid and guid == last_guid:
+                        break
+
+                    # ФИЛЬТР: Берем только новости за сегодня
+                    try:
+                        # Парсим дату публикации
+                        # Если дата не указана - считаем что это сегодня
+                        pub_date = entry_published(e) or datetime.now(timezone.utc)
+
+                        if last_published and pub_date < last_published:
+                            continue
+
+                        # Проверяем что новость за сегодня (текущий день UTC)
+                        today = datetime.now(timezone.utc).date()
+                        news_date = pub_date.date()
+
+                        if news_date < today:
+                            # Пропускаем старые новости
+                            logger.debug(f"SKIP OLD: {news_date} < {today} | {title[:60]}")
+                            continue
+
+                    except Exception as e_date:
+                        # Если не смогли распарсить дату - пропускаем
+                        logger.warning(f"Date parse error for {title[:60]}: {e_date}")
+                        continue
+
+                    # Одна статья из фидов разных секторов — одна запись и несколько членств
+                    uid = article_id(link, title)
+                    memberships.add((uid, sector.upper()))
+                    if uid in seen_items:
+                        continue
+                    seen_items.add(uid)
+
+                    pending.append((uid, ts, sector, title, link, url, e["raw"]))
+                    candidates.append({"id": uid, "sector": sector, "title": title, "link": link, "published": ts, "source": url})
+                    feed_ids.append(uid)
+                feed_updates.append((url, state, feed_ids))
+            except Exception as e:
+                logger.error(f"Error processing {url}: {e}")
+                continue
+
+        # ШАГ 3: пакетная запись; на анализ идут только действительно новые id
+        new_ids = bulk_insert_ingested(conn, pending)
+        add_article_sectors(conn, memberships)
+        for item in candidates:
+            if item["id"] in new_ids:
+                logger.info("INGEST INSERT: %s | %s", item["sector"], (item["title"] or item["link"])[:120])
+                out.append(item)
+        # Водяные знаки сдвигаем только после успешной записи
+        for url, state, feed_ids in feed_updates:
+            save_feed_state(conn, url, state, changed=True)
+            schedule_next_poll(conn, url, sum(1 for uid in feed_ids if uid in new_ids), failed=False)
         conn.commit()
-        logger.info("INGEST SAVED total=%d", len(out))
+        logger.info("INGEST SAVED total=%d (candidates=%d)", len(out), len(pending))
     except Exception as e:
         logger.error(f"Error in ingest_once: {e}")
         if conn:
@@ -687,6 +2425,135 @@ async def ingest_once(sectors: Optional[List[str]] = None) -> List[Dict[str, Any
 
     return out
 
+# ---------------- Near-duplicates ----------------
+# Одна и та же история приходит из десятка изданий: перед вызовом LLM ищем почти-дубликат
+# через MinHash LSH по токенам заголовка. Подпись из MINHASH_PERMUTATIONS значений режется на полосы,
+# ключ каждой полосы лежит в индексе — кандидаты достаются точечным поиском, без скана таблицы,
+# а затем проверяются точным коэффициентом Жаккара.
+NEAR_DUP_ENABLED = os.getenv("NEAR_DUP_ENABLED", "1") == "1"
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.8"))
+NEAR_DUP_WINDOW_HOURS = float(os.getenv("NEAR_DUP_WINDOW_HOURS", "72"))
+NEAR_DUP_MIN_TOKENS = int(os.getenv("NEAR_DUP_MIN_TOKENS", "4"))
+MINHASH_PERMUTATIONS = 16
+MINHASH_BAND_ROWS = 2
+NEAR_DUP_BACKFILL_BATCH = 5000
+
+_MINHASH_PRIME = (1 << 61) - 1
+_MINHASH_PARAMS = [(random.Random(i).randrange(1, _MINHASH_PRIME), random.Random(-i - 1).randrange(0, _MINHASH_PRIME))
+                   for i in range(MINHASH_PERMUTATIONS)]
+
+_NEAR_DUP_STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "to", "in", "on", "for", "at", "by", "with", "from", "as",
+    "is", "are", "was", "were", "be", "its", "it", "this", "that", "amid", "into", "says", "said",
+    "и", "в", "во", "на", "по", "с", "со", "из", "за", "к", "от", "о", "об", "для", "что", "как",
+}
+# Хвост с названием издания: "... - Reuters", "... | Bloomberg"
+_TITLE_SOURCE_SUFFIX = re.compile(r"\s+[-–—|]\s+[^-–—|]{1,40}$")
+
+def title_tokens(title: str) -> List[str]:
+    title = _TITLE_SOURCE_SUFFIX.sub("", title or "")
+    return sorted({t for t in re.findall(r"\w+", title.lower()) if len(t) > 1 and t not in _NEAR_DUP_STOPWORDS})
+
+def minhash_band_keys(tokens: List[str]) -> List[int]:
+    """Ключи полос MinHash-подписи (знаковые 64-битные — под SQLite INTEGER)"""
+    hashes = [int.from_bytes(hashlib.blake2b(t.encode("utf-8"), digest_size=8).digest(), "big") for t in tokens]
+    signature = [min((a * h + b) % _MINHASH_PRIME for h in hashes) for a, b in _MINHASH_PARAMS]
+    keys = []
+    for band, start in enumerate(range(0, MINHASH_PERMUTATIONS, MINHASH_BAND_ROWS)):
+        chunk = f"{band}:" + ",".join(map(str, signature[start:start + MINHASH_BAND_ROWS]))
+        keys.append(int.from_bytes(hashlib.blake2b(chunk.encode(), digest_size=8).digest(), "big", signed=True))
+    return keys
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+def _numeric_tokens(tokens: set) -> set:
+    return {t for t in tokens if any(ch.isdigit() for ch in t)}
+
+def index_signal_title(conn, signal_id: str, ts: str, title: str) -> bool:
+    tokens = title_tokens(title)
+    # короткие заголовки тоже записываем (без полос), чтобы backfill не выбирал их повторно
+    safe_execute(conn, "INSERT OR REPLACE INTO near_dup_index(signal_id, ts, tokens) VALUES(?,?,?)",
+                 (signal_id, ts, " ".join(tokens)))
+    safe_execute(conn, "DELETE FROM near_dup_bands WHERE signal_id = ?", (signal_id,))
+    if len(tokens) < NEAR_DUP_MIN_TOKENS:
+        return False
+    conn.executemany("INSERT INTO near_dup_bands(band_key, signal_id) VALUES(?,?)",
+                     [(key, signal_id) for key in minhash_band_keys(tokens)])
+    return True
+
+def find_near_duplicate(conn, title: str, exclude_id: str = "") -> Optional[Tuple[str, float]]:
+    """Самый похожий сигнал за окно NEAR_DUP_WINDOW_HOURS: (signal_id, similarity) или None"""
+    tokens = title_tokens(title)
+    if len(tokens) < NEAR_DUP_MIN_TOKENS:
+        return None
+    keys = minhash_band_keys(tokens)
+    cutoff = (datetime.now(timezone.utc) - timedelta(hours=NEAR_DUP_WINDOW_HOURS)).isoformat()
+    rows = conn.execute(f"""
+        SELECT DISTINCT n.signal_id, n.tokens
+        FROM near_dup_bands b
+        JOIN near_dup_index n ON n.signal_id = b.signal_id
+        WHERE b.band_key IN ({",".join("?" * len(keys))}) AND n.ts >= ?
+    """, (*keys, cutoff)).fetchall()
+    token_set = set(tokens)
+    best = None
+    for signal_id, other in rows:
+        if signal_id == exclude_id:
+            continue
+        similarity = token_similarity(token_set, set(other.split()))
+        if similarity >= NEAR_DUP_THRESHOLD and (best is None or similarity > best[1]):
+            best = (signal_id, similarity)
+    return best
+
+def token_similarity(a: set, b: set) -> float:
+    # "+25 bps" и "+50 bps" — разные события, даже если остальной заголовок совпал
+    if _numeric_tokens(a) != _numeric_tokens(b):
+        return 0.0
+    return jaccard(a, b)
+
+def titles_near_duplicate(a: str, b: str) -> bool:
+    """Сравнение двух заголовков без индекса (внутри одного пакета анализа)"""
+    ta, tb = title_tokens(a), title_tokens(b)
+    if len(ta) < NEAR_DUP_MIN_TOKENS or len(tb) < NEAR_DUP_MIN_TOKENS:
+        return False
+    return token_similarity(set(ta), set(tb)) >= NEAR_DUP_THRESHOLD
+
+def attach_duplicate(conn, item_id: str, signal_id: str, similarity: float, sector: str = ""):
+    """Прикрепляет запись ingested к существующему сигналу: signal_duplicates + signals.merged_of + сектор"""
+    if sector:
+        add_article_sectors(conn, [(signal_id, sector.upper())])
+    cur = safe_execute(conn, "INSERT OR IGNORE INTO signal_duplicates(item_id, signal_id, similarity, ts) VALUES(?,?,?,?)",
+                       (item_id, signal_id, round(similarity, 3), datetime.now(timezone.utc).isoformat()))
+    if cur is None or cur.rowcount <= 0:
+        return
+    row = conn.execute("SELECT merged_of FROM signals WHERE id = ?", (signal_id,)).fetchone()
+    try:
+        merged = json.loads(row[0]) if row and row[0] else []
+    except ValueError:
+        merged = []
+    merged.append(item_id)
+    safe_execute(conn, "UPDATE signals SET merged_of = ? WHERE id = ?", (json.dumps(merged), signal_id))
+
+def prune_near_dup_index(conn):
+    """Убирает из индекса сигналы, удалённые очисткой"""
+    conn.execute("DELETE FROM near_dup_bands WHERE signal_id NOT IN (SELECT id FROM signals)")
+    conn.execute("DELETE FROM near_dup_index WHERE signal_id NOT IN (SELECT id FROM signals)")
+    conn.execute("DELETE FROM signal_duplicates WHERE signal_id NOT IN (SELECT id FROM signals)")
+
+def backfill_near_dup_index(conn, limit: int = NEAR_DUP_BACKFILL_BATCH) -> int:
+    """Индексирует сигналы, созданные до появления индекса"""
+    rows = conn.execute("""
+        SELECT s.id, s.ts_ingested, s.title
+        FROM signals s
+        LEFT JOIN near_dup_index n ON s.id = n.signal_id
+        WHERE n.signal_id IS NULL
+        ORDER BY s.ts_ingested DESC
+        LIMIT ?
+    """, (limit,)).fetchall()
+    for signal_id, ts, title in rows:
+        index_signal_title(conn, signal_id, ts or "", title or "")
+    return len(rows)
+
 # ---------------- Analysis ----------------
 def consensus(results: List[LLMResult]) -> LLMResult:
     if not results:
@@ -733,28 +2600,175 @@ def consensus(results: List[LLMResult]) -> LLMResult:
         latency="fast"
     )
 
+def item_text(item: Dict[str, Any]) -> str:
+    return f"[{item['sector']}] {item['title']}\n{item['link']}"
+
+# ---------------- Model cascade ----------------
+# Двухуровневый анализ: дешёвая быстрая модель (триаж) размечает все новости, дорогая (PROVIDERS, gpt-4o)
+# вызывается только когда триаж дал высокий impact, низкую уверенность или модели триажа разошлись.
+# Остальные новости сохраняются с результатом триажа (providers = "openai:gpt-4o-mini").
+LLM_CASCADE = os.getenv("LLM_CASCADE", "0") == "1"
+LLM_TRIAGE_MODELS = [
+    (provider, model)
+    for provider, _, model in (spec.strip().partition(":") for spec in os.getenv("LLM_TRIAGE_MODELS", "openai:gpt-4o-mini").split(","))
+    if provider in ALL_PROVIDERS and model
+]
+LLM_CASCADE_IMPACT = int(os.getenv("LLM_CASCADE_IMPACT", "50"))  # impact триажа >= — к дорогой модели
+LLM_CASCADE_MIN_CONFIDENCE = int(os.getenv("LLM_CASCADE_MIN_CONFIDENCE", "50"))  # confidence < — к дорогой модели
+
+CASCADE_STATS: Dict[str, Any] = {
+    "triaged": 0,
+    "escalated": 0,
+    "reasons": {"impact": 0, "low_confidence": 0, "disagreement": 0, "triage_failed": 0},
+    "triage_impact_bands": [0] * (100 // IMPACT_BAND),  # распределение impact триажа: 0-24, 25-49, 50-74, 75-100
+    # сверка эскалированных: насколько дорогая модель согласна с триажем (для подбора порогов)
+    "compared": 0,
+    "label_agree": 0,
+    "impact_abs_delta": 0,
+}
+
+def provider_endpoint(provider: str) -> Tuple[str, str]:
+    if provider == "deepseek":
+        return DEEPSEEK_URL, os.environ.get('DEEPSEEK_API_KEY', '')
+    return OPENAI_URL, os.environ.get('OPENAI_API_KEY', '')
+
+async def call_model(provider: str, model: str, text: str, site: str) -> LLMResult:
+    """Одиночный запрос пайплайна к произвольной модели провайдера (ошибки пробрасываются)"""
+    url, api_key = provider_endpoint(provider)
+    if not api_key:
+        raise RuntimeError(f"{provider} API key not set")
+    payload = pipeline_payload(model, PROMPT_USER_TMPL.format(text=text))
+    content = await chat_completion(provider, url, api_key, payload, site=site)
+    return pipeline_result(provider, payload, content, impact=25, confidence=50)
+
+async def triage(items: List[Dict[str, Any]]) -> Dict[str, Dict[str, Union[LLMResult, BaseException]]]:
+    """Прогон пакета через модели триажа: item_id -> {"provider:model": результат}"""
+    texts = {it["id"]: item_text(it) for it in items}
+
+    async def run(provider: str, model: str) -> ProviderResults:
+        got: ProviderResults = {}
+        if len(texts) > 1:
+            url, api_key = provider_endpoint(provider)
+            try:
+                got.update(await _call_batch(provider, url, api_key, model, texts, site="triage_batch"))
+            except LLMRateLimited as e:
+                return {item_id: e for item_id in texts}
+        missing = [item_id for item_id in texts if item_id not in got]
+        single = await asyncio.gather(*[call_model(provider, model, texts[item_id], "triage") for item_id in missing],
+                                      return_exceptions=True)
+        got.update(zip(missing, single))
+        return got
+
+    names = [f"{provider}:{model}" for provider, model in LLM_TRIAGE_MODELS]
+    by_model = await asyncio.gather(*[run(provider, model) for provider, model in LLM_TRIAGE_MODELS])
+    return {item_id: {name: res[item_id] for name, res in zip(names, by_model)} for item_id in texts}
+
+def escalation_reason(results: Dict[str, Union[LLMResult, BaseException]]) -> Optional[str]:
+    """Почему новость нужно отдать дорогой модели (None — хватает результата триажа)"""
+    valid = [r for r in results.values() if isinstance(r, LLMResult)]
+    if not valid:
+        return "triage_failed"
+    if len(valid) > 1 and (len({r.label for r in valid}) > 1 or
+                           max(r.impact for r in valid) - min(r.impact for r in valid) >= IMPACT_BAND):
+        return "disagreement"
+    c = consensus(valid)
+    if c.impact >= LLM_CASCADE_IMPACT:
+        return "impact"
+    if c.confidence < LLM_CASCADE_MIN_CONFIDENCE:
+        return "low_confidence"
+    return None
+
+async def analyze_cascade(items: List[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+    triaged = await triage(items)
+    out: Dict[str, Optional[Dict[str, Any]]] = {}
+    escalate: List[Dict[str, Any]] = []
+    triage_view: Dict[str, LLMResult] = {}
+    for it in items:
+        results = triaged[it["id"]]
+        valid = [r for r in results.values() if isinstance(r, LLMResult)]
+        CASCADE_STATS["triaged"] += 1
+        if valid:
+            triage_view[it["id"]] = consensus(valid)
+            CASCADE_STATS["triage_impact_bands"][min(triage_view[it["id"]].impact, 99) // IMPACT_BAND] += 1
+        reason = escalation_reason(results)
+        if reason:
+            CASCADE_STATS["escalated"] += 1
+            CASCADE_STATS["reasons"][reason] += 1
+            escalate.append(it)
+        else:
+            out[it["id"]] = build_signal(it, results)
+    if escalate:
+        logger.info(f"LLM CASCADE: {len(escalate)}/{len(items)} items escalated to {','.join(PROVIDERS)}")
+        for it, sig in zip(escalate, await analyze_batch(escalate, cascade=False)):
+            out[it["id"]] = sig
+            seen = triage_view.get(it["id"])
+            if sig and seen:
+                CASCADE_STATS["compared"] += 1
+                CASCADE_STATS["label_agree"] += int(sig["label"] == seen.label)
+                CASCADE_STATS["impact_abs_delta"] += abs(sig["impact"] - seen.impact)
+    return [out[it["id"]] for it in items]
+
 async def analyze_item(item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-    text = f"[{item['sector']}] {item['title']}\n{item['link']}"
-    tasks = [PROVIDERS[name](text) for name in PROVIDERS.keys()]
-    results: List[Union[LLMResult, BaseException]] = await asyncio.gather(*tasks, return_exceptions=True)
+    text = item_text(item)
+
+    async def call(name: str) -> ProviderResults:
+        return {item["id"]: await PROVIDERS[name](text)}
+
+    by_provider = await run_providers(call, [item["id"]], "single")
+    return build_signal(item, {name: res[item["id"]] for name, res in by_provider.items()})
+
+async def analyze_batch(items: List[Dict[str, Any]], cascade: Optional[bool] = None) -> List[Optional[Dict[str, Any]]]:
+    """Анализ пакета: один запрос на провайдера; новости, которых нет в ответе, — повтор по одной"""
+    if (LLM_CASCADE if cascade is None else cascade) and LLM_TRIAGE_MODELS:
+        return await analyze_cascade(items)
+    if len(items) == 1:
+        return [await analyze_item(items[0])]
+    texts = {it["id"]: item_text(it) for it in items}
+
+    async def run_provider(name: str) -> ProviderResults:
+        got: ProviderResults = {}
+        if name in BATCH_PROVIDERS:
+            try:
+                got.update(await BATCH_PROVIDERS[name](texts))
+            except LLMRateLimited as e:
+                return {item_id: e for item_id in texts}
+        missing = [item_id for item_id in texts if item_id not in got]
+        if missing:
+            if name in BATCH_PROVIDERS:
+                logger.info(f"LLM BATCH: {name} returned {len(got)}/{len(texts)} items, retrying {len(missing)} one by one")
+            single = await asyncio.gather(*[PROVIDERS[name](texts[item_id]) for item_id in missing], return_exceptions=True)
+            got.update(zip(missing, single))
+        return got
+
+    by_provider = await run_providers(run_provider, list(texts), "batch")
+    return [build_signal(it, {name: res[it["id"]] for name, res in by_provider.items()}) for it in items]
+
+def batch_item_tokens(item: Dict[str, Any]) -> int:
+    output = LLM_COMPACT_MAX_TOKENS if LLM_OUTPUT_SCHEMA == "compact" else LLM_BATCH_OUTPUT_TOKENS
+    return estimate_tokens(item_text(item)) + output
+
+def build_signal(item: Dict[str, Any], results: Dict[str, Union[LLMResult, BaseException]]) -> Optional[Dict[str, Any]]:
+    """Собирает запись signals из результатов провайдеров (provider -> результат)"""
     clean: List[LLMResult] = []
     raw_dump: List[Dict[str, Any]] = []
+    answered: List[str] = []
 
-    for i, r in enumerate(results):
-        provider = list(PROVIDERS.keys())[i]
+    for provider, r in results.items():
         if isinstance(r, BaseException):
             logger.error(f"Error with {provider}: {r!r}")
             raw_dump.append({"provider": provider, "error": str(r)})
             continue
         rr = cast(LLMResult, r)
-        raw_dump.append(rr.model_dump())
+        raw_dump.append(dict(rr.model_dump(), provider=provider))
         clean.append(rr)
+        answered.append(provider)
     if not clean:
-        clean.append(LLMResult(summary="no analysis", label="other", impact=0, confidence=0, sentiment=0, region="US", tickers=[], what="", why_matters="", action_window=">1w"))
+        # все провайдеры упали — сигнал не создаём, задача вернётся в очередь и будет повторена позже
+        return None
     c = consensus(clean)
 
-    # Генерируем ID и хеши
-    sig_id = hash_id((item["link"] or item["title"]) + item["sector"])
+    # ID сигнала совпадает с id записи ingested (article_id; у старых записей — хеш ссылки с сектором)
+    sig_id = item["id"]
     url_hash = hash_id(item["link"])
     title_clean = re.sub(r'[^\w\s]', '', item["title"].lower()).strip()
     body_hash = hash_id(item.get("summary", "")[:500])
@@ -785,146 +2799,618 @@ async def analyze_item(item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         "trust_score": trust_score,
         "is_test": is_test,
         "merged_of": None,
-        "providers": ",".join(PROVIDERS.keys()),
+        "providers": ",".join(answered),
         "summary": getattr(c, 'summary', ''),
         "title_ru": getattr(c, 'title_ru', ''),
         "analysis": getattr(c, 'analysis', ''),
         "latency": "fast",
-        "raw": json.dumps(raw_dump)
+        "raw": raw_dump
     }
 
-# ИСПРАВЛЕННАЯ ФУНКЦИЯ run_pipeline с обработкой orphan records
-async def run_pipeline(selected_sectors: Optional[List[str]] = None) -> int:
-    async with pipeline_lock:
-        # ШАГ 0: Автоматическая очистка данных старше 7 дней
-        conn_cleanup = None
+# ---------------- Pre-scorer ----------------
+# Локальный классификатор (наивный Байес по хешированным признакам заголовка), обученный на разметке LLM
+# из signals: train_prescorer.py. Оценка новости — десятки микросекунд, без сети:
+#   prioritize — новости уходят в LLM по убыванию важности (сначала наименее похожие на шум);
+#   label      — то же + очевидный шум (P(noise) >= PRESCORER_NOISE_PROB) размечается локально, без LLM.
+PRESCORER_PATH = os.getenv("PRESCORER_PATH", "prescorer.json")
+PRESCORER_MODE = os.getenv("PRESCORER_MODE", "off")  # off | prioritize | label
+PRESCORER_NOISE_IMPACT = int(os.getenv("PRESCORER_NOISE_IMPACT", "30"))  # impact ниже — шум
+PRESCORER_NOISE_PROB = float(os.getenv("PRESCORER_NOISE_PROB", "0.95"))
+
+PRESCORER_STATS: Dict[str, Any] = {"scored": 0, "prelabeled": 0, "total_us": 0.0}
+
+class PreScorer:
+    """Мультиномиальный наивный Байес по хешированным признакам: токены и биграммы заголовка, сектор, домен.
+
+    Цели: noise (impact < PRESCORER_NOISE_IMPACT), label, sentiment. Модель хранит только ненулевые
+    поправки log((n + a) / a) по признакам, поэтому файл компактный, а оценка — сумма нескольких чисел."""
+    BUCKETS = 1 << 18
+    ALPHA = 1.0
+    TARGETS = ("noise", "label", "sentiment")
+
+    def __init__(self, model: Optional[Dict[str, Any]] = None):
+        self.model = model or {}
+        # JSON хранит ключи строками — переводим корзины обратно в int
+        self.weights = {
+            target: {int(bucket): deltas for bucket, deltas in spec["weights"].items()}
+            for target, spec in self.model.get("targets", {}).items()
+        }
+
+    @classmethod
+    def features(cls, title: str, sector: str, domain: str) -> List[int]:
+        words = [t for t in re.findall(r"\w+", _TITLE_SOURCE_SUFFIX.sub("", title or "").lower())
+                 if len(t) > 1 and t not in _NEAR_DUP_STOPWORDS]
+        names = words + [f"{a} {b}" for a, b in zip(words, words[1:])] + [f"sector={sector.upper()}", f"domain={domain}"]
+        return [zlib.crc32(name.encode("utf-8")) % cls.BUCKETS for name in names]
+
+    @classmethod
+    def fit(cls, rows: List[Tuple[List[int], Dict[str, str]]], noise_impact: int) -> "PreScorer":
+        """rows: (признаки, {цель: класс}); noise_impact — impact, который ставится локально размеченному шуму"""
+        targets: Dict[str, Any] = {}
+        for target in cls.TARGETS:
+            counts: Dict[str, Dict[int, int]] = {}
+            docs: Dict[str, int] = {}
+            for feats, labels in rows:
+                cls_name = labels[target]
+                docs[cls_name] = docs.get(cls_name, 0) + 1
+                bucket_counts = counts.setdefault(cls_name, {})
+                for f in feats:
+                    bucket_counts[f] = bucket_counts.get(f, 0) + 1
+            classes = sorted(docs)
+            vocab = len({f for bucket_counts in counts.values() for f in bucket_counts})
+            total = sum(docs.values())
+            weights: Dict[int, Dict[int, float]] = {}
+            for ci, cls_name in enumerate(classes):
+                for f, n in counts[cls_name].items():
+                    weights.setdefault(f, {})[ci] = round(math.log((n + cls.ALPHA) / cls.ALPHA), 4)
+            targets[target] = {
+                "classes": classes,
+                "log_prior": [math.log(docs[c] / total) for c in classes],
+                # log(a / (слов в классе + a * V)) — вклад любого признака, которого класс не видел
+                "log_unseen": [math.log(cls.ALPHA / (sum(counts[c].values()) + cls.ALPHA * vocab)) for c in classes],
+                "weights": weights,
+            }
+        return cls({"targets": targets, "noise_impact": noise_impact, "samples": len(rows)})
+
+    def proba(self, target: str, feats: List[int]) -> Dict[str, float]:
+        spec = self.model["targets"][target]
+        weights = self.weights[target]
+        scores = [prior + unseen * len(feats) for prior, unseen in zip(spec["log_prior"], spec["log_unseen"])]
+        for f in feats:
+            for ci, delta in weights.get(f, {}).items():
+                scores[int(ci)] += delta
+        top = max(scores)
+        exps = [math.exp(x - top) for x in scores]
+        norm = sum(exps)
+        return {c: e / norm for c, e in zip(spec["classes"], exps)}
+
+    def predict_features(self, feats: List[int]) -> Dict[str, Any]:
+        """{noise, noise_p = P(шум), label, label_p, sentiment, sentiment_p}"""
+        out: Dict[str, Any] = {}
+        for target in self.TARGETS:
+            probs = self.proba(target, feats)
+            best = max(probs, key=lambda c: probs[c])
+            out[target] = best
+            out[f"{target}_p"] = probs.get("1", 0.0) if target == "noise" else probs[best]
+        return out
+
+    def predict(self, title: str, sector: str, domain: str) -> Dict[str, Any]:
+        return self.predict_features(self.features(title, sector, domain))
+
+    def save(self, path: str):
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.model, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+
+def prescorer_training_rows(conn) -> List[Tuple[List[int], Dict[str, str]]]:
+    """Сигналы с разметкой LLM (без локально размеченных и тестовых), от старых к новым"""
+    rows = conn.execute("""SELECT title, sector, source_domain, label, impact, sentiment
+                           FROM signals
+                           WHERE IFNULL(providers, '') != 'prescorer' AND IFNULL(is_test, 0) = 0 AND title != ''
+                           ORDER BY ts_ingested""").fetchall()
+    return [
+        (PreScorer.features(title, sector or "", domain or ""),
+         {"noise": "1" if (impact or 0) < PRESCORER_NOISE_IMPACT else "0",
+          "label": label or "other",
+          "sentiment": str(sentiment or 0)})
+        for title, sector, domain, label, impact, sentiment in rows
+    ]
+
+def evaluate_prescorer(model: PreScorer, rows: List[Tuple[List[int], Dict[str, str]]]) -> Dict[str, Any]:
+    """Точность против разметки LLM: accuracy по целям (и базовая линия — самый частый класс),
+    а для шума — доля помеченных и их precision при разных порогах P(noise)"""
+    from collections import Counter
+    report: Dict[str, Any] = {"samples": len(rows)}
+    if not rows:
+        return report
+    predicted = [(model.predict_features(feats), labels) for feats, labels in rows]
+    for target in PreScorer.TARGETS:
+        majority = Counter(labels[target] for _, labels in predicted).most_common(1)[0][1]
+        report[target] = {
+            "accuracy": round(sum(p[target] == labels[target] for p, labels in predicted) / len(rows), 3),
+            "baseline": round(majority / len(rows), 3),
+        }
+    noise_total = sum(labels["noise"] == "1" for _, labels in predicted)
+    report["noise"]["share"] = round(noise_total / len(rows), 3)
+    report["noise"]["thresholds"] = {}
+    for threshold in (0.8, 0.9, 0.95, 0.99):
+        flagged = [labels for p, labels in predicted if p["noise_p"] >= threshold]
+        hits = sum(labels["noise"] == "1" for labels in flagged)
+        report["noise"]["thresholds"][str(threshold)] = {
+            "coverage": round(len(flagged) / len(rows), 3),  # доля новостей, которые не пойдут в LLM
+            "precision": round(hits / len(flagged), 3) if flagged else None,  # из них действительно шум
+            "recall": round(hits / noise_total, 3) if noise_total else None,
+        }
+    return report
+
+def train_prescorer(conn, holdout: float = 0.2) -> Tuple[PreScorer, Dict[str, Any]]:
+    """Оценка на последних holdout сигналов (обучение на более ранних), затем обучение на всех"""
+    rows = prescorer_training_rows(conn)
+    split = int(len(rows) * (1 - holdout))
+    noise_impacts = sorted(impact for (impact,) in conn.execute(
+        "SELECT impact FROM signals WHERE impact < ? AND IFNULL(providers, '') != 'prescorer'", (PRESCORER_NOISE_IMPACT,)))
+    noise_impact = noise_impacts[len(noise_impacts) // 2] if noise_impacts else 25
+    report = evaluate_prescorer(PreScorer.fit(rows[:split], noise_impact), rows[split:]) if 0 < split < len(rows) else {}
+    model = PreScorer.fit(rows, noise_impact)
+    model.model["trained_at"] = datetime.now(timezone.utc).isoformat()
+    model.model["metrics"] = report
+    return model, report
+
+_prescorer: Dict[str, Any] = {"mtime": None, "model": None}
+
+def load_prescorer() -> Optional[PreScorer]:
+    """Модель из PRESCORER_PATH; перечитывается, если файл обновили (переобучение без рестарта)"""
+    try:
+        mtime = os.path.getmtime(PRESCORER_PATH)
+    except OSError:
+        return None
+    if _prescorer["mtime"] != mtime:
         try:
-            conn_cleanup = db()
-            # Считаем сколько удалим
-            cutoff_date = (datetime.now(timezone.utc) - timedelta(days=7)).strftime('%Y-%m-%d')
-            old_count = conn_cleanup.execute(
-                "SELECT COUNT(*) FROM signals WHERE DATE(ts_published) < ?",
-                (cutoff_date,)
-            ).fetchone()[0]
-            
-            if old_count > 0:
-                logger.info(f"🗑️  CLEANUP: Удаляю {old_count} сигналов старше 7 дней...")
-                conn_cleanup.execute(
-                    "DELETE FROM signals WHERE DATE(ts_published) < ?",
-                    (cutoff_date,)
-                )
-                conn_cleanup.commit()
-                logger.info(f"✅ CLEANUP: Удалено {old_count} старых сигналов (старше {cutoff_date})")
-            else:
-                logger.info(f"✅ CLEANUP: Нет сигналов старше 7 дней для удаления")
+            with open(PRESCORER_PATH, encoding="utf-8") as f:
+                _prescorer["model"] = PreScorer(json.load(f))
+            _prescorer["mtime"] = mtime
+            logger.info(f"PRESCORER: loaded {PRESCORER_PATH} ({_prescorer['model'].model.get('samples', 0)} samples)")
         except Exception as e:
-            logger.error(f"❌ CLEANUP: Ошибка при очистке: {e}")
-        finally:
-            if conn_cleanup:
-                try:
-                    conn_cleanup.close()
-                except Exception:
-                    pass
-        
-        # ШАГ 1: Ingest новых новостей
-        new_items = await ingest_once(selected_sectors)
-        logger.info(f"PIPELINE: ingested {len(new_items)} new items")
-        
-        # ШАГ 2: Найти orphan records (в ingested но НЕ в signals)
-        conn = None
-        orphans = []
+            logger.error(f"PRESCORER: failed to load {PRESCORER_PATH}: {e}")
+            _prescorer.update(mtime=mtime, model=None)
+    return _prescorer["model"]
+
+def prescore(item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Оценка новости локальной моделью (None — режим выключен или модели нет); кэшируется в item"""
+    if PRESCORER_MODE == "off":
+        return None
+    if "_prescore" not in item:
+        model = load_prescorer()
+        if not model:
+            return None
+        started = time.perf_counter()
+        item["_prescore"] = model.predict(item.get("title", ""), item.get("sector", ""), extract_domain(item.get("link", "")))
+        PRESCORER_STATS["scored"] += 1
+        PRESCORER_STATS["total_us"] += (time.perf_counter() - started) * 1e6
+    return item["_prescore"]
+
+def prioritize_items(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Сначала новости, меньше всего похожие на шум (порядок среди равных сохраняется)"""
+    if PRESCORER_MODE == "off" or not load_prescorer():
+        return items
+    return sorted(items, key=lambda it: (prescore(it) or {}).get("noise_p", 0.0))
+
+def prescored_signal(item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Сигнал из локальной оценки для очевидного шума (режим label); None — новость идёт в LLM"""
+    if PRESCORER_MODE != "label":
+        return None
+    score = prescore(item)
+    if not score or score["noise_p"] < PRESCORER_NOISE_PROB:
+        return None
+    model = cast(PreScorer, load_prescorer())
+    # confidence — уверенность в сохранённой метке, а не P(шум); пересказа нет — в summary идёт заголовок
+    result = LLMResult(summary=item.get("title", ""), label=score["label"], impact=int(model.model.get("noise_impact", 25)),
+                       confidence=int(score["label_p"] * 100), sentiment=int(score["sentiment"]))
+    PRESCORER_STATS["prelabeled"] += 1
+    return build_signal(item, {"prescorer": result})
+
+# ИСПРАВЛЕННАЯ ФУНКЦИЯ run_pipeline с обработкой orphan records
+def insert_signal(conn, sig: Dict[str, Any]) -> bool:
+    """INSERT OR IGNORE сигнала; True — если запись действительно новая"""
+    cur = safe_execute(conn, """INSERT OR IGNORE INTO signals
+    (id, ts_published, ts_ingested, source_domain, url_hash, url, title, title_clean, title_ru, body_hash, sector, label, region, entities_json, tickers_json, impact, confidence, sentiment, trust_score, is_test, merged_of, providers, summary, analysis, latency)
+    VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
+    (sig["id"], sig["ts_published"], sig["ts_ingested"], sig["source_domain"], sig["url_hash"], sig["url"],
+     sig["title"], sig["title_clean"], sig.get("title_ru", ""), sig["body_hash"], sig["sector"], sig["label"], sig["region"],
+     sig["entities_json"], sig["tickers_json"], sig["impact"], sig["confidence"], sig["sentiment"],
+     sig["trust_score"], sig["is_test"], sig["merged_of"], sig["providers"], sig["summary"], sig.get("analysis", ""), sig["latency"]))
+    # Проверяем что запись действительно вставилась (total_changes накопительный — не годится)
+    if cur is None or cur.rowcount <= 0:
+        return False
+    if sig.get("raw"):
+        store_raw_payloads(conn, [(sig["id"], "signal", sig["raw"])])
+    return True
+
+# Время последнего запуска обслуживающих шагов пайплайна (очистка)
+MAINTENANCE_INTERVAL_MINUTES = float(os.getenv("MAINTENANCE_INTERVAL_MINUTES", "60"))
+_last_maintenance: Dict[str, float] = {}
+
+def maintenance_due(name: str, interval_s: float) -> bool:
+    now = time.monotonic()
+    last = _last_maintenance.get(name)
+    if last is not None and now - last < interval_s:
+        return False
+    _last_maintenance[name] = now
+    return True
+
+def attach_if_duplicate(conn, it: Dict[str, Any]) -> bool:
+    """Прикрепляет новость к существующему сигналу, если она уже проанализирована; True — если прикреплена"""
+    # Та же ссылка уже проанализирована (например, под старым id с сектором) — только добавляем сектор
+    same_url = conn.execute("SELECT id FROM signals WHERE url_hash = ?", (hash_id(it["link"]),)).fetchone() if it["link"] else None
+    if same_url:
+        attach_duplicate(conn, it["id"], same_url[0], 1.0, it["sector"])
+        return True
+
+    # Почти-дубликат уже проанализированной истории — прикрепляем без вызова LLM
+    if NEAR_DUP_ENABLED:
+        dup = find_near_duplicate(conn, it["title"], exclude_id=it["id"])
+        if dup:
+            attach_duplicate(conn, it["id"], *dup, it["sector"])
+            logger.info(f"PIPELINE: 🔗 near-duplicate of {dup[0]} (jaccard={dup[1]:.2f}): {it['title'][:80]}")
+            return True
+    return False
+
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "4"))
+
+async def analyze_round(conn, items: List[Dict[str, Any]], counts: Dict[str, int]) -> List[Dict[str, Any]]:
+    """Один проход анализа: пакеты обрабатываются ANALYSIS_WORKERS воркерами параллельно,
+    результаты пишутся в БД по мере готовности. Возвращает отложенные новости — похожие на
+    уже отправленные в этом проходе; их проверяем на дубликат в следующем проходе."""
+    batches: asyncio.Queue = asyncio.Queue(maxsize=max(ANALYSIS_WORKERS, 1) * 2)
+    results: asyncio.Queue = asyncio.Queue()
+    held: List[Dict[str, Any]] = []
+
+    async def produce():
+        # Набираем пакеты (LLM_BATCH_SIZE новостей в пределах бюджета токенов);
+        # дубликаты уже проанализированных историй прикрепляем без вызова LLM
+        dispatched: List[Dict[str, Any]] = []
+        queue = list(items)
         try:
-            conn = db()
-            # Находим записи которые есть в ingested но нет в signals
-            orphan_rows = conn.execute("""
-                SELECT i.id, i.sector, i.title, i.link, i.ts_utc, i.source
-                FROM ingested i
-                LEFT JOIN signals s ON i.id = s.id
-                WHERE s.id IS NULL
-                ORDER BY i.ts_utc DESC
-                LIMIT 100
-            """).fetchall()
-            
-            for row in orphan_rows:
-                orphans.append({
-                    "id": row[0],
-                    "sector": row[1],
-                    "title": row[2],
-                    "link": row[3],
-                    "published": row[4],
-                    "source": row[5]
-                })
-            
-            logger.info(f"PIPELINE: found {len(orphans)} orphan records to analyze")
-        except Exception as e:
-            logger.error(f"Error finding orphans: {e}")
+            while queue:
+                batch: List[Dict[str, Any]] = []
+                tokens = 0
+                while queue and len(batch) < max(LLM_BATCH_SIZE, 1):
+                    it = queue[0]
+                    cost = batch_item_tokens(it)
+                    if batch and tokens + cost > LLM_BATCH_MAX_TOKENS:
+                        break
+                    queue.pop(0)
+                    try:
+                        if attach_if_duplicate(conn, it):
+                            counts["merged"] += 1
+                            complete_job(conn, it["id"])
+                            continue
+                    except Exception as e:
+                        logger.error(f"PIPELINE: ❌ Error processing item {it.get('id', 'unknown')}: {e}", exc_info=True)
+                        counts["failed"] += 1
+                        fail_job(conn, it["id"], str(e))
+                        continue
+                    # Похожая новость уже анализируется — проверим снова, когда она будет сохранена
+                    if NEAR_DUP_ENABLED and any(titles_near_duplicate(it["title"], other["title"]) for other in dispatched + batch):
+                        held.append(it)
+                        continue
+                    # Очевидный шум размечает локальный пре-скорер — без вызова LLM
+                    local = prescored_signal(it)
+                    if local:
+                        counts["prelabeled"] += 1
+                        dispatched.append(it)
+                        await results.put(([it], [local]))
+                        continue
+                    batch.append(it)
+                    tokens += cost
+                if batch:
+                    dispatched.extend(batch)
+                    await batches.put(batch)
         finally:
-            if conn:
-                try:
-                    conn.close()
-                except Exception:
-                    pass
-        
-        # ШАГ 3: Объединяем новые + orphans для анализа
-        items_to_analyze = new_items + orphans
-        
-        if not items_to_analyze:
-            logger.info("PIPELINE: nothing to analyze")
-            return 0
-        
-        logger.info(f"PIPELINE: analyzing {len(items_to_analyze)} total items ({len(new_items)} new + {len(orphans)} orphans)")
+            for _ in range(max(ANALYSIS_WORKERS, 1)):
+                await batches.put(None)
 
-        # ШАГ 4: Анализируем и сохраняем
-        conn = None
-        saved = 0
-        failed = 0
-        try:
-            conn = db()
-            for it in items_to_analyze:
+    async def work():
+        while True:
+            batch = await batches.get()
+            if batch is None:
+                break
+            logger.info(f"PIPELINE: analyzing batch of {len(batch)}: " + " | ".join(f"[{it['sector']}] {it['title'][:40]}" for it in batch))
+            try:
+                sigs = await analyze_batch(batch)
+            except Exception as e:
+                logger.error(f"PIPELINE: ❌ Error analyzing batch: {e}", exc_info=True)
+                sigs = [None] * len(batch)
+            await results.put((batch, sigs))
+
+    async def write():
+        # Единственный писатель: сохраняем пакеты по мере готовности
+        while True:
+            done = await results.get()
+            if done is None:
+                break
+            for it, sig in zip(*done):
                 try:
-                    logger.info(f"PIPELINE: analyzing [{it['sector']}] {it['title'][:80]}...")
-                    sig = await analyze_item(it)
-                    if not sig: 
+                    if not sig:
                         logger.warning(f"PIPELINE: analyze_item returned None for {it.get('id', 'unknown')}")
-                        failed += 1
+                        counts["failed"] += 1
+                        fail_job(conn, it["id"], "no provider returned a valid analysis")
                         continue
-                    
-                    safe_execute(conn, """INSERT OR IGNORE INTO signals
-                    (id, ts_published, ts_ingested, source_domain, url_hash, url, title, title_clean, title_ru, body_hash, sector, label, region, entities_json, tickers_json, impact, confidence, sentiment, trust_score, is_test, merged_of, providers, summary, analysis, latency, raw)
-                    VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
-                    (sig["id"], sig["ts_published"], sig["ts_ingested"], sig["source_domain"], sig["url_hash"], sig["url"],
-                     sig["title"], sig["title_clean"], sig.get("title_ru", ""), sig["body_hash"], sig["sector"], sig["label"], sig["region"],
-                     sig["entities_json"], sig["tickers_json"], sig["impact"], sig["confidence"], sig["sentiment"],
-                     sig["trust_score"], sig["is_test"], sig["merged_of"], sig["providers"], sig["summary"], sig.get("analysis", ""), sig["latency"], sig["raw"]))
-                    
-                    # Проверяем что запись действительно вставилась
-                    if conn.total_changes > 0:
-                        saved += 1
+
+                    if insert_signal(conn, sig):
+                        counts["saved"] += 1
+                        index_signal_title(conn, sig["id"], sig["ts_ingested"], sig["title"])
                         logger.info(f"PIPELINE: ✅ saved signal {sig['id']} | impact={sig['impact']}")
                     else:
                         logger.info(f"PIPELINE: ⏭️  signal {sig['id']} already exists, skipping")
-                        
+                    complete_job(conn, it["id"])
+
                 except Exception as e:
                     logger.error(f"PIPELINE: ❌ Error processing item {it.get('id', 'unknown')}: {e}", exc_info=True)
-                    failed += 1
+                    counts["failed"] += 1
+                    fail_job(conn, it["id"], str(e))
                     continue
             conn.commit()
-            logger.info(f"PIPELINE: ✅ DONE | saved={saved}, failed={failed}, total={len(items_to_analyze)}")
-        except Exception as e:
-            logger.error(f"PIPELINE: Fatal error: {e}", exc_info=True)
-            if conn:
-                try:
-                    conn.rollback()
-                except Exception:
-                    pass
-        finally:
-            if conn:
+
+    writer = asyncio.create_task(write())
+    try:
+        await asyncio.gather(produce(), *[work() for _ in range(max(ANALYSIS_WORKERS, 1))])
+    finally:
+        await results.put(None)
+        await writer
+    return held
+
+# ---------------- Analysis queue ----------------
+# Задачи на анализ живут в analysis_jobs: ingest ставит задачу в той же транзакции, что и запись ingested;
+# воркер забирает пачку под аренду (BEGIN IMMEDIATE — атомарно и между процессами), по итогу задача
+# становится done, либо возвращается в очередь с паузой ANALYSIS_RETRY_BASE_S * 2^(попытка-1), либо — dead.
+# Пока пачка в работе, аренда продлевается; истёкшая (процесс упал посреди анализа) снова доступна для захвата,
+# а итог записывает только текущий владелец аренды.
+ANALYSIS_CLAIM_SIZE = int(os.getenv("ANALYSIS_CLAIM_SIZE", "100"))
+ANALYSIS_LEASE_SECONDS = float(os.getenv("ANALYSIS_LEASE_SECONDS", "900"))
+ANALYSIS_MAX_ATTEMPTS = int(os.getenv("ANALYSIS_MAX_ATTEMPTS", "5"))
+ANALYSIS_RETRY_BASE_S = float(os.getenv("ANALYSIS_RETRY_BASE_S", "300"))
+ANALYSIS_RETRY_MAX_S = float(os.getenv("ANALYSIS_RETRY_MAX_S", "21600"))
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+def enqueue_jobs(conn, item_ids) -> int:
+    now = time.time()
+    cur = conn.executemany("""INSERT OR IGNORE INTO analysis_jobs(item_id, status, attempts, created_at, next_attempt_at, updated_at)
+                              VALUES(?, 'queued', 0, ?, ?, ?)""", [(item_id, now, now, now) for item_id in item_ids])
+    return max(cur.rowcount, 0)
+
+def backfill_analysis_jobs(conn) -> int:
+    """Разовый перенос: записи ingested без сигнала и без задачи (база до появления очереди).
+    Пока в очереди есть хоть одна задача, ничего не сканируем."""
+    if conn.execute("SELECT 1 FROM analysis_jobs LIMIT 1").fetchone():
+        return 0
+    orphan_ids = [row[0] for row in conn.execute("""
+        SELECT i.id FROM ingested i
+        LEFT JOIN signals s ON i.id = s.id
+        LEFT JOIN signal_duplicates d ON i.id = d.item_id
+        WHERE s.id IS NULL AND d.item_id IS NULL""")]
+    return enqueue_jobs(conn, orphan_ids)
+
+def claim_jobs(limit: int) -> List[Dict[str, Any]]:
+    """Забирает до limit готовых задач под аренду WORKER_ID (сначала свежие новости)"""
+    now = time.time()
+    conn = None
+    try:
+        conn = db()
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute("""
+            SELECT j.item_id, i.sector, i.title, i.link, i.ts_utc, i.source
+            FROM analysis_jobs j JOIN ingested i ON i.id = j.item_id
+            WHERE (j.status = 'queued' AND j.next_attempt_at <= ?) OR (j.status = 'leased' AND j.lease_until < ?)
+            ORDER BY j.created_at DESC
+            LIMIT ?""", (now, now, limit)).fetchall()
+        conn.executemany("""UPDATE analysis_jobs SET status = 'leased', lease_owner = ?, lease_until = ?,
+                                   attempts = attempts + 1, updated_at = ?
+                            WHERE item_id = ?""",
+                         [(WORKER_ID, now + ANALYSIS_LEASE_SECONDS, now, row[0]) for row in rows])
+        conn.commit()
+    except Exception as e:
+        logger.error(f"QUEUE: claim failed: {e}")
+        if conn:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+        return []
+    finally:
+        if conn:
+            conn.close()
+    return [{"id": r[0], "sector": r[1], "title": r[2], "link": r[3], "published": r[4], "source": r[5]} for r in rows]
+
+def complete_job(conn, item_id: str):
+    # только своя аренда: если её перехватил другой процесс, его итог не затираем
+    safe_execute(conn, """UPDATE analysis_jobs SET status = 'done', lease_owner = NULL, lease_until = NULL,
+                                 last_error = NULL, updated_at = ? WHERE item_id = ? AND lease_owner = ?""",
+                 (time.time(), item_id, WORKER_ID))
+
+def fail_job(conn, item_id: str, error: str):
+    """Неудачная попытка: повтор с экспоненциальной паузой или dead после ANALYSIS_MAX_ATTEMPTS"""
+    row = conn.execute("SELECT attempts FROM analysis_jobs WHERE item_id = ? AND lease_owner = ?", (item_id, WORKER_ID)).fetchone()
+    if not row:
+        return  # аренда уже не наша — попытку засчитал тот, кто её перехватил
+    attempts = row[0] or 1
+    now = time.time()
+    if attempts >= ANALYSIS_MAX_ATTEMPTS:
+        logger.warning(f"QUEUE: ☠️  {item_id} dead after {attempts} attempts: {error[:200]}")
+        status, next_attempt_at = "dead", None
+    else:
+        status, next_attempt_at = "queued", now + min(ANALYSIS_RETRY_MAX_S, ANALYSIS_RETRY_BASE_S * 2 ** (attempts - 1))
+    safe_execute(conn, """UPDATE analysis_jobs SET status = ?, next_attempt_at = ?, lease_owner = NULL, lease_until = NULL,
+                                 last_error = ?, updated_at = ? WHERE item_id = ? AND lease_owner = ?""",
+                 (status, next_attempt_at, error[:500], now, item_id, WORKER_ID))
+
+def release_jobs(item_ids: List[str]):
+    """Возвращает арендованные этим процессом задачи в очередь без учёта попытки (остановка посреди анализа)"""
+    now = time.time()
+    conn = None
+    try:
+        conn = db()
+        conn.executemany("""UPDATE analysis_jobs SET status = 'queued', attempts = MAX(attempts - 1, 0), next_attempt_at = ?,
+                                   lease_owner = NULL, lease_until = NULL, updated_at = ?
+                            WHERE item_id = ? AND status = 'leased' AND lease_owner = ?""",
+                         [(now, now, item_id, WORKER_ID) for item_id in item_ids])
+        conn.commit()
+    except Exception as e:
+        logger.error(f"QUEUE: release failed: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+def renew_leases(item_ids: List[str]):
+    """Продлевает аренду ещё не завершённых задач этого процесса на ANALYSIS_LEASE_SECONDS"""
+    now = time.time()
+    conn = None
+    try:
+        conn = db()
+        conn.executemany("""UPDATE analysis_jobs SET lease_until = ?, updated_at = ?
+                            WHERE item_id = ? AND status = 'leased' AND lease_owner = ?""",
+                         [(now + ANALYSIS_LEASE_SECONDS, now, item_id, WORKER_ID) for item_id in item_ids])
+        conn.commit()
+    except Exception as e:
+        logger.warning(f"QUEUE: lease renewal failed: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+async def keep_leases(item_ids: List[str]):
+    """Пока пачка анализируется (лимиты провайдеров могут растянуть её дольше аренды), аренда продлевается"""
+    while True:
+        await asyncio.sleep(ANALYSIS_LEASE_SECONDS / 3)
+        renew_leases(item_ids)
+
+async def drain_analysis_queue() -> Dict[str, int]:
+    """Анализирует готовые задачи пачками по ANALYSIS_CLAIM_SIZE, пока они есть"""
+    counts = {"saved": 0, "merged": 0, "failed": 0, "prelabeled": 0}
+    async with analysis_lock:
+        while True:
+            items = claim_jobs(ANALYSIS_CLAIM_SIZE)
+            if not items:
+                break
+            logger.info(f"PIPELINE: claimed {len(items)} analysis jobs")
+            # ШАГ 4: Анализируем и сохраняем (с пре-скорером — сначала самые важные)
+            conn = None
+            keeper = asyncio.create_task(keep_leases([it["id"] for it in items]))
+            try:
+                conn = db()
+                pending = prioritize_items(items)
+                while pending:
+                    pending = await analyze_round(conn, pending, counts)
+                conn.commit()
+            except asyncio.CancelledError:
+                # уже сохранённое остаётся, остальное — обратно в очередь (даже если commit не удался)
                 try:
-                    conn.close()
-                except Exception:
-                    pass
+                    if conn:
+                        conn.commit()
+                finally:
+                    release_jobs([it["id"] for it in items])
+                raise
+            except Exception as e:
+                # незавершённые задачи вернутся в очередь по истечении аренды
+                logger.error(f"PIPELINE: Fatal error: {e}", exc_info=True)
+                if conn:
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        pass
+                break
+            finally:
+                keeper.cancel()
+                if conn:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+    if any(counts.values()):
+        logger.info(f"PIPELINE: ✅ DONE | saved={counts['saved']} (prelabeled={counts['prelabeled']}), merged={counts['merged']}, failed={counts['failed']}")
+    return counts
+
+_drain_task: Optional[asyncio.Task] = None
+
+def start_analysis_drain():
+    """Фоновый разбор очереди (если ещё не идёт) — тик планировщика не ждёт окончания анализа"""
+    global _drain_task
+    if APP_ROLE == "api":
+        return  # очередь разбирает процесс-воркер
+    if _drain_task is None or _drain_task.done():
+        _drain_task = asyncio.create_task(drain_and_precompute())
+
+async def drain_and_precompute():
+    counts = await drain_analysis_queue()
+    if counts["saved"]:
+        await precompute_analyses()
+
+async def run_ingest(selected_sectors: Optional[List[str]] = None, feeds: Optional[List[Tuple[str, str]]] = None) -> int:
+    """Обслуживание + опрос фидов; новые записи попадают в очередь анализа"""
+    async with ingest_lock:
+        # ШАГ 0: Автоматическая очистка данных старше 7 дней
+        # (при адаптивном опросе пайплайн запускается часто — обслуживание не чаще раза в час)
+        if feeds is None or maintenance_due("cleanup", MAINTENANCE_INTERVAL_MINUTES * 60):
+            conn_cleanup = None
+            try:
+                conn_cleanup = db()
+                # Считаем сколько удалим
+                cutoff_date = (datetime.now(timezone.utc) - timedelta(days=7)).strftime('%Y-%m-%d')
+                old_count = conn_cleanup.execute(
+                    "SELECT COUNT(*) FROM signals WHERE DATE(ts_published) < ?",
+                    (cutoff_date,)
+                ).fetchone()[0]
+            
+                if old_count > 0:
+                    logger.info(f"🗑️  CLEANUP: Удаляю {old_count} сигналов старше 7 дней...")
+                    conn_cleanup.execute(
+                        "DELETE FROM signals WHERE DATE(ts_published) < ?",
+                        (cutoff_date,)
+                    )
+                    conn_cleanup.commit()
+                    logger.info(f"✅ CLEANUP: Удалено {old_count} старых сигналов (старше {cutoff_date})")
+                else:
+                    logger.info(f"✅ CLEANUP: Нет сигналов старше 7 дней для удаления")
+
+                # Индекс почти-дубликатов: убираем удалённые сигналы и досчитываем недостающие
+                prune_near_dup_index(conn_cleanup)
+                conn_cleanup.execute("""DELETE FROM article_sectors
+                    WHERE article_id NOT IN (SELECT id FROM signals) AND article_id NOT IN (SELECT id FROM ingested)""")
+                indexed = backfill_near_dup_index(conn_cleanup)
+                conn_cleanup.execute("DELETE FROM signal_analysis WHERE signal_id NOT IN (SELECT id FROM signals)")
+                conn_cleanup.execute("DELETE FROM analysis_precompute_failures WHERE signal_id NOT IN (SELECT id FROM signals)")
+                conn_cleanup.execute("DELETE FROM raw_payloads WHERE kind = 'signal' AND id NOT IN (SELECT id FROM signals)")
+                conn_cleanup.execute("DELETE FROM llm_usage WHERE ts < ?", (time.time() - LLM_USAGE_RETENTION_DAYS * 86400,))
+                # Очередь: завершённые задачи старше 7 дней не нужны; dead остаются для разбора
+                conn_cleanup.execute("DELETE FROM analysis_jobs WHERE status = 'done' AND updated_at < ?", (time.time() - 7 * 86400,))
+                conn_cleanup.execute("DELETE FROM worker_heartbeats WHERE heartbeat_at < ?", (time.time() - 86400,))
+                queued = backfill_analysis_jobs(conn_cleanup)
+                conn_cleanup.commit()
+                if indexed:
+                    logger.info(f"✅ CLEANUP: индекс почти-дубликатов дополнен {indexed} сигналами")
+                if queued:
+                    logger.info(f"✅ CLEANUP: в очередь анализа добавлено {queued} необработанных записей")
+            except Exception as e:
+                logger.error(f"❌ CLEANUP: Ошибка при очистке: {e}")
+            finally:
+                if conn_cleanup:
+                    try:
+                        conn_cleanup.close()
+                    except Exception:
+                        pass
+
+        # ШАГ 1: Ingest новых новостей (задачи на анализ ставятся в той же транзакции)
+        new_items = await ingest_once(selected_sectors, feeds=feeds)
+        logger.info(f"PIPELINE: ingested {len(new_items)} new items")
+        return len(new_items)
 
-        return saved
+async def run_pipeline(selected_sectors: Optional[List[str]] = None, feeds: Optional[List[Tuple[str, str]]] = None) -> int:
+    """Ingest и анализ очереди до конца (ручной запуск); возвращает число новых сигналов"""
+    await run_ingest(selected_sectors, feeds)
+    counts = await drain_analysis_queue()
+    if counts["saved"]:
+        await precompute_analyses()
+    return counts["saved"]
 
 def fetch_signals(limit=20, label=None, min_impact=0, sector=None, starred_only=False, ticker=None, region=None, min_confidence=0, hide_test=True, date_from=None, date_to=None) -> List[Signal]:
     conn = None
@@ -932,7 +3418,8 @@ def fetch_signals(limit=20, label=None, min_impact=0, sector=None, starred_only=
         conn = db()
         q = """SELECT s.id, s.ts_published, s.ts_ingested, s.source_domain, s.url, s.title, s.title_clean, s.title_ru, s.sector, s.label, s.region, 
                       s.entities_json, s.tickers_json, s.impact, s.confidence, s.sentiment, s.trust_score, s.is_test, s.summary, s.analysis, s.latency,
-                      IFNULL(c.starred,0), IFNULL(c.note,''), IFNULL(c.tags,'')
+                      IFNULL(c.starred,0), IFNULL(c.note,''), IFNULL(c.tags,''),
+                      (SELECT group_concat(a.sector) FROM article_sectors a WHERE a.article_id = s.id)
                FROM signals s
                LEFT JOIN curation c ON c.signal_id = s.id"""
         conds: List[str] = []
@@ -943,8 +3430,9 @@ def fetch_signals(limit=20, label=None, min_impact=0, sector=None, starred_only=
             params.append(label)
 
         if sector:
-            conds.append("s.sector=?")
-            params.append(sector)
+            # основной сектор сигнала или любое из членств статьи
+            conds.append("(s.sector=? OR EXISTS (SELECT 1 FROM article_sectors a WHERE a.article_id = s.id AND a.sector=?))")
+            params.extend([sector, sector])
 
         if min_impact:
             conds.append("s.impact>=?")
@@ -1007,10 +3495,11 @@ def fetch_signals(limit=20, label=None, min_impact=0, sector=None, starred_only=
                     except Exception:
                         tickers = []
 
+                sectors = sorted({r[8], *(r[24].split(",") if r[24] else [])})
                 signal = Signal(
                     id=r[0], ts_published=r[1], ts_ingested=r[2], source_domain=r[3], url=r[4], title=r[5], title_clean=r[6], title_ru=r[7] or "",
                     sector=r[8], label=r[9], region=r[10], tickers=tickers, impact=r[13], 
-                    confidence=r[14], sentiment=r[15], trust_score=r[16], is_test=r[17], summary=r[18] or "", analysis=r[19] or "", latency=r[20] or "fast", starred=r[21], note=r[22] or "", tags=r[23] or ""
+                    confidence=r[14], sentiment=r[15], trust_score=r[16], is_test=r[17], summary=r[18] or "", analysis=r[19] or "", latency=r[20] or "fast", starred=r[21], note=r[22] or "", tags=r[23] or "", sectors=sectors
                 )
                 signals.append(signal)
             except Exception as e:
@@ -1028,23 +3517,171 @@ def fetch_signals(limit=20, label=None, min_impact=0, sector=None, starred_only=
             except Exception:
                 pass
 
+# ---------------- Feed scheduler ----------------
+SCHEDULER_TICK_SECONDS = int(os.getenv("SCHEDULER_TICK_SECONDS", "60"))
+
+WORKER_STARTED_AT = time.time()
+
+def record_heartbeat():
+    conn = None
+    try:
+        conn = db()
+        safe_execute(conn, """INSERT INTO worker_heartbeats(worker_id, role, started_at, heartbeat_at, ingesting, draining)
+                              VALUES(?,?,?,?,?,?)
+                              ON CONFLICT(worker_id) DO UPDATE SET heartbeat_at=excluded.heartbeat_at,
+                                  ingesting=excluded.ingesting, draining=excluded.draining""",
+                     (WORKER_ID, APP_ROLE, WORKER_STARTED_AT, time.time(), int(ingest_lock.locked()), int(analysis_lock.locked())))
+        conn.commit()
+    except Exception as e:
+        logger.warning(f"SCHEDULER: heartbeat failed: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+def request_feed_poll(sectors: Optional[List[str]] = None) -> Tuple[int, List[str]]:
+    """Ставит фиды секторов на немедленный опрос (feed_state.next_poll_at) — подхватит ближайший тик воркера.
+
+    Воркер опрашивает только scheduled_feeds(); возвращает (число поставленных фидов, секторы, которые он не опрашивает)."""
+    now = datetime.now(timezone.utc).isoformat()
+    polled = {url for _, url in scheduled_feeds()}
+    urls: set = set()
+    unscheduled: List[str] = []
+    for sector in sectors or DEFAULT_SECTORS:
+        sector_urls = [url for url in SECTOR_FEEDS.get(sector, []) if url in polled]
+        if not sector_urls:
+            unscheduled.append(sector)
+        urls.update(sector_urls)
+    conn = None
+    try:
+        conn = db()
+        conn.executemany("""INSERT INTO feed_state(url, next_poll_at) VALUES(?,?)
+                            ON CONFLICT(url) DO UPDATE SET next_poll_at=excluded.next_poll_at""", [(url, now) for url in urls])
+        conn.commit()
+    finally:
+        if conn:
+            conn.close()
+    return len(urls), unscheduled
+
+def scheduled_feeds() -> List[Tuple[str, str]]:
+    return [(sector, url) for sector in DEFAULT_SECTORS for url in SECTOR_FEEDS.get(sector, [])]
+
+async def poll_due_feeds() -> int:
+    """Тик планировщика: запускает пайплайн только для фидов, у которых подошло время опроса"""
+    record_heartbeat()
+    # задачи, которым подошло время повтора, разбираются даже без новых фидов
+    start_analysis_drain()
+    if ingest_lock.locked():
+        logger.info("SCHEDULER: ingest busy, skipping tick")
+        return 0
+    now = datetime.now(timezone.utc)
+    due: List[Tuple[str, str]] = []
+    conn = None
+    try:
+        conn = db()
+        next_polls = dict(conn.execute("SELECT url, next_poll_at FROM feed_state").fetchall())
+        for sector, url in scheduled_feeds():
+            next_poll_at = next_polls.get(url)
+            if not next_poll_at:
+                # Новый фид: разносим первый опрос случайно по базовому интервалу, без залпа на старте
+                first = now + timedelta(seconds=random.uniform(0, POLL_DEFAULT_MINUTES * 60))
+                safe_execute(conn, """INSERT INTO feed_state(url, next_poll_at) VALUES(?,?)
+                    ON CONFLICT(url) DO UPDATE SET next_poll_at=excluded.next_poll_at""", (url, first.isoformat()))
+                continue
+            try:
+                if datetime.fromisoformat(next_poll_at) <= now:
+                    due.append((sector, url))
+            except ValueError:
+                due.append((sector, url))
+        conn.commit()
+    except Exception as e:
+        logger.error(f"SCHEDULER: error selecting due feeds: {e}")
+        return 0
+    finally:
+        if conn:
+            try:
+                conn.close()
+            except Exception:
+                pass
+    if not due:
+        return 0
+    logger.info("SCHEDULER: %d feeds due", len(due))
+    n = await run_ingest(feeds=due)
+    if n:
+        start_analysis_drain()
+    return n
+
 # ---------------- Lifespan & app ----------------
+# Роль процесса (APP_ROLE):
+#   all    — API и фоновый пайплайн в одном процессе (по умолчанию);
+#   api    — только HTTP: планировщик не запускается, опрос фидов и анализ делает воркер;
+#   worker — python -m app worker: планировщик и очередь анализа без HTTP.
+# Процессы координируются только через базу: analysis_jobs (аренды), feed_state (расписание опроса),
+# worker_heartbeats (пульс) — API и воркер можно масштабировать и перезапускать независимо.
+APP_ROLE = os.getenv("APP_ROLE", "all")
 scheduler = AsyncIOScheduler()
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # startup
-    # Обновление раз в час (не каждые 10 минут!)
-    scheduler.add_job(run_pipeline, "interval", minutes=60)  # БЕЗ next_run_time!
+
+async def start_background():
+    await http_clients.start()
+    if APP_ROLE == "api":
+        logger.info("API-only mode: scheduler disabled, ingestion and analysis run in the worker process.")
+        return
+    # Адаптивный опрос: тик раз в минуту, каждый фид — по своему расписанию из feed_state
+    scheduler.add_job(poll_due_feeds, "interval", seconds=SCHEDULER_TICK_SECONDS, max_instances=1, coalesce=True)
     scheduler.start()
     logger.info("Scheduler started.")
-    try:
-        yield
-    finally:
+
+async def stop_background():
+    if scheduler.running:
         try:
             scheduler.shutdown(wait=False)
             logger.info("Scheduler stopped.")
         except Exception as e:
             logger.warning(f"Scheduler shutdown issue: {e}")
+    if _drain_task and not _drain_task.done():
+        _drain_task.cancel()  # арендованные задачи вернутся в очередь
+        try:
+            await _drain_task
+        except (asyncio.CancelledError, Exception):
+            pass
+    await http_clients.aclose()
+    logger.info("HTTP clients closed.")
+    parse_pool.shutdown()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_background()
+    try:
+        yield
+    finally:
+        await stop_background()
+
+async def run_worker():
+    """Процесс-воркер: опрос фидов по расписанию и разбор очереди анализа до SIGINT/SIGTERM"""
+    import signal
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass  # Windows: остановка по Ctrl+C через KeyboardInterrupt
+    await start_background()
+    logger.info(f"Worker {WORKER_ID} started.")
+    record_heartbeat()
+    start_analysis_drain()  # задачи, оставшиеся с прошлого запуска, — сразу
+    try:
+        await stop.wait()
+    finally:
+        logger.info(f"Worker {WORKER_ID} stopping...")
+        await stop_background()
+        conn = None
+        try:
+            conn = db()
+            conn.execute("DELETE FROM worker_heartbeats WHERE worker_id = ?", (WORKER_ID,))
+            conn.commit()
+        finally:
+            if conn:
+                conn.close()
 
 app = FastAPI(title="Система обзора для инвесторов (Публичные данные)", lifespan=lifespan)
 
@@ -1725,7 +4362,7 @@ async def dashboard():
             }
         }
         
-        async function generateAnalysis(signalId) {
+        function generateAnalysis(signalId) {
             const button = document.getElementById('analyze-btn-' + signalId);
             const analysisDiv = document.getElementById('analysis-' + signalId);
             const analysisContent = analysisDiv.querySelector('div');
@@ -1739,22 +4376,30 @@ async def dashboard():
             analysisDiv.style.display = 'block';
             analysisContent.innerHTML = '<div style="text-align: center; padding: 20px;"><div style="display: inline-block; width: 20px; height: 20px; border: 3px solid #FFD700; border-top-color: transparent; border-radius: 50%; animation: spin 1s linear infinite;"></div><br/>Generating analytics...</div>';
             
-            try {
-                // Запрос на бэкенд для генерации
-                const response = await fetch('/generate-analysis/' + signalId, {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ language: i18n.currentLang })
-                });
+            const fail = (message) => {
+                console.error('Ошибка генерации аналитики:', message);
+                analysisContent.innerHTML = '<div style="color: #ff6b6b;">❌ Ошибка генерации аналитики: ' + message + '</div>';
                 
-                if (!response.ok) {
-                    throw new Error('Ошибка генерации: ' + response.status);
-                }
-                
-                const data = await response.json();
+                // Восстанавливаем кнопку
+                button.disabled = false;
+                button.innerHTML = '📊 SAA Alliance Analytics';
+                button.style.background = 'linear-gradient(45deg, #4CAF50, #45a049)';
+            };
+            
+            // Поток с бэкенда: текст появляется по мере генерации (SSE)
+            const source = new EventSource('/generate-analysis/' + signalId + '/stream?language=' + encodeURIComponent(i18n.currentLang));
+            let streamed = '';
+            
+            source.onmessage = (event) => {
+                streamed += JSON.parse(event.data).delta || '';
+                analysisContent.textContent = streamed;
+            };
+            
+            source.addEventListener('done', (event) => {
+                source.close();
                 
                 // Обновляем контент
-                analysisContent.innerHTML = data.analysis || i18n.t('analysisNotGenerated');
+                analysisContent.innerHTML = JSON.parse(event.data).analysis || i18n.t('analysisNotGenerated');
                 
                 // Заменяем кнопку на кнопку показа/скрытия
                 button.outerHTML = `
@@ -1762,16 +4407,18 @@ async def dashboard():
                         📊 SAA Alliance Analytics
                     </button>
                 `;
-                
-            } catch (error) {
-                console.error('Ошибка генерации аналитики:', error);
-                analysisContent.innerHTML = '<div style="color: #ff6b6b;">❌ Ошибка генерации аналитики: ' + error.message + '</div>';
-                
-                // Восстанавливаем кнопку
-                button.disabled = false;
-                button.innerHTML = '📊 SAA Alliance Analytics';
-                button.style.background = 'linear-gradient(45deg, #4CAF50, #45a049)';
-            }
+            });
+            
+            source.addEventListener('failed', (event) => {
+                source.close();
+                fail(JSON.parse(event.data).error);
+            });
+            
+            // Обрыв соединения: не даём EventSource переподключаться и запускать генерацию заново
+            source.onerror = () => {
+                source.close();
+                fail(streamed ? 'connection lost' : 'request failed');
+            };
         }
         
         
@@ -2044,6 +4691,292 @@ async def dashboard():
 async def health():
     return {"ok": True, "utc": datetime.now(timezone.utc).isoformat(), "sectors": DEFAULT_SECTORS}
 
+@app.get("/http/stats")
+async def http_stats():
+    """Счётчики пулов HTTP: запросы, новые соединения, переиспользованные keep-alive"""
+    return {"http2": HTTP2_ENABLED and HTTP2_AVAILABLE, "pools": http_clients.report()}
+
+@app.get("/llm/cache")
+async def llm_cache_stats():
+    """Кэш ответов LLM: попадания, промахи, объём"""
+    conn = None
+    try:
+        conn = db()
+        entries, size = conn.execute("SELECT COUNT(*), IFNULL(SUM(size), 0) FROM llm_cache").fetchone()
+    finally:
+        if conn:
+            conn.close()
+    lookups = LLM_CACHE_STATS["hits"] + LLM_CACHE_STATS["misses"]
+    return {
+        "enabled": LLM_CACHE_ENABLED,
+        "ttl_hours": LLM_CACHE_TTL_HOURS,
+        "max_mb": LLM_CACHE_MAX_MB,
+        "entries": entries,
+        "size_mb": round(size / 1024 / 1024, 2),
+        "hit_rate": round(LLM_CACHE_STATS["hits"] / lookups, 3) if lookups else 0.0,
+        **LLM_CACHE_STATS,
+    }
+
+@app.get("/llm/limits")
+async def llm_limits():
+    """Лимитеры провайдеров: текущая параллельность (AIMD), RPM/TPM из заголовков, 429 и ожидание"""
+    return {name: limiter.report() for name, limiter in _provider_limiters.items()}
+
+@app.get("/llm/latency")
+async def llm_latency():
+    """Гистограммы задержек провайдеров (p50/p90/p99), на них опираются hedged и quorum"""
+    return {
+        "policy": LLM_POLICY,
+        "providers": list(PROVIDERS),
+        "latency": {f"{provider}/{kind}": hist.report() for (provider, kind), hist in LLM_LATENCY.items()},
+    }
+
+@app.get("/llm/usage")
+async def llm_usage(hours: float = Query(24, gt=0)):
+    """Токены по провайдеру, модели и месту вызова: prompt / cached / completion, доля кэша префикса, задержки"""
+    conn = None
+    try:
+        conn = db()
+        rows = conn.execute("""SELECT provider, model, site, COUNT(*), SUM(prompt_tokens), SUM(cached_tokens),
+                                      SUM(completion_tokens), AVG(latency_ms), MAX(latency_ms), SUM(IFNULL(items, 1)), SUM(latency_ms)
+                               FROM llm_usage WHERE ts >= ?
+                               GROUP BY provider, model, site
+                               ORDER BY SUM(prompt_tokens) + SUM(completion_tokens) DESC""",
+                            (time.time() - hours * 3600,)).fetchall()
+    finally:
+        if conn:
+            conn.close()
+    breakdown = []
+    totals = {"calls": 0, "items": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0}
+    for provider, model, site, calls, prompt, cached, completion, avg_ms, max_ms, items, total_ms in rows:
+        breakdown.append({
+            "provider": provider,
+            "model": model,
+            "site": site,
+            "calls": calls,
+            "prompt_tokens": prompt,
+            "cached_tokens": cached,
+            "completion_tokens": completion,
+            "cache_ratio": round(cached / prompt, 3) if prompt else 0.0,
+            "cost_usd": round(usage_cost(model, prompt, cached, completion), 4),
+            "avg_prompt_tokens": round(prompt / calls),
+            "avg_completion_tokens": round(completion / calls),
+            "avg_latency_ms": round(avg_ms),
+            "max_latency_ms": max_ms,
+            # на одну новость (пакетный запрос — несколько новостей): сравнение схем и размеров пакета
+            "items": items,
+            "completion_tokens_per_item": round(completion / items, 1),
+            "seconds_per_item": round(total_ms / items / 1000, 3),
+        })
+        totals["calls"] += calls
+        totals["items"] += items
+        totals["prompt_tokens"] += prompt
+        totals["cached_tokens"] += cached
+        totals["completion_tokens"] += completion
+        totals["cost_usd"] = round(totals["cost_usd"] + usage_cost(model, prompt, cached, completion), 4)
+    totals["cache_ratio"] = round(totals["cached_tokens"] / totals["prompt_tokens"], 3) if totals["prompt_tokens"] else 0.0
+    return {"hours": hours, "totals": totals, "breakdown": breakdown}
+
+@app.get("/llm/cascade")
+async def llm_cascade(hours: float = Query(24, gt=0)):
+    """Каскад моделей: доля эскалаций и причины, согласие дорогой модели с триажем, задержка и стоимость по уровням"""
+    conn = None
+    try:
+        conn = db()
+        rows = conn.execute("""SELECT CASE WHEN site LIKE 'triage%' THEN 'triage' ELSE 'full' END AS tier, model,
+                                      COUNT(*), SUM(IFNULL(items, 1)), SUM(prompt_tokens), SUM(cached_tokens),
+                                      SUM(completion_tokens), SUM(latency_ms)
+                               FROM llm_usage
+                               WHERE ts >= ? AND (site LIKE 'triage%' OR site LIKE 'analyze%')
+                               GROUP BY tier, model""", (time.time() - hours * 3600,)).fetchall()
+    finally:
+        if conn:
+            conn.close()
+    tiers: Dict[str, Dict[str, Any]] = {}
+    for tier, model, calls, items, prompt, cached, completion, total_ms in rows:
+        t = tiers.setdefault(tier, {"calls": 0, "items": 0, "tokens": 0, "cost_usd": 0.0, "latency_ms": 0})
+        t["calls"] += calls
+        t["items"] += items
+        t["tokens"] += prompt + completion
+        t["cost_usd"] += usage_cost(model, prompt, cached, completion)
+        t["latency_ms"] += total_ms
+    for t in tiers.values():
+        t["avg_latency_ms"] = round(t.pop("latency_ms") / t["calls"])
+        t["cost_per_item_usd"] = round(t["cost_usd"] / t["items"], 6)
+        t["cost_usd"] = round(t["cost_usd"], 4)
+    stats = CASCADE_STATS
+    return {
+        "enabled": LLM_CASCADE,
+        "triage_models": [f"{provider}:{model}" for provider, model in LLM_TRIAGE_MODELS],
+        "full_providers": list(PROVIDERS),
+        "thresholds": {"impact": LLM_CASCADE_IMPACT, "min_confidence": LLM_CASCADE_MIN_CONFIDENCE},
+        "escalation_rate": round(stats["escalated"] / stats["triaged"], 3) if stats["triaged"] else 0.0,
+        "label_agreement": round(stats["label_agree"] / stats["compared"], 3) if stats["compared"] else None,
+        "mean_impact_delta": round(stats["impact_abs_delta"] / stats["compared"], 1) if stats["compared"] else None,
+        **stats,
+        "tiers": tiers,
+    }
+
+@app.get("/workers")
+async def workers_status():
+    """Процессы с планировщиком (воркеры): роль, аптайм, давность пульса, занятость"""
+    now = time.time()
+    conn = None
+    try:
+        conn = db()
+        rows = conn.execute("SELECT worker_id, role, started_at, heartbeat_at, ingesting, draining FROM worker_heartbeats ORDER BY heartbeat_at DESC").fetchall()
+    finally:
+        if conn:
+            conn.close()
+    workers = [{
+        "worker_id": worker_id,
+        "role": role,
+        "uptime_s": round(now - started_at),
+        "heartbeat_age_s": round(now - heartbeat_at),
+        "alive": now - heartbeat_at < SCHEDULER_TICK_SECONDS * 3,
+        "ingesting": bool(ingesting),
+        "draining": bool(draining),
+    } for worker_id, role, started_at, heartbeat_at, ingesting, draining in rows]
+    return {"role": APP_ROLE, "this_process": WORKER_ID, "alive": sum(w["alive"] for w in workers), "workers": workers}
+
+@app.get("/queue")
+async def queue_status(dead_limit: int = Query(20, ge=0, le=500)):
+    """Очередь анализа: глубина по статусам, готовые/отложенные, возраст старейшей задачи, аренды, dead-letter"""
+    now = time.time()
+    conn = None
+    try:
+        conn = db()
+        by_status = dict(conn.execute("SELECT status, COUNT(*) FROM analysis_jobs GROUP BY status").fetchall())
+        ready, delayed, oldest_created, oldest_ready = conn.execute("""
+            SELECT SUM(next_attempt_at <= ?), SUM(next_attempt_at > ?), MIN(created_at), MIN(CASE WHEN next_attempt_at <= ? THEN next_attempt_at END)
+            FROM analysis_jobs WHERE status = 'queued'""", (now, now, now)).fetchone()
+        leases = conn.execute("""SELECT lease_owner, COUNT(*), SUM(lease_until < ?) FROM analysis_jobs
+                                 WHERE status = 'leased' GROUP BY lease_owner""", (now,)).fetchall()
+        retries = dict(conn.execute("""SELECT attempts, COUNT(*) FROM analysis_jobs
+                                       WHERE status = 'queued' AND attempts > 0 GROUP BY attempts""").fetchall())
+        dead = conn.execute("""SELECT j.item_id, i.title, j.attempts, j.last_error, j.updated_at
+                               FROM analysis_jobs j LEFT JOIN ingested i ON i.id = j.item_id
+                               WHERE j.status = 'dead' ORDER BY j.updated_at DESC LIMIT ?""", (dead_limit,)).fetchall()
+    finally:
+        if conn:
+            conn.close()
+    return {
+        "depth": {status: by_status.get(status, 0) for status in ("queued", "leased", "done", "dead")},
+        "ready": ready or 0,
+        "delayed": delayed or 0,  # ждут повтора после ошибки
+        "oldest_queued_age_s": round(now - oldest_created) if oldest_created else None,
+        "oldest_ready_wait_s": round(now - oldest_ready) if oldest_ready else None,
+        "retries_by_attempt": retries,
+        "leases": [{"owner": owner, "jobs": n, "expired": expired or 0} for owner, n, expired in leases],
+        "draining": analysis_lock.locked(),
+        "max_attempts": ANALYSIS_MAX_ATTEMPTS,
+        "dead_letter": [
+            {"item_id": item_id, "title": title, "attempts": attempts, "last_error": error,
+             "dead_since": datetime.fromtimestamp(updated, timezone.utc).isoformat() if updated else None}
+            for item_id, title, attempts, error, updated in dead
+        ],
+    }
+
+@app.post("/queue/retry")
+async def queue_retry(item_id: Optional[str] = None):
+    """Возвращает dead-задачи (все или одну) в очередь с обнулёнными попытками"""
+    now = time.time()
+    conn = None
+    try:
+        conn = db()
+        q = "UPDATE analysis_jobs SET status = 'queued', attempts = 0, next_attempt_at = ?, updated_at = ? WHERE status = 'dead'"
+        params: Tuple[Any, ...] = (now, now)
+        if item_id:
+            q += " AND item_id = ?"
+            params += (item_id,)
+        requeued = safe_execute(conn, q, params).rowcount
+        conn.commit()
+    finally:
+        if conn:
+            conn.close()
+    if requeued:
+        start_analysis_drain()
+    return {"requeued": requeued}
+
+@app.get("/prescorer")
+async def prescorer_status():
+    """Локальный пре-скорер: режим, пороги, метрики последнего обучения и скорость оценки"""
+    model = load_prescorer()
+    return {
+        "mode": PRESCORER_MODE,
+        "path": PRESCORER_PATH,
+        "loaded": model is not None,
+        "noise_impact": PRESCORER_NOISE_IMPACT,
+        "noise_prob": PRESCORER_NOISE_PROB,
+        "trained_at": model.model.get("trained_at") if model else None,
+        "samples": model.model.get("samples") if model else None,
+        "metrics": model.model.get("metrics") if model else None,
+        **PRESCORER_STATS,
+        "avg_us": round(PRESCORER_STATS["total_us"] / PRESCORER_STATS["scored"], 1) if PRESCORER_STATS["scored"] else None,
+    }
+
+@app.get("/feeds/health")
+async def feeds_health(only_failing: bool = False):
+    """Состояние фидов: задержки, статусы, ошибки подряд, открытые circuit breaker и расписание опроса"""
+    conn = None
+    try:
+        conn = db()
+        q = """SELECT h.url, h.sector, h.last_status, h.last_error, h.last_latency_ms, h.avg_latency_ms, h.last_entries,
+                      h.consecutive_failures, h.total_ok, h.total_fail, h.last_ok_at, h.last_checked_at, h.circuit_open_until,
+                      f.rate_per_hour, f.next_poll_at
+               FROM feed_health h
+               LEFT JOIN feed_state f ON f.url = h.url"""
+        if only_failing:
+            q += " WHERE h.consecutive_failures > 0"
+        q += " ORDER BY h.consecutive_failures DESC, h.avg_latency_ms DESC"
+        now = datetime.now(timezone.utc)
+        feeds = []
+        for r in conn.execute(q).fetchall():
+            circuit = "closed"
+            if r[12]:
+                try:
+                    circuit = "open" if datetime.fromisoformat(r[12]) > now else "half_open"
+                except ValueError:
+                    pass
+            feeds.append({
+                "url": r[0], "sector": r[1], "last_status": r[2], "last_error": r[3],
+                "last_latency_ms": r[4], "avg_latency_ms": r[5], "last_entries": r[6],
+                "consecutive_failures": r[7], "total_ok": r[8], "total_fail": r[9],
+                "last_ok_at": r[10], "last_checked_at": r[11], "circuit": circuit, "circuit_open_until": r[12],
+                "rate_per_hour": round(r[13], 3) if r[13] is not None else None, "next_poll_at": r[14],
+            })
+        return {
+            "total": len(feeds),
+            "open_circuits": sum(1 for f in feeds if f["circuit"] == "open"),
+            "failing": sum(1 for f in feeds if f["consecutive_failures"]),
+            "feeds": feeds,
+        }
+    except Exception as e:
+        logger.error(f"Feed health error: {e}")
+        return {"error": str(e)}
+    finally:
+        if conn:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+@app.get("/debug/raw/{item_id}")
+async def debug_raw(item_id: str, kind: str = Query(default="ingest", description="ingest | signal")):
+    """Распаковывает сохранённый сырой payload записи (только для отладки)"""
+    if kind not in ("ingest", "signal"):
+        raise HTTPException(status_code=400, detail="kind must be 'ingest' or 'signal'")
+    conn = None
+    try:
+        conn = db()
+        payload = load_raw_payload(conn, item_id, kind)
+    finally:
+        if conn:
+            conn.close()
+    if payload is None:
+        raise HTTPException(status_code=404, detail="Raw payload not found")
+    return {"id": item_id, "kind": kind, "raw": payload}
+
 @app.get("/stats")
 async def get_stats():
     """Получить общую статистику по всем сигналам"""
@@ -2099,6 +5032,12 @@ async def get_stats():
 @app.post("/ingest-run")
 async def ingest_run(sectors: Optional[str] = Query(default=None, description="comma-separated e.g. energy,biotech")):
     selected = [s.strip() for s in sectors.split(",")] if sectors else None
+    if APP_ROLE == "api":
+        # API не опрашивает фиды сам: ставим их на ближайший тик воркера
+        scheduled, unscheduled = request_feed_poll(selected)
+        if not scheduled:
+            raise HTTPException(status_code=400, detail=f"Worker does not poll sectors: {', '.join(unscheduled)} (DEFAULT_SECTORS)")
+        return {"scheduled_feeds": scheduled, "unscheduled_sectors": unscheduled}
     n = await run_pipeline(selected)
     return {"new_signals": n}
 
@@ -2110,119 +5049,9 @@ async def list_signals(limit: int = 50, label: Optional[str] = None, min_impact:
     return fetch_signals(limit, label, min_impact, sector, starred_only, ticker, region, min_confidence, hide_test, date_from, date_to)
 
 
-@app.post("/generate-analysis/{signal_id}")
-async def generate_analysis_endpoint(signal_id: str, request: Request):
-    """Генерирует аналитику для конкретной новости по требованию"""
-    try:
-        body = await request.json()
-        language = body.get('language', 'ru')
-        
-        # Retry логика для чтения из БД с увеличенными таймаутами
-        max_retries = 5  # Увеличили с 3 до 5
-        row = None
-        for attempt in range(max_retries):
-            try:
-                # Создаем соединение с увеличенным таймаутом
-                conn = sqlite3.connect(DB_PATH, timeout=90, check_same_thread=False)
-                conn.execute("PRAGMA busy_timeout=60000;")  # 60 секунд
-                cursor = conn.cursor()
-                
-                # Получаем новость по ID
-                cursor.execute("""
-                    SELECT id, title, summary, sector, label, region, impact, confidence, sentiment, tickers_json
-                    FROM signals
-                    WHERE id = ?
-                """, (signal_id,))
-                
-                row = cursor.fetchone()
-                conn.close()
-                break
-            except sqlite3.OperationalError as e:
-                if "locked" in str(e).lower() and attempt < max_retries - 1:
-                    logger.warning(f"⚠️ База заблокирована, попытка {attempt + 1}/{max_retries}, жду 2 сек...")
-                    if conn:
-                        try:
-                            conn.close()
-                        except:
-                            pass
-                    await asyncio.sleep(2)  # Увеличили с 1 до 2 секунд
-                    continue
-                else:
-                    if conn:
-                        try:
-                            conn.close()
-                        except:
-                            pass
-                    raise
-        
-        if not row:
-            raise HTTPException(status_code=404, detail="Signal not found")
-        
-        # Создаем объект для анализа
-        item = {
-            "id": row[0],
-            "title": row[1],
-            "summary": row[2] or "",
-            "sector": row[3],
-            "label": row[4],
-            "region": row[5],
-            "impact": row[6],
-            "confidence": row[7],
-            "sentiment": row[8],
-            "tickers": json.loads(row[9]) if row[9] else []
-        }
-        
-        # Генерируем аналитику через LLM
-        logger.info(f"🔍 Генерация аналитики для {signal_id} на языке {language}")
-        
-        # Получаем полную информацию включая URL и дату
-        full_signal = None
-        try:
-            conn_full = sqlite3.connect(DB_PATH, timeout=90, check_same_thread=False)
-            cursor_full = conn_full.cursor()
-            cursor_full.execute("""
-                SELECT url, ts_published
-                FROM signals
-                WHERE id = ?
-            """, (signal_id,))
-            full_row = cursor_full.fetchone()
-            conn_full.close()
-            
-            if full_row:
-                item['url'] = full_row[0]
-                item['ts_published'] = full_row[1]
-        except Exception as e:
-            logger.warning(f"Could not fetch full signal data: {e}")
-        
-        # Форматируем дату для промпта
-        publish_date = ""
-        if item.get('ts_published'):
-            try:
-                from datetime import datetime
-                dt = datetime.fromisoformat(item['ts_published'].replace('Z', '+00:00'))
-                publish_date = dt.strftime('%B %d, %Y')
-            except:
-                pass
-        
-        # Формируем текст для анализа
-        text = f"""Title: {item['title']}
-Summary: {item['summary']}
-Source URL: {item.get('url', 'N/A')}
-Publication Date: {publish_date or 'Recent'}
-Sector: {item['sector']}
-Label: {item['label']}
-Region: {item['region']}
-Impact: {item['impact']}
-Confidence: {item['confidence']}
-Sentiment: {item['sentiment']}
-Tickers: {', '.join(item['tickers'])}"""
-        
-        # Создаем специальный промпт для анализа в зависимости от языка
-        if language == "en":
-            analysis_prompt = f"""You are a professional financial analyst at SAA Alliance. Analyze this news and provide a comprehensive market analysis.
-
-News data:
-{text}
+# Аналитика по требованию: инструкции — статический system-префикс (его кэширует провайдер), данные новости — в user
+ANALYSIS_SYSTEM_PROMPTS = {
+    "en": """You are a professional financial analyst at SAA Alliance. Analyze this news and provide a comprehensive market analysis.
 
 IMPORTANT: Pay attention to the Publication Date. Ensure your analysis is contextually appropriate for that time period. Do not use outdated information or reference events that haven't occurred yet relative to the publication date.
 
@@ -2233,14 +5062,8 @@ Provide a detailed analysis (100-150 words) covering:
 4. Investment opportunities
 5. Key metrics and trends
 
-Write the analysis in English. Be professional, data-driven, and provide actionable insights that are relevant to the publication date.
-
-Analysis:"""
-        else:
-            analysis_prompt = f"""Ты — профессиональный аналитик SAA Alliance. Проанализируй эту новость и дай развернутый анализ рынка.
-
-Данные новости:
-{text}
+Write the analysis in English. Be professional, data-driven, and provide actionable insights that are relevant to the publication date.""",
+    "ru": """Ты — профессиональный аналитик SAA Alliance. Проанализируй эту новость и дай развернутый анализ рынка.
 
 ВАЖНО: Обрати внимание на дату публикации (Publication Date). Убедись что твой анализ соответствует этому периоду времени. Не используй устаревшую информацию и не ссылайся на события которые еще не произошли относительно даты публикации.
 
@@ -2251,79 +5074,225 @@ Analysis:"""
 4. Инвестиционные возможности
 5. Ключевые метрики и тренды
 
-Пиши анализ на русском языке. Будь профессиональным, опирайся на данные и давай практические инсайты актуальные для даты публикации.
+Пиши анализ на русском языке. Будь профессиональным, опирайся на данные и давай практические инсайты актуальные для даты публикации.""",
+}
+ANALYSIS_USER_TMPL = {
+    "en": "News data:\n{text}\n\nAnalysis:",
+    "ru": "Данные новости:\n{text}\n\nАнализ:",
+}
 
-Анализ:"""
-        
-        # Для кнопки "Анализ" используем DeepSeek (быстро и дешево)
-        api_key = os.getenv("DEEPSEEK_API_KEY")
-        if not api_key:
-            raise HTTPException(status_code=500, detail="DEEPSEEK_API_KEY не настроен")
+async def prepare_analysis_request(signal_id: str, language: str) -> Tuple[str, str, Dict[str, Any]]:
+    """Читает новость и собирает запрос к LLM для аналитики по требованию: (api_url, api_key, payload)"""
+    # Retry логика для чтения из БД с увеличенными таймаутами
+    max_retries = 5  # Увеличили с 3 до 5
+    row = None
+    for attempt in range(max_retries):
+        try:
+            # Создаем соединение с увеличенным таймаутом
+            conn = sqlite3.connect(DB_PATH, timeout=90, check_same_thread=False)
+            conn.execute("PRAGMA busy_timeout=60000;")  # 60 секунд
+            cursor = conn.cursor()
+            
+            # Получаем новость по ID
+            cursor.execute("""
+                SELECT id, title, summary, sector, label, region, impact, confidence, sentiment, tickers_json
+                FROM signals
+                WHERE id = ?
+            """, (signal_id,))
+            
+            row = cursor.fetchone()
+            conn.close()
+            break
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e).lower() and attempt < max_retries - 1:
+                logger.warning(f"⚠️ База заблокирована, попытка {attempt + 1}/{max_retries}, жду 2 сек...")
+                if conn:
+                    try:
+                        conn.close()
+                    except:
+                        pass
+                await asyncio.sleep(2)  # Увеличили с 1 до 2 секунд
+                continue
+            else:
+                if conn:
+                    try:
+                        conn.close()
+                    except:
+                        pass
+                raise
+    
+    if not row:
+        raise HTTPException(status_code=404, detail="Signal not found")
+    
+    # Создаем объект для анализа
+    item = {
+        "id": row[0],
+        "title": row[1],
+        "summary": row[2] or "",
+        "sector": row[3],
+        "label": row[4],
+        "region": row[5],
+        "impact": row[6],
+        "confidence": row[7],
+        "sentiment": row[8],
+        "tickers": json.loads(row[9]) if row[9] else []
+    }
+    
+    # Генерируем аналитику через LLM
+    logger.info(f"🔍 Генерация аналитики для {signal_id} на языке {language}")
+    
+    # Получаем полную информацию включая URL и дату
+    full_signal = None
+    try:
+        conn_full = sqlite3.connect(DB_PATH, timeout=90, check_same_thread=False)
+        cursor_full = conn_full.cursor()
+        cursor_full.execute("""
+            SELECT url, ts_published
+            FROM signals
+            WHERE id = ?
+        """, (signal_id,))
+        full_row = cursor_full.fetchone()
+        conn_full.close()
         
-        api_url = "https://api.deepseek.com/v1/chat/completions"
-        model = "deepseek-chat"
-        logger.info("✅ Используем DeepSeek для генерации аналитики по требованию")
+        if full_row:
+            item['url'] = full_row[0]
+            item['ts_published'] = full_row[1]
+    except Exception as e:
+        logger.warning(f"Could not fetch full signal data: {e}")
+    
+    text = analysis_news_text(item)
+    
+    lang = "en" if language == "en" else "ru"
+    
+    # Для кнопки "Анализ" используем DeepSeek (быстро и дешево)
+    api_key = os.getenv("DEEPSEEK_API_KEY")
+    if not api_key:
+        raise HTTPException(status_code=500, detail="DEEPSEEK_API_KEY не настроен")
+    
+    api_url = DEEPSEEK_URL
+    model = "deepseek-chat"
+    logger.info("✅ Используем DeepSeek для генерации аналитики по требованию")
+    
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": ANALYSIS_SYSTEM_PROMPTS[lang]},
+            {"role": "user", "content": ANALYSIS_USER_TMPL[lang].format(text=text)}
+        ],
+        "temperature": 0.7,
+        "max_tokens": 500,
+        "stream": False
+    }
+    return api_url, api_key, payload
+
+def analysis_news_text(item: Dict[str, Any]) -> str:
+    """Карточка новости для промпта аналитики"""
+    # Форматируем дату для промпта
+    publish_date = ""
+    if item.get('ts_published'):
+        try:
+            from datetime import datetime
+            dt = datetime.fromisoformat(item['ts_published'].replace('Z', '+00:00'))
+            publish_date = dt.strftime('%B %d, %Y')
+        except:
+            pass
+    
+    # Формируем текст для анализа
+    text = f"""Title: {item['title']}
+Summary: {item['summary']}
+Source URL: {item.get('url', 'N/A')}
+Publication Date: {publish_date or 'Recent'}
+Sector: {item['sector']}
+Label: {item['label']}
+Region: {item['region']}
+Impact: {item['impact']}
+Confidence: {item['confidence']}
+Sentiment: {item['sentiment']}
+Tickers: {', '.join(item['tickers'])}"""
+    return text
+
+def load_signal_analysis(conn, signal_id: str, language: str) -> str:
+    """Готовая аналитика на нужном языке: signal_analysis, для старых записей — signals.analysis того же языка"""
+    row = conn.execute("SELECT analysis FROM signal_analysis WHERE signal_id = ? AND language = ?", (signal_id, language)).fetchone()
+    if row and row[0]:
+        return row[0]
+    row = conn.execute("SELECT analysis FROM signals WHERE id = ?", (signal_id,)).fetchone()
+    legacy = (row[0] or "") if row else ""
+    if legacy and bool(re.search("[А-Яа-яЁё]", legacy)) == (language == "ru"):
+        return legacy
+    return ""
+
+def store_signal_analysis(conn, signal_id: str, language: str, analysis_text: str, model: str = ""):
+    conn.execute("""INSERT INTO signal_analysis(signal_id, language, analysis, model, created_at) VALUES(?,?,?,?,?)
+                    ON CONFLICT(signal_id, language) DO UPDATE SET analysis=excluded.analysis, model=excluded.model,
+                        created_at=excluded.created_at""", (signal_id, language, analysis_text, model, time.time()))
+    if language == "ru":
+        # signals.analysis остаётся русской версией: её отдаёт список сигналов
+        conn.execute("UPDATE signals SET analysis = ? WHERE id = ?", (analysis_text, signal_id))
+
+async def save_signal_analysis(signal_id: str, analysis_text: str, language: str = "ru", model: str = "") -> bool:
+    """Сохраняет аналитику на языке language (с повторами при блокировке БД)"""
+    max_retries = 5
+    # Сохраняем в БД с улучшенной retry логикой
+    saved = False
+    for attempt in range(max_retries):
+        conn = None
+        try:
+            # Создаем соединение с увеличенным таймаутом
+            conn = sqlite3.connect(DB_PATH, timeout=90, check_same_thread=False)
+            conn.execute("PRAGMA busy_timeout=60000;")  # 60 секунд
+            store_signal_analysis(conn, signal_id, language, analysis_text, model)
+            conn.commit()
+            conn.close()
+            saved = True
+            logger.info(f"✅ Аналитика сохранена в БД для {signal_id}")
+            break
+        except sqlite3.OperationalError as e:
+            if conn:
+                try:
+                    conn.close()
+                except:
+                    pass
+            
+            if "locked" in str(e).lower() and attempt < max_retries - 1:
+                logger.warning(f"⚠️ База заблокирована при сохранении, попытка {attempt + 1}/{max_retries}, жду 3 сек...")
+                await asyncio.sleep(3)  # Увеличили до 3 секунд
+                continue
+            else:
+                logger.error(f"❌ Не удалось сохранить аналитику после {attempt + 1} попыток: {e}")
+                # Даже если не сохранили в БД - вернем результат пользователю
+                break
+        except Exception as e:
+            if conn:
+                try:
+                    conn.close()
+                except:
+                    pass
+            logger.error(f"❌ Неожиданная ошибка при сохранении: {e}")
+            break
+    
+    return saved
+
+@app.post("/generate-analysis/{signal_id}")
+async def generate_analysis_endpoint(signal_id: str, request: Request):
+    """Генерирует аналитику для конкретной новости по требованию"""
+    try:
+        body = await request.json()
+        language = body.get('language', 'ru')
+        refresh = bool(body.get('refresh', False))  # True — мимо кэша LLM, за новым вариантом
+        lang = "en" if language == "en" else "ru"
         
-        headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-        payload = {
-            "model": model,
-            "messages": [{"role": "user", "content": analysis_prompt}],
-            "temperature": 0.7,
-            "max_tokens": 500,
-            "stream": False
-        }
+        # Уже сгенерированная (в т.ч. заранее, precompute_analyses) аналитика — просто чтение из БД
+        stored = "" if refresh else read_signal_analysis(signal_id, lang)
+        if stored:
+            return {"analysis": stored, "stored": True}
         
-        timeout = 60  # DeepSeek быстрый
+        api_url, api_key, payload = await prepare_analysis_request(signal_id, language)
         
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            response = await client.post(api_url, headers=headers, json=payload)
-            response.raise_for_status()
-            data = response.json()
-            analysis_text = data["choices"][0]["message"]["content"].strip()
+        analysis_text = (await chat_completion("deepseek", api_url, api_key, payload, bypass_cache=refresh, site="on_demand")).strip()
         
         if analysis_text:
-            # Сохраняем в БД с улучшенной retry логикой
-            saved = False
-            for attempt in range(max_retries):
-                conn = None
-                try:
-                    # Создаем соединение с увеличенным таймаутом
-                    conn = sqlite3.connect(DB_PATH, timeout=90, check_same_thread=False)
-                    conn.execute("PRAGMA busy_timeout=60000;")  # 60 секунд
-                    cursor = conn.cursor()
-                    cursor.execute("""
-                        UPDATE signals
-                        SET analysis = ?
-                        WHERE id = ?
-                    """, (analysis_text, signal_id))
-                    conn.commit()
-                    conn.close()
-                    saved = True
-                    logger.info(f"✅ Аналитика сохранена в БД для {signal_id}")
-                    break
-                except sqlite3.OperationalError as e:
-                    if conn:
-                        try:
-                            conn.close()
-                        except:
-                            pass
-                    
-                    if "locked" in str(e).lower() and attempt < max_retries - 1:
-                        logger.warning(f"⚠️ База заблокирована при сохранении, попытка {attempt + 1}/{max_retries}, жду 3 сек...")
-                        await asyncio.sleep(3)  # Увеличили до 3 секунд
-                        continue
-                    else:
-                        logger.error(f"❌ Не удалось сохранить аналитику после {attempt + 1} попыток: {e}")
-                        # Даже если не сохранили в БД - вернем результат пользователю
-                        break
-                except Exception as e:
-                    if conn:
-                        try:
-                            conn.close()
-                        except:
-                            pass
-                    logger.error(f"❌ Неожиданная ошибка при сохранении: {e}")
-                    break
+            await save_signal_analysis(signal_id, analysis_text, lang, payload["model"])
             
             logger.info(f"✅ Аналитика сгенерирована для {signal_id} на языке {language}")
             return {"analysis": analysis_text}
@@ -2334,6 +5303,224 @@ Analysis:"""
         logger.error(f"❌ Ошибка генерации аналитики: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def read_signal_analysis(signal_id: str, language: str) -> str:
+    conn = None
+    try:
+        conn = db()
+        return load_signal_analysis(conn, signal_id, language)
+    except Exception as e:
+        logger.warning(f"Could not read stored analysis for {signal_id}: {e}")
+        return ""
+    finally:
+        if conn:
+            conn.close()
+
+ANALYSIS_STREAM_TASKS: set = set()  # живые генерации: держим ссылки, чтобы задачу не собрал GC
+
+def sse_event(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    """Одно событие text/event-stream"""
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.get("/generate-analysis/{signal_id}/stream")
+async def generate_analysis_stream(signal_id: str, language: str = "ru", refresh: bool = False):
+    """Потоковая аналитика по требованию (SSE): токены уходят в браузер по мере генерации, итог сохраняется в БД.
+
+    События: data {"delta"} — очередной кусок текста, event: done {"analysis"} — готовый текст,
+    event: failed {"error"} — генерация не удалась. Готовая аналитика приходит сразу одним событием done."""
+    lang = "en" if language == "en" else "ru"
+    stored = "" if refresh else read_signal_analysis(signal_id, lang)
+    if stored:
+        async def stored_event():
+            yield sse_event({"analysis": stored, "stored": True}, event="done")
+        return StreamingResponse(stored_event(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    api_url, api_key, payload = await prepare_analysis_request(signal_id, language)
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def generate():
+        # Генерация не привязана к соединению: если вкладку закрыли, текст всё равно допишется и сохранится
+        parts: List[str] = []
+        try:
+            async for delta in stream_chat_completion("deepseek", api_url, api_key, payload, bypass_cache=refresh, site="on_demand_stream"):
+                parts.append(delta)
+                queue.put_nowait(("delta", delta))
+            analysis_text = "".join(parts).strip()
+            if not analysis_text:
+                raise RuntimeError("Failed to generate analysis")
+            await save_signal_analysis(signal_id, analysis_text, lang, payload["model"])
+            logger.info(f"✅ Аналитика сгенерирована (stream) для {signal_id} на языке {language}")
+            queue.put_nowait(("done", analysis_text))
+        except Exception as e:
+            logger.error(f"❌ Ошибка потоковой генерации аналитики: {e}")
+            queue.put_nowait(("failed", str(e) or type(e).__name__))
+
+    task = asyncio.create_task(generate())
+    ANALYSIS_STREAM_TASKS.add(task)
+    task.add_done_callback(ANALYSIS_STREAM_TASKS.discard)
+
+    async def events():
+        while True:
+            kind, value = await queue.get()
+            if kind == "delta":
+                yield sse_event({"delta": value})
+            elif kind == "done":
+                yield sse_event({"analysis": value}, event="done")
+                return
+            else:
+                yield sse_event({"error": value}, event="failed")
+                return
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# ---------------- Analysis precompute ----------------
+# После каждого прогона пайплайна аналитика для важных свежих сигналов генерируется заранее —
+# сразу на двух языках одним вызовом LLM (общая карточка новости и системный промпт оплачиваются один раз).
+# Кнопка "Анализ" для таких сигналов — чтение из signal_analysis без ожидания модели.
+ANALYSIS_PRECOMPUTE_IMPACT = int(os.getenv("ANALYSIS_PRECOMPUTE_IMPACT", "70"))
+ANALYSIS_PRECOMPUTE_HOURS = int(os.getenv("ANALYSIS_PRECOMPUTE_HOURS", "24"))
+ANALYSIS_PRECOMPUTE_LIMIT = int(os.getenv("ANALYSIS_PRECOMPUTE_LIMIT", "20"))  # 0 — выключено
+ANALYSIS_PRECOMPUTE_CONCURRENCY = int(os.getenv("ANALYSIS_PRECOMPUTE_CONCURRENCY", "4"))
+ANALYSIS_PRECOMPUTE_MAX_ATTEMPTS = int(os.getenv("ANALYSIS_PRECOMPUTE_MAX_ATTEMPTS", "3"))
+ANALYSIS_PRECOMPUTE_RETRY_S = float(os.getenv("ANALYSIS_PRECOMPUTE_RETRY_S", "900"))  # пауза после неудачи, x2 на попытку
+PRECOMPUTE_STATS: Dict[str, int] = {"runs": 0, "generated": 0, "failed": 0}
+precompute_lock = asyncio.Lock()  # фоновый drain и run_pipeline не генерируют одни и те же сигналы параллельно
+
+ANALYSIS_BILINGUAL_SYSTEM = """You are a professional financial analyst at SAA Alliance. Analyze this news and provide a comprehensive market analysis in two languages.
+
+IMPORTANT: Pay attention to the Publication Date. Ensure your analysis is contextually appropriate for that time period. Do not use outdated information or reference events that haven't occurred yet relative to the publication date.
+
+Each analysis (100-150 words) covers:
+1. Market impact assessment (in the context of the date)
+2. Industry implications
+3. Risk factors
+4. Investment opportunities
+5. Key metrics and trends
+
+Return strict JSON: {"ru": "<analysis written in Russian>", "en": "<the same analysis written in English>"}.
+Be professional, data-driven, and provide actionable insights that are relevant to the publication date."""
+
+def precompute_candidates(conn, limit: int) -> List[Dict[str, Any]]:
+    """Важные свежие сигналы, у которых нет аналитики хотя бы на одном языке (кроме отложенных после неудач)"""
+    since = (datetime.now(timezone.utc) - timedelta(hours=ANALYSIS_PRECOMPUTE_HOURS)).isoformat()
+    rows = conn.execute("""SELECT id, title, summary, sector, label, region, impact, confidence, sentiment, tickers_json, url, ts_published
+                           FROM signals s
+                           WHERE impact >= ? AND ts_ingested >= ? AND is_test = 0
+                             AND (SELECT COUNT(*) FROM signal_analysis a WHERE a.signal_id = s.id AND a.language IN ('ru', 'en')) < 2
+                             AND NOT EXISTS (SELECT 1 FROM analysis_precompute_failures f WHERE f.signal_id = s.id
+                                             AND (f.attempts >= ? OR f.next_attempt_at > ?))
+                           ORDER BY impact DESC, ts_ingested DESC
+                           LIMIT ?""", (ANALYSIS_PRECOMPUTE_IMPACT, since, ANALYSIS_PRECOMPUTE_MAX_ATTEMPTS, time.time(), limit)).fetchall()
+    return [{
+        "id": r[0], "title": r[1], "summary": r[2] or "", "sector": r[3], "label": r[4], "region": r[5],
+        "impact": r[6], "confidence": r[7], "sentiment": r[8], "tickers": json.loads(r[9]) if r[9] else [],
+        "url": r[10], "ts_published": r[11],
+    } for r in rows]
+
+async def generate_bilingual_analysis(item: Dict[str, Any], api_key: str) -> Dict[str, str]:
+    """Один вызов LLM — аналитика на ru и en; ValueError, если ответ не содержит обе версии"""
+    payload = {
+        "model": DEEPSEEK_MODEL,
+        "messages": [
+            {"role": "system", "content": ANALYSIS_BILINGUAL_SYSTEM},
+            {"role": "user", "content": ANALYSIS_USER_TMPL["en"].format(text=analysis_news_text(item))},
+        ],
+        "temperature": 0.7,
+        "max_tokens": 1000,
+        "response_format": {"type": "json_object"},
+    }
+    content = await chat_completion("deepseek", DEEPSEEK_URL, api_key, payload, site="precompute")
+    try:
+        parsed = json.loads(content)
+        texts = {lang: str(parsed.get(lang) or "").strip() for lang in ("ru", "en")}
+        if not all(texts.values()):
+            raise ValueError(f"missing language in answer: {sorted(k for k, v in texts.items() if not v)}")
+    except (ValueError, AttributeError) as e:
+        llm_cache_discard("deepseek", payload)
+        raise ValueError(f"bad bilingual analysis: {e}")
+    return texts
+
+def record_precompute_failure(signal_id: str, error: str):
+    conn = None
+    try:
+        conn = db()
+        row = conn.execute("SELECT attempts FROM analysis_precompute_failures WHERE signal_id = ?", (signal_id,)).fetchone()
+        attempts = (row[0] if row else 0) + 1
+        safe_execute(conn, """INSERT INTO analysis_precompute_failures(signal_id, attempts, next_attempt_at, last_error) VALUES(?,?,?,?)
+                              ON CONFLICT(signal_id) DO UPDATE SET attempts=excluded.attempts,
+                                  next_attempt_at=excluded.next_attempt_at, last_error=excluded.last_error""",
+                     (signal_id, attempts, time.time() + ANALYSIS_PRECOMPUTE_RETRY_S * 2 ** (attempts - 1), error[:500]))
+        conn.commit()
+    except Exception as e:
+        logger.warning(f"PRECOMPUTE: could not record failure for {signal_id}: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+async def precompute_analyses() -> int:
+    """Заранее генерирует ru+en аналитику для сигналов с impact >= ANALYSIS_PRECOMPUTE_IMPACT"""
+    api_key = os.getenv("DEEPSEEK_API_KEY")
+    if ANALYSIS_PRECOMPUTE_LIMIT <= 0 or not api_key:
+        return 0
+    if precompute_lock.locked():
+        return 0  # уже идёт: новые сигналы подхватит следующий прогон
+    async with precompute_lock:
+        return await _precompute_analyses(api_key)
+
+async def _precompute_analyses(api_key: str) -> int:
+    conn = None
+    try:
+        conn = db()
+        items = precompute_candidates(conn, ANALYSIS_PRECOMPUTE_LIMIT)
+    finally:
+        if conn:
+            conn.close()
+    if not items:
+        return 0
+    PRECOMPUTE_STATS["runs"] += 1
+    sem = asyncio.Semaphore(ANALYSIS_PRECOMPUTE_CONCURRENCY)
+
+    async def one(item):
+        async with sem:
+            try:
+                texts = await generate_bilingual_analysis(item, api_key)
+            except Exception as e:
+                PRECOMPUTE_STATS["failed"] += 1
+                logger.warning(f"PRECOMPUTE: {item['id']} failed: {e}")
+                record_precompute_failure(item["id"], str(e) or type(e).__name__)
+                return 0
+            for lang, text in texts.items():
+                await save_signal_analysis(item["id"], text, lang, DEEPSEEK_MODEL)
+            PRECOMPUTE_STATS["generated"] += 1
+            return 1
+
+    generated = sum(await asyncio.gather(*[one(it) for it in items]))
+    logger.info(f"PRECOMPUTE: bilingual analysis for {generated}/{len(items)} signals (impact >= {ANALYSIS_PRECOMPUTE_IMPACT})")
+    return generated
+
+@app.get("/analysis/precompute")
+async def analysis_precompute_status():
+    """Покрытие заранее сгенерированной аналитикой: сколько важных свежих сигналов уже имеют ru/en"""
+    since = (datetime.now(timezone.utc) - timedelta(hours=ANALYSIS_PRECOMPUTE_HOURS)).isoformat()
+    conn = None
+    try:
+        conn = db()
+        eligible, ru, en = conn.execute("""SELECT COUNT(*),
+                   SUM(EXISTS(SELECT 1 FROM signal_analysis a WHERE a.signal_id = s.id AND a.language = 'ru')),
+                   SUM(EXISTS(SELECT 1 FROM signal_analysis a WHERE a.signal_id = s.id AND a.language = 'en'))
+            FROM signals s WHERE impact >= ? AND ts_ingested >= ? AND is_test = 0""", (ANALYSIS_PRECOMPUTE_IMPACT, since)).fetchone()
+    finally:
+        if conn:
+            conn.close()
+    return {
+        "impact_threshold": ANALYSIS_PRECOMPUTE_IMPACT,
+        "hours": ANALYSIS_PRECOMPUTE_HOURS,
+        "eligible": eligible,
+        "ready": {"ru": ru or 0, "en": en or 0},
+        "stats": PRECOMPUTE_STATS,
+    }
+
 @app.get("/telegram-digest")
 async def telegram_digest(sector: Optional[str] = None, min_impact: int = 40, limit: int = 50, starred_only: bool = False, date_from: Optional[str] = None, date_to: Optional[str] = None, sentiment: Optional[int] = None, region: Optional[str] = None, min_confidence: int = 0, language: str = "ru"):
     """Генерирует Telegram-дайджест в нужном формате"""
@@ -2565,14 +5752,13 @@ async def telegram_send(content: dict = Body(...)):
         return {"success": False, "error": "Telegram token not configured"}
     
     try:
-        import requests
         url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
         data = {
             "chat_id": TELEGRAM_CHANNEL,
             "text": content["content"],
             "parse_mode": "HTML"
         }
-        response = requests.post(url, data=data, timeout=10)
+        response = await http_clients.get("misc").post(url, data=data)
         if response.status_code == 200:
             return {"success": True}
         else:
@@ -2582,7 +5768,18 @@ async def telegram_send(content: dict = Body(...)):
 
 # ---------------- Run (local) ----------------
 if __name__ == "__main__":
-    import uvicorn
-    port = int(os.getenv("PORT", 8080))
-    # Безопасность: только localhost, не внешние IP
-    uvicorn.run(app, host="127.0.0.1", port=port)
+    # python app.py            — API + пайплайн (APP_ROLE=all)
+    # python -m app api        — только API, без планировщика
+    # python -m app worker     — только опрос фидов и анализ, без HTTP
+    import sys
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "worker":
+        APP_ROLE = "worker"
+        asyncio.run(run_worker())
+    else:
+        import uvicorn
+        if command == "api":
+            APP_ROLE = "api"
+        port = int(os.getenv("PORT", 8080))
+        # Безопасность: только localhost, не внешние IP
+        uvicorn.run(app, host="127.0.0.1", port=port)
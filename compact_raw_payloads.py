@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Перенос сырых payload'ов (ingested.raw / signals.raw) в сжатую таблицу raw_payloads
+"""
+import json
+import os
+import sys
+from app import DB_PATH, RAW_INGEST_FIELDS, db, raw_payload_rows
+
+BATCH = 500
+
+def legacy_stats(conn):
+    stats = {}
+    for table in ("ingested", "signals"):
+        count, size = conn.execute(
+            f"SELECT COUNT(*), IFNULL(SUM(LENGTH(raw)), 0) FROM {table} WHERE raw IS NOT NULL AND raw != ''"
+        ).fetchone()
+        stats[table] = (count, size)
+    return stats
+
+def compact(dry_run: bool = True):
+    conn = db()
+
+    print("=" * 70)
+    print("📦 СЖАТИЕ СЫРЫХ PAYLOAD'ОВ")
+    print("=" * 70)
+
+    stats = legacy_stats(conn)
+    for table, (count, size) in stats.items():
+        print(f"   • {table:10s}: {count:,} записей, {size / 1024 / 1024:.1f} MB в колонке raw")
+
+    if not any(count for count, _ in stats.values()):
+        print("\n✅ Несжатых payload'ов нет.")
+        conn.close()
+        return
+
+    if dry_run:
+        print(f"\n⚠️  РЕЖИМ ТЕСТИРОВАНИЯ (dry run)")
+        print(f"   Данные НЕ будут изменены.")
+        print(f"\n💡 Для реального переноса запустите:")
+        print(f"   python compact_raw_payloads.py --execute")
+        conn.close()
+        return
+
+    for table, kind in (("ingested", "ingest"), ("signals", "signal")):
+        moved = 0
+        while True:
+            rows = conn.execute(
+                f"SELECT id, raw FROM {table} WHERE raw IS NOT NULL AND raw != '' LIMIT ?", (BATCH,)
+            ).fetchall()
+            if not rows:
+                break
+            items = []
+            for item_id, raw in rows:
+                try:
+                    obj = json.loads(raw)
+                except ValueError:
+                    obj = raw
+                if kind == "ingest" and isinstance(obj, dict):
+                    obj = {k: v for k, v in obj.items() if k in RAW_INGEST_FIELDS and v and v != "None"}
+                items.append((item_id, kind, obj))
+            conn.executemany(
+                "INSERT OR REPLACE INTO raw_payloads(id, kind, codec, size, data) VALUES(?,?,?,?,?)",
+                raw_payload_rows(items)
+            )
+            conn.executemany(f"UPDATE {table} SET raw = NULL WHERE id = ?", [(r[0],) for r in rows])
+            conn.commit()
+            moved += len(rows)
+        print(f"✅ {table}: перенесено {moved:,} payload'ов")
+
+    print("📦 Оптимизирую базу данных...")
+    conn.execute("VACUUM")
+    conn.close()
+
+    db_size_mb = os.path.getsize(DB_PATH) / 1024 / 1024
+    print(f"   • Размер базы: {db_size_mb:.1f} MB")
+    print("\n" + "=" * 70)
+
+if __name__ == "__main__":
+    compact(dry_run="--execute" not in sys.argv)
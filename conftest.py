@@ -0,0 +1,12 @@
+import pytest
+
+import app
+
+
+@pytest.fixture
+def tmp_db(tmp_path, monkeypatch):
+    """Отдельная SQLite-база на тест (схема создаётся app.db() при первом подключении)"""
+    monkeypatch.setattr(app, "DB_PATH", str(tmp_path / "signals.db"))
+    conn = app.db()
+    yield conn
+    conn.close()
@@ -10,6 +10,7 @@ from datetime import datetime
 import asyncio
 import httpx
 from typing import Dict, Any
+from app import OPENAI_URL, chat_completion
 
 # Настройки
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -32,47 +33,35 @@ Return ONLY valid JSON, no other text.
 """
 
 async def call_openai(title: str) -> Dict[str, Any]:
-    """Вызов OpenAI API для анализа"""
+    """Вызов OpenAI API для анализа (через кэш ответов LLM приложения)"""
+    payload = {
+        "model": "gpt-4o-mini",
+        "messages": [
+            {"role": "user", "content": PROMPT_TMPL.format(title=title)}
+        ],
+        "temperature": 0.3,
+        "max_tokens": 1000
+    }
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {OPENAI_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "gpt-4o-mini",
-                    "messages": [
-                        {"role": "user", "content": PROMPT_TMPL.format(title=title)}
-                    ],
-                    "temperature": 0.3,
-                    "max_tokens": 1000
-                }
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                content = result["choices"][0]["message"]["content"].strip()
-                
-                # Парсим JSON
-                try:
-                    parsed = json.loads(content)
-                    return {
-                        "title_ru": parsed.get("title_ru", ""),
-                        "analysis": parsed.get("analysis", "")
-                    }
-                except json.JSONDecodeError:
-                    print(f"❌ Ошибка парсинга JSON для: {title[:50]}...")
-                    return {"title_ru": "", "analysis": ""}
-            else:
-                print(f"❌ OpenAI API ошибка {response.status_code}: {response.text}")
-                return {"title_ru": "", "analysis": ""}
-                
+        content = (await chat_completion("openai", OPENAI_URL, OPENAI_API_KEY, payload, site="missing_analysis")).strip()
+    except httpx.HTTPStatusError as e:
+        print(f"❌ OpenAI API ошибка {e.response.status_code}: {e.response.text}")
+        return {"title_ru": "", "analysis": ""}
     except Exception as e:
         print(f"❌ Ошибка вызова OpenAI: {e}")
         return {"title_ru": "", "analysis": ""}
 
+    # Парсим JSON
+    try:
+        parsed = json.loads(content)
+        return {
+            "title_ru": parsed.get("title_ru", ""),
+            "analysis": parsed.get("analysis", "")
+        }
+    except json.JSONDecodeError:
+        print(f"❌ Ошибка парсинга JSON для: {title[:50]}...")
+        return {"title_ru": "", "analysis": ""}
+
 async def main():
     """Основная функция"""
     print("🚀 Генерация недостающей аналитики...")
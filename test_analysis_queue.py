@@ -0,0 +1,106 @@
+import time
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def queue(tmp_db, monkeypatch):
+    monkeypatch.setattr(app, "WORKER_ID", "worker-a")
+    monkeypatch.setattr(app, "ANALYSIS_RETRY_BASE_S", 300.0)
+    monkeypatch.setattr(app, "ANALYSIS_RETRY_MAX_S", 3600.0)
+    monkeypatch.setattr(app, "ANALYSIS_MAX_ATTEMPTS", 5)
+    ids = ["a", "b", "c"]
+    tmp_db.executemany("INSERT INTO ingested(id, ts_utc, sector, title, link, source) VALUES(?,?,?,?,?,?)",
+                       [(i, "2026-01-01T00:00:00+00:00", "crypto", f"title {i}", f"https://x.com/{i}", "feed") for i in ids])
+    app.enqueue_jobs(tmp_db, ids)
+    tmp_db.commit()
+    return tmp_db
+
+
+def job(conn, item_id):
+    row = conn.execute("""SELECT status, attempts, next_attempt_at, lease_owner, lease_until, last_error
+                          FROM analysis_jobs WHERE item_id = ?""", (item_id,)).fetchone()
+    return dict(zip(("status", "attempts", "next_attempt_at", "lease_owner", "lease_until", "last_error"), row))
+
+
+def test_enqueue_is_idempotent(queue):
+    assert app.enqueue_jobs(queue, ["a", "b", "d"]) == 1
+    assert queue.execute("SELECT COUNT(*) FROM analysis_jobs").fetchone()[0] == 4
+
+
+def test_claim_is_exclusive(queue, monkeypatch):
+    claimed = app.claim_jobs(10)
+    assert sorted(it["id"] for it in claimed) == ["a", "b", "c"]
+    assert claimed[0]["title"].startswith("title")
+    monkeypatch.setattr(app, "WORKER_ID", "worker-b")
+    assert app.claim_jobs(10) == []
+    assert job(queue, "a")["lease_owner"] == "worker-a" and job(queue, "a")["attempts"] == 1
+
+
+def test_expired_lease_is_reclaimed(queue, monkeypatch):
+    monkeypatch.setattr(app, "ANALYSIS_LEASE_SECONDS", -1.0)  # аренда истекает сразу
+    assert len(app.claim_jobs(1)) == 1
+    monkeypatch.setattr(app, "WORKER_ID", "worker-b")
+    monkeypatch.setattr(app, "ANALYSIS_LEASE_SECONDS", 900.0)
+    reclaimed = app.claim_jobs(10)
+    assert len(reclaimed) == 3
+    first = [it["id"] for it in reclaimed if job(queue, it["id"])["attempts"] == 2]
+    assert len(first) == 1 and job(queue, first[0])["lease_owner"] == "worker-b"
+
+
+@pytest.mark.parametrize("attempts, expected", [(1, 300), (2, 600), (3, 1200), (4, 2400)])
+def test_retry_backoff_is_exponential(queue, attempts, expected):
+    app.claim_jobs(1)
+    item_id = queue.execute("SELECT item_id FROM analysis_jobs WHERE status = 'leased'").fetchone()[0]
+    queue.execute("UPDATE analysis_jobs SET attempts = ? WHERE item_id = ?", (attempts, item_id))
+    before = time.time()
+    app.fail_job(queue, item_id, "boom")
+    state = job(queue, item_id)
+    assert state["status"] == "queued" and state["lease_owner"] is None and state["last_error"] == "boom"
+    assert before + expected <= state["next_attempt_at"] <= time.time() + expected
+
+
+def test_retry_backoff_is_capped(queue, monkeypatch):
+    monkeypatch.setattr(app, "ANALYSIS_MAX_ATTEMPTS", 20)
+    app.claim_jobs(1)
+    item_id = queue.execute("SELECT item_id FROM analysis_jobs WHERE status = 'leased'").fetchone()[0]
+    queue.execute("UPDATE analysis_jobs SET attempts = 10 WHERE item_id = ?", (item_id,))
+    before = time.time()
+    app.fail_job(queue, item_id, "boom")
+    assert before + app.ANALYSIS_RETRY_MAX_S <= job(queue, item_id)["next_attempt_at"] <= time.time() + app.ANALYSIS_RETRY_MAX_S
+
+
+def test_dead_after_max_attempts(queue):
+    app.claim_jobs(1)
+    item_id = queue.execute("SELECT item_id FROM analysis_jobs WHERE status = 'leased'").fetchone()[0]
+    queue.execute("UPDATE analysis_jobs SET attempts = ? WHERE item_id = ?", (app.ANALYSIS_MAX_ATTEMPTS, item_id))
+    app.fail_job(queue, item_id, "poison")
+    state = job(queue, item_id)
+    assert state["status"] == "dead" and state["next_attempt_at"] is None
+    queue.commit()
+    assert item_id not in [it["id"] for it in app.claim_jobs(10)]
+
+
+def test_complete_and_fail_respect_lease_owner(queue, monkeypatch):
+    app.claim_jobs(10)
+    monkeypatch.setattr(app, "WORKER_ID", "worker-b")
+    app.complete_job(queue, "a")
+    app.fail_job(queue, "b", "late")
+    assert job(queue, "a")["status"] == "leased"
+    assert job(queue, "b")["status"] == "leased" and job(queue, "b")["attempts"] == 1
+    monkeypatch.setattr(app, "WORKER_ID", "worker-a")
+    app.complete_job(queue, "a")
+    assert job(queue, "a")["status"] == "done" and job(queue, "a")["lease_owner"] is None
+
+
+def test_release_does_not_count_attempt(queue):
+    app.claim_jobs(10)
+    queue.commit()
+    app.release_jobs(["a", "b"])
+    for item_id in ("a", "b"):
+        state = job(queue, item_id)
+        assert (state["status"], state["attempts"], state["lease_owner"]) == ("queued", 0, None)
+    assert job(queue, "c")["status"] == "leased"
+    assert sorted(it["id"] for it in app.claim_jobs(10)) == ["a", "b"]
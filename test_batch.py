@@ -0,0 +1,133 @@
+import asyncio
+import json
+
+import pytest
+
+import app
+from app import LLMResult, extract_json_items
+
+
+def compact(item_id, impact=60):
+    return {"id": item_id, "t": "Заголовок", "s": "Сводка", "l": 0, "i": impact, "c": 70, "se": 1, "r": "US", "k": [], "w": 1}
+
+
+@pytest.mark.parametrize("content, ids", [
+    ('{"items": [{"id": 1, "s": "a"}, {"id": "2", "s": "b"}]}', ["1", "2"]),
+    ('[{"id": 1}, {"id": 2}]', ["1", "2"]),
+    ('```json\n{"items": [{"id": 1}, {"id": 3}]}\n```', ["1", "3"]),
+    ('Вот ответ:\n```\n[{"id": "2"}]\n```\nГотово.', ["2"]),
+    # записи без id и не-объекты пропускаются
+    ('{"items": [{"s": "no id"}, {"id": null}, "junk", 7, {"id": 4}]}', ["4"]),
+    ('{"result": [{"id": 1}]}', []),
+    ('{"items": {"id": 1}}', []),
+    ("not json at all", []),
+    ("", []),
+])
+def test_extract_json_items(content, ids):
+    assert list(extract_json_items(content)) == ids
+
+
+@pytest.fixture
+def fake_chat(monkeypatch):
+    """Подменяет chat_completion; тест задаёт текст ответа, вызовы и удаления из кэша записываются"""
+    monkeypatch.setattr(app, "LLM_OUTPUT_SCHEMA", "compact")
+    state = {"calls": [], "discarded": []}
+
+    async def chat_completion(provider, url, api_key, payload, site="other", items=1, bypass_cache=False):
+        state["calls"].append(payload)
+        answer = state["answer"]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    monkeypatch.setattr(app, "chat_completion", chat_completion)
+    monkeypatch.setattr(app, "llm_cache_discard", lambda provider, payload: state["discarded"].append(payload))
+    return state
+
+
+def call_batch(texts):
+    return asyncio.run(app._call_batch("OpenAI", "https://llm.test", "key", "model", texts))
+
+
+def test_call_batch_maps_prompt_keys_back_to_item_ids(fake_chat):
+    fake_chat["answer"] = json.dumps({"items": [compact(2, impact=80), compact(1)]})
+    out = call_batch({"art-a": "A", "art-b": "B"})
+    assert set(out) == {"art-a", "art-b"}
+    assert out["art-b"].impact == 80
+    assert fake_chat["discarded"] == []
+
+
+def test_call_batch_partial_answer_returns_valid_items_and_discards_cache(fake_chat):
+    bad = dict(compact(3), i=150)  # вне диапазона — не проходит проверку
+    fake_chat["answer"] = "```json\n" + json.dumps({"items": [compact(1), {"s": "без id"}, bad, compact(9)]}) + "\n```"
+    out = call_batch({"art-a": "A", "art-b": "B", "art-c": "C"})
+    assert list(out) == ["art-a"]
+    assert fake_chat["discarded"] == fake_chat["calls"]
+
+
+def test_call_batch_request_failure_returns_empty(fake_chat):
+    fake_chat["answer"] = RuntimeError("HTTP 500")
+    assert call_batch({"art-a": "A", "art-b": "B"}) == {}
+
+
+def test_call_batch_rate_limit_propagates(fake_chat):
+    fake_chat["answer"] = app.LLMRateLimited("openai")
+    with pytest.raises(app.LLMRateLimited):
+        call_batch({"art-a": "A"})
+
+
+def news(n):
+    return {"id": f"art-{n}", "title": f"Headline {n}", "link": f"https://news.com/{n}", "sector": "crypto",
+            "published": "2026-03-01T10:00:00+00:00"}
+
+
+def result(summary):
+    return LLMResult(summary=summary, label="Markets", impact=60, confidence=70)
+
+
+@pytest.fixture
+def one_provider(monkeypatch):
+    monkeypatch.setattr(app, "LLM_CASCADE", False)
+    monkeypatch.setattr(app, "LLM_POLICY", "all")
+    monkeypatch.setattr(app, "LLM_LATENCY", {})
+    state = {"batch": [], "single": []}
+
+    async def batch(texts):
+        state["batch"].append(list(texts))
+        return {item_id: result("batch") for item_id in list(texts)[::2]}  # модель «потеряла» каждую вторую
+
+    async def single(text):
+        state["single"].append(text)
+        return result("single")
+
+    monkeypatch.setattr(app, "PROVIDERS", {"openai": single})
+    monkeypatch.setattr(app, "BATCH_PROVIDERS", {"openai": batch})
+    return state
+
+
+def test_analyze_batch_re_requests_only_missing_items(one_provider):
+    items = [news(n) for n in range(5)]
+    signals = asyncio.run(app.analyze_batch(items))
+    assert one_provider["batch"] == [[it["id"] for it in items]]
+    assert one_provider["single"] == [app.item_text(items[1]), app.item_text(items[3])]
+    assert [s["summary"] for s in signals] == ["batch", "single", "batch", "single", "batch"]
+    assert [s["id"] for s in signals] == [it["id"] for it in items]
+
+
+def test_analyze_batch_single_failure_leaves_only_that_item_empty(one_provider, monkeypatch):
+    async def single(text):
+        raise RuntimeError("timeout")
+
+    monkeypatch.setattr(app, "PROVIDERS", {"openai": single})
+    signals = asyncio.run(app.analyze_batch([news(n) for n in range(3)]))
+    assert [s is None for s in signals] == [False, True, False]
+
+
+def test_analyze_batch_rate_limited_does_not_fall_back_to_singles(one_provider, monkeypatch):
+    async def batch(texts):
+        raise app.LLMRateLimited("openai")
+
+    monkeypatch.setattr(app, "BATCH_PROVIDERS", {"openai": batch})
+    signals = asyncio.run(app.analyze_batch([news(n) for n in range(3)]))
+    assert signals == [None, None, None]
+    assert one_provider["single"] == []
@@ -0,0 +1,55 @@
+import pytest
+
+from app import article_id, canonical_url
+
+
+@pytest.mark.parametrize("url, expected", [
+    # трекинг-параметры
+    ("https://news.com/a?utm_source=tw&utm_medium=social&id=7", "https://news.com/a?id=7"),
+    ("https://news.com/a?UTM_Campaign=x", "https://news.com/a"),
+    ("https://news.com/a?fbclid=IwAR0abc", "https://news.com/a"),
+    ("https://news.com/a?gclid=1&ref=rss&page=2", "https://news.com/a?page=2"),
+    # порядок параметров
+    ("https://news.com/a?b=2&a=1", "https://news.com/a?a=1&b=2"),
+    ("https://news.com/a?a=1&b=2", "https://news.com/a?a=1&b=2"),
+    ("https://news.com/a?q=", "https://news.com/a?q="),
+    # регистр схемы и хоста (путь регистр сохраняет)
+    ("HTTPS://News.COM/Markets/Story", "https://news.com/Markets/Story"),
+    # фрагмент
+    ("https://news.com/a#comments", "https://news.com/a"),
+    ("https://news.com/a?x=1#top", "https://news.com/a?x=1"),
+    # порт по умолчанию
+    ("https://news.com:443/a", "https://news.com/a"),
+    ("http://news.com:80/a", "http://news.com/a"),
+    ("https://news.com:8443/a", "https://news.com:8443/a"),
+    ("http://news.com:443/a", "http://news.com:443/a"),
+    # завершающий слэш
+    ("https://news.com/a/", "https://news.com/a"),
+    ("https://news.com/a//", "https://news.com/a"),
+    ("https://news.com/", "https://news.com/"),
+    ("https://news.com", "https://news.com/"),
+    # пусто / пробелы
+    ("  https://news.com/a  ", "https://news.com/a"),
+    ("", ""),
+])
+def test_canonical_url(url, expected):
+    assert canonical_url(url) == expected
+
+
+@pytest.mark.parametrize("a, b", [
+    ("https://News.com/a/?utm_source=x&b=2&a=1#frag", "https://news.com:443/a?a=1&b=2"),
+    ("https://news.com/a?fbclid=1", "https://news.com/a"),
+    ("https://news.com", "https://news.com/"),
+])
+def test_article_id_is_stable_across_url_variants(a, b):
+    assert article_id(a, "title A") == article_id(b, "title B")
+
+
+def test_article_id_differs_for_different_articles():
+    assert article_id("https://news.com/a") != article_id("https://news.com/b")
+    assert article_id("https://news.com/a?id=1") != article_id("https://news.com/a?id=2")
+
+
+def test_article_id_falls_back_to_title():
+    assert article_id("", "Same title") == article_id(None, "Same title")
+    assert article_id("", "Same title") != article_id("", "Other title")
@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+from app import ACTION_WINDOW_CODES, LABEL_CODES, _compact_code, _compact_int, llm_result_from_compact
+
+
+def answer(**overrides):
+    base = {"t": "Заголовок", "s": "Сводка", "l": 0, "i": 60, "c": 70, "se": 1, "r": "US", "k": ["btc"], "w": 1}
+    base.update(overrides)
+    return {k: v for k, v in base.items() if v is not None}
+
+
+def test_valid_answer():
+    r = llm_result_from_compact(answer())
+    assert (r.label, r.impact, r.confidence, r.sentiment) == (LABEL_CODES[0], 60, 70, 1)
+    assert r.region == "US" and r.tickers == ["BTC"] and r.action_window == ACTION_WINDOW_CODES[1]
+
+
+@pytest.mark.parametrize("value, expected", [("42", 42), (" -1 ", -1), ("+7", 7), (42.0, 42), (0, 0), (100, 100)])
+def test_compact_int_accepts_integers_and_digit_strings(value, expected):
+    assert _compact_int({"x": value}, "x", -100, 100) == expected
+
+
+@pytest.mark.parametrize("value", [True, False, 4.5, "4.5", "", "high", None, [1], float("nan"), float("inf")])
+def test_compact_int_rejects_non_integers(value):
+    with pytest.raises(ValueError):
+        _compact_int({"x": value}, "x", -100, 1000)
+
+
+@pytest.mark.parametrize("key, value", [("i", 101), ("i", -1), ("c", 150), ("se", 2), ("se", -2), ("l", len(LABEL_CODES)), ("w", 3)])
+def test_out_of_range_is_rejected(key, value):
+    with pytest.raises(ValueError):
+        llm_result_from_compact(answer(**{key: value}))
+
+
+def test_label_name_instead_of_code():
+    assert llm_result_from_compact(answer(l=LABEL_CODES[2])).label == LABEL_CODES[2]
+    assert _compact_code({"w": " >1w "}, "w", ACTION_WINDOW_CODES) == ">1w"
+    assert _compact_code({"l": str(len(LABEL_CODES) - 1)}, "l", LABEL_CODES) == LABEL_CODES[-1]
+    with pytest.raises(ValueError):
+        llm_result_from_compact(answer(l="not-a-label"))
+
+
+@pytest.mark.parametrize("summary", [None, "", "   ", 5, ["s"]])
+def test_missing_or_bad_summary(summary):
+    with pytest.raises(ValueError):
+        llm_result_from_compact(answer(s=summary))
+
+
+def test_optional_keys_default():
+    r = llm_result_from_compact(answer(se=None, r=None, k=None, w=None, t=None))
+    assert (r.sentiment, r.region, r.tickers, r.action_window, r.title_ru) == (0, "US", [], ACTION_WINDOW_CODES[2], "")
+
+
+@pytest.mark.parametrize("key", ["l", "i", "c"])
+def test_required_keys(key):
+    with pytest.raises(ValueError):
+        llm_result_from_compact(answer(**{key: None}))
+
+
+@pytest.mark.parametrize("overrides", [{"r": "MARS"}, {"r": 1}, {"k": "BTC"}, {"k": [1]}, {"t": 3}])
+def test_bad_region_tickers_title(overrides):
+    with pytest.raises(ValueError):
+        llm_result_from_compact(answer(**overrides))
+
+
+@pytest.mark.parametrize("parsed", [[], "text", None, 3])
+def test_not_an_object(parsed):
+    with pytest.raises(ValueError):
+        llm_result_from_compact(parsed)
+
+
+def test_decodes_parsed_json_with_infinity():
+    with pytest.raises(ValueError):
+        llm_result_from_compact(json.loads('{"s": "x", "l": 0, "i": Infinity, "c": 50}'))
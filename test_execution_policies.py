@@ -0,0 +1,170 @@
+import asyncio
+import time
+
+import pytest
+
+import app
+from app import LatencyHistogram, LLMResult, _quorum_reached
+
+
+def result(label="Markets", impact=60):
+    return LLMResult(summary="s", label=label, impact=impact, confidence=70)
+
+
+@pytest.fixture(autouse=True)
+def fresh_latency(monkeypatch):
+    monkeypatch.setattr(app, "LLM_LATENCY", {})
+    monkeypatch.setattr(app, "LLM_QUORUM", 2)
+
+
+@pytest.mark.parametrize("by_provider, item_ids, reached", [
+    # два из трёх совпали по label и полосе impact (50-74)
+    ({"a": {"1": result(impact=55)}, "b": {"1": result(impact=70)}, "c": {"1": result("Tech")}}, ["1"], True),
+    # label совпал, полоса impact разная
+    ({"a": {"1": result(impact=45)}, "b": {"1": result(impact=55)}}, ["1"], False),
+    # impact 100 попадает в верхнюю полосу вместе с 75-99
+    ({"a": {"1": result(impact=100)}, "b": {"1": result(impact=80)}}, ["1"], True),
+    # ошибка провайдера — не голос
+    ({"a": {"1": result()}, "b": {"1": ValueError("bad json")}}, ["1"], False),
+    # один провайдер ещё не ответил
+    ({"a": {"1": result()}}, ["1"], False),
+    ({}, ["1"], False),
+    # кворум нужен по каждой новости
+    ({"a": {"1": result(), "2": result()}, "b": {"1": result(), "2": result("Tech")}}, ["1", "2"], False),
+    ({"a": {"1": result(), "2": result("Tech")}, "b": {"1": result(), "2": result("Tech")}}, ["1", "2"], True),
+])
+def test_quorum_reached(by_provider, item_ids, reached):
+    assert _quorum_reached(by_provider, item_ids) is reached
+
+
+def test_quorum_size_is_configurable(monkeypatch):
+    monkeypatch.setattr(app, "LLM_QUORUM", 3)
+    by_provider = {"a": {"1": result()}, "b": {"1": result()}}
+    assert not _quorum_reached(by_provider, ["1"])
+    by_provider["c"] = {"1": result()}
+    assert _quorum_reached(by_provider, ["1"])
+
+
+def test_histogram_quantile_empty():
+    assert LatencyHistogram().quantile(0.9) is None
+
+
+def test_histogram_quantile_returns_bucket_upper_bound():
+    hist = LatencyHistogram()
+    for _ in range(90):
+        hist.record(0.05)  # первая корзина: <= 0.1 с
+    for _ in range(10):
+        hist.record(3.0)
+    assert hist.quantile(0.5) == 0.1
+    assert hist.quantile(0.9) == 0.1
+    assert hist.quantile(0.95) == next(b for b in LatencyHistogram.BOUNDS if b >= 3.0)
+    assert hist.report()["count"] == 100
+
+
+def test_histogram_overflow_bucket_reports_last_bound():
+    hist = LatencyHistogram()
+    hist.record(10_000)
+    assert hist.counts[-1] == 1
+    assert hist.quantile(0.99) == LatencyHistogram.BOUNDS[-1]
+
+
+def test_hedge_delay_uses_default_until_enough_samples(monkeypatch):
+    monkeypatch.setattr(app, "LLM_HEDGE_DEFAULT_DELAY_S", 15.0)
+    hist = app.latency_histogram("openai", "single")
+    for _ in range(app.LLM_HEDGE_MIN_SAMPLES - 1):
+        hist.record(1.0)
+    assert app.hedge_delay("openai", "single") == 15.0
+    hist.record(1.0)
+    assert app.hedge_delay("openai", "single") == next(b for b in LatencyHistogram.BOUNDS if b >= 1.0)
+    # гистограммы раздельные по виду запроса
+    assert app.hedge_delay("openai", "batch") == 15.0
+
+
+def fake_providers(monkeypatch, policy, behaviour):
+    """behaviour: name -> (задержка, результат или исключение); возвращает список отменённых провайдеров"""
+    monkeypatch.setattr(app, "PROVIDERS", dict.fromkeys(behaviour))
+    monkeypatch.setattr(app, "LLM_POLICY", policy)
+    cancelled = []
+
+    async def make_call(name):
+        delay, outcome = behaviour[name]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(name)
+            raise
+        if isinstance(outcome, Exception):
+            raise outcome
+        return {"1": outcome}
+
+    return make_call, cancelled
+
+
+def run(make_call):
+    async def scenario():
+        started = time.monotonic()
+        results = await app.run_providers(make_call, ["1"], "single")
+        elapsed = time.monotonic() - started
+        await asyncio.sleep(0)  # даём отменённым задачам обработать CancelledError
+        return results, elapsed
+
+    return asyncio.run(scenario())
+
+
+def test_quorum_cancels_slow_provider_once_reached(monkeypatch):
+    make_call, cancelled = fake_providers(monkeypatch, "quorum", {
+        "fast": (0.01, result()),
+        "medium": (0.05, result(impact=70)),
+        "slow": (30, result("Tech")),
+    })
+    results, elapsed = run(make_call)
+    assert set(results) == {"fast", "medium"}
+    assert cancelled == ["slow"]
+    assert elapsed < 1
+    # отменённый запрос учтён в гистограмме как нижняя оценка задержки
+    assert app.latency_histogram("slow", "single").total == 1
+
+
+def test_quorum_waits_for_all_on_disagreement(monkeypatch):
+    make_call, cancelled = fake_providers(monkeypatch, "quorum", {
+        "a": (0.01, result("Markets")),
+        "b": (0.02, result("Tech")),
+        "c": (0.03, ValueError("bad json")),
+    })
+    results, _ = run(make_call)
+    assert set(results) == {"a", "b", "c"}
+    assert isinstance(results["c"]["1"], ValueError)
+    assert cancelled == []
+
+
+def test_hedged_launches_backup_and_cancels_straggler(monkeypatch):
+    monkeypatch.setattr(app, "LLM_HEDGE_DEFAULT_DELAY_S", 0.05)
+    make_call, cancelled = fake_providers(monkeypatch, "hedged", {
+        "primary": (30, result()),
+        "backup": (0.01, result("Tech")),
+    })
+    results, elapsed = run(make_call)
+    assert list(results) == ["backup"]
+    assert cancelled == ["primary"]
+    assert elapsed < 1
+
+
+def test_hedged_falls_through_to_next_provider_on_error(monkeypatch):
+    monkeypatch.setattr(app, "LLM_HEDGE_DEFAULT_DELAY_S", 30)
+    make_call, cancelled = fake_providers(monkeypatch, "hedged", {
+        "primary": (0.01, RuntimeError("HTTP 500")),
+        "backup": (0.01, result()),
+    })
+    results, elapsed = run(make_call)
+    assert list(results) == ["backup"]
+    assert elapsed < 1
+
+
+def test_all_policy_waits_for_every_provider(monkeypatch):
+    make_call, cancelled = fake_providers(monkeypatch, "all", {
+        "a": (0.01, result()),
+        "b": (0.1, result()),
+    })
+    results, elapsed = run(make_call)
+    assert set(results) == {"a", "b"}
+    assert elapsed >= 0.1 and cancelled == []
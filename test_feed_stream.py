@@ -0,0 +1,175 @@
+import asyncio
+from datetime import datetime, timezone
+
+import httpx
+import pytest
+
+import app
+
+NOW = datetime(2026, 3, 10, 12, 0, tzinfo=timezone.utc)
+
+
+def rss(n, start_day=10, extra=b""):
+    items = b"".join(
+        b"<item><title>Item %d</title><link>https://news.example.com/%d</link><guid>guid-%d</guid>"
+        b"<pubDate>%s</pubDate><description>Body %d</description></item>"
+        % (i, i, i, datetime(2026, 3, start_day - i, 9, 0, tzinfo=timezone.utc).strftime("%a, %d %b %Y %H:%M:%S +0000").encode(), i)
+        for i in range(n)
+    )
+    return b'<?xml version="1.0"?><rss version="2.0"><channel><title>Feed</title>' + items + extra + b"</channel></rss>"
+
+
+ATOM = b"""<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+  <title>Atom feed</title>
+  <entry>
+    <id>tag:example.com,2026:1</id>
+    <title>Atom item</title>
+    <link rel="self" href="https://example.com/self/1"/>
+    <link rel="alternate" href="https://example.com/posts/1"/>
+    <updated>2026-03-10T08:00:00Z</updated>
+    <published>2026-03-10T07:30:00Z</published>
+    <summary>Atom summary</summary>
+  </entry>
+  <entry>
+    <id>tag:example.com,2026:2</id>
+    <title>Only updated</title>
+    <link href="https://example.com/posts/2"/>
+    <updated>2026-03-09T08:00:00Z</updated>
+  </entry>
+</feed>"""
+
+
+def chunks(data, size=7):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def parse(data, size=7, **kwargs):
+    parser = app.FeedStreamParser(kwargs.pop("max_entries", 50), **kwargs)
+    fed = 0
+    for chunk in chunks(data, size):
+        fed += len(chunk)
+        if parser.feed(chunk):
+            break
+    return parser, parser.close(), fed
+
+
+def test_rss_fields_chunk_by_chunk():
+    parser, entries, fed = parse(rss(3))
+    assert not parser.not_feed and fed == len(rss(3))
+    assert [e["title"] for e in entries] == ["Item 0", "Item 1", "Item 2"]
+    first = entries[0]
+    assert (first["id"], first["link"]) == ("guid-0", "https://news.example.com/0")
+    assert first["published"].startswith("Tue, 10 Mar 2026")
+    assert first["published_parsed"][:4] == (2026, 3, 10, 9)
+    assert first["raw"]["summary"] == "Body 0"
+
+
+def test_atom_fields():
+    parser, entries, _ = parse(ATOM, size=5)
+    assert not parser.not_feed
+    first, second = entries
+    assert first["id"] == "tag:example.com,2026:1"
+    assert first["link"] == "https://example.com/posts/1"  # rel="self" пропускается
+    assert (first["published"], first["updated"]) == ("2026-03-10T07:30:00Z", "2026-03-10T08:00:00Z")
+    assert first["published_parsed"][:4] == (2026, 3, 10, 7)
+    assert first["raw"]["summary"] == "Atom summary"
+    assert second["link"] == "https://example.com/posts/2" and second["published"] is None
+    assert second["updated_parsed"][:3] == (2026, 3, 9) and second["published_parsed"] is None
+
+
+def test_stops_at_max_entries_without_reading_the_rest():
+    data = rss(8)
+    parser, entries, fed = parse(data, max_entries=2)
+    assert parser.done and len(entries) == 2
+    assert fed < len(data) // 2
+
+
+def test_stops_at_cutoff():
+    data = rss(8)
+    parser, entries, fed = parse(data, cutoff=datetime(2026, 3, 7, 12, 0, tzinfo=timezone.utc))
+    assert [e["id"] for e in entries] == ["guid-0", "guid-1", "guid-2"]  # 10, 9, 8 марта; 7 марта 9:00 — старше
+    assert parser.done and fed < len(data)
+
+
+def test_stops_at_last_guid():
+    data = rss(8)
+    parser, entries, fed = parse(data, last_guid="guid-2")
+    assert [e["id"] for e in entries] == ["guid-0", "guid-1"]
+    assert parser.done and fed < len(data)
+
+
+@pytest.mark.parametrize("data", [
+    b"<!DOCTYPE html><html><head><title>Page</title></head><body><p>hi</p></body></html>",
+    b"<html><body>" + b"x" * 100,
+    b"not xml at all",
+])
+def test_non_feed_documents_are_flagged(data):
+    parser, entries, _ = parse(data)
+    assert parser.not_feed and entries == []
+
+
+def stream_response(data, content_type="application/rss+xml", size=1024):
+    sent = []
+
+    async def body():
+        for chunk in chunks(data, size):
+            sent.append(len(chunk))
+            yield chunk
+    return httpx.Response(200, headers={"Content-Type": content_type}, content=body()), sent
+
+
+def read(response, url="https://feeds.example.org/rss", state=None):
+    result = {"url": url, "state": {}, "entries": []}
+    asyncio.run(app.read_feed_stream(response, state or {}, result, datetime(2026, 1, 1, tzinfo=timezone.utc)))
+    return result
+
+
+def test_read_feed_stream_stops_early(monkeypatch):
+    monkeypatch.setattr(app, "FEED_MAX_ENTRIES", 3)
+    monkeypatch.setattr(app, "FEED_HASH_BYTES", 256)
+    data = rss(9)
+    response, sent = stream_response(data, size=128)
+    result = read(response)
+    assert [e["id"] for e in result["entries"]] == ["guid-0", "guid-1", "guid-2"]
+    assert result["bytes_read"] == sum(sent) < len(data)
+    assert result["state"]["body_hash"]
+
+
+def test_read_feed_stream_truncates_at_max_bytes(monkeypatch):
+    monkeypatch.setattr(app, "FEED_MAX_ENTRIES", 10_000)
+    monkeypatch.setattr(app, "FEED_HASH_BYTES", 256)
+    monkeypatch.setattr(app, "FEED_MAX_BYTES", 4096)
+    data = rss(25, start_day=28) + b"<!--" + b"x" * 50_000 + b"-->"
+    response, sent = stream_response(data, size=512)
+    result = read(response)
+    assert 4096 <= result["bytes_read"] < 4096 + 512
+    assert sum(sent) == result["bytes_read"]
+    assert result["entries"] and len(result["entries"]) < 25
+
+
+def test_read_feed_stream_unchanged_head(monkeypatch):
+    monkeypatch.setattr(app, "FEED_HASH_BYTES", 256)
+    first = read(stream_response(rss(5))[0])
+    second = read(stream_response(rss(5))[0], state={"body_hash": first["state"]["body_hash"]})
+    assert second.get("unchanged") and second["entries"] == []
+
+
+def test_read_feed_stream_falls_back_to_feedparser(monkeypatch):
+    monkeypatch.setattr(app, "PARSE_EXECUTOR", "thread")
+    monkeypatch.setattr(app, "parse_pool", app.ParsePool())
+    # RSS, отданный как text/html и с мусором перед корнем: потоковый парсер не берётся, работает feedparser
+    data = b"\n\n" + rss(2).replace(b'<?xml version="1.0"?>', b"")
+    result = read(stream_response(data, content_type="text/html")[0])
+    assert [e["title"] for e in result["entries"]] == ["Item 0", "Item 1"]
+    assert result["entries"][0]["link"] == "https://news.example.com/0"
+    app.parse_pool.shutdown()
+
+
+def test_read_feed_stream_broken_xml_falls_back(monkeypatch):
+    monkeypatch.setattr(app, "PARSE_EXECUTOR", "thread")
+    monkeypatch.setattr(app, "parse_pool", app.ParsePool())
+    data = b'<?xml version="1.0"?><html><body><a href="/x">not a feed</a></body></html>'
+    result = read(stream_response(data)[0])
+    assert result["entries"] == [] and result["bytes_read"] == len(data)
+    app.parse_pool.shutdown()
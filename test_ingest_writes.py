@@ -0,0 +1,69 @@
+import sqlite3
+
+import pytest
+
+import app
+
+
+def rows(*ids, raw=True):
+    return [(i, "2026-01-01T00:00:00+00:00", "crypto", f"title {i}", f"https://x.com/{i}", "feed",
+             {"summary": f"body {i}"} if raw else None) for i in ids]
+
+
+def count(conn, table):
+    return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_reinsert_returns_no_new_ids(tmp_db):
+    assert app.bulk_insert_ingested(tmp_db, rows("a", "b")) == {"a", "b"}
+    assert app.bulk_insert_ingested(tmp_db, rows("a", "b")) == set()
+    assert app.bulk_insert_ingested(tmp_db, rows("b", "c")) == {"c"}
+    assert count(tmp_db, "ingested") == 3
+
+
+def test_duplicate_ids_within_one_call(tmp_db):
+    assert app.bulk_insert_ingested(tmp_db, rows("a", "a", "b")) == {"a", "b"}
+    assert count(tmp_db, "ingested") == 2
+
+
+def test_jobs_and_raw_payloads_only_for_fresh_rows(tmp_db):
+    app.bulk_insert_ingested(tmp_db, rows("a"))
+    tmp_db.execute("UPDATE analysis_jobs SET status = 'done' WHERE item_id = 'a'")
+    tmp_db.commit()
+    app.bulk_insert_ingested(tmp_db, rows("a", "b") + rows("c", raw=False))
+    jobs = dict(tmp_db.execute("SELECT item_id, status FROM analysis_jobs").fetchall())
+    assert jobs == {"a": "done", "b": "queued", "c": "queued"}  # задача "a" не пересоздана
+    raw = {r[0] for r in tmp_db.execute("SELECT id FROM raw_payloads WHERE kind = 'ingest'")}
+    assert raw == {"a", "b"}
+    assert app.load_raw_payload(tmp_db, "b", "ingest") == {"summary": "body b"}
+
+
+def test_chunks_commit_separately(tmp_db, monkeypatch):
+    monkeypatch.setattr(app, "INGEST_WRITE_CHUNK", 2)
+    assert app.bulk_insert_ingested(tmp_db, rows("a", "b", "c", "d", "e")) == {"a", "b", "c", "d", "e"}
+    assert count(tmp_db, "analysis_jobs") == 5
+
+
+@pytest.mark.parametrize("error", [sqlite3.OperationalError("disk I/O error"), RuntimeError("boom")])
+def test_failure_rolls_back_all_three_tables(tmp_db, monkeypatch, error):
+    def fail(conn, item_ids):
+        raise error
+    monkeypatch.setattr(app, "enqueue_jobs", fail)
+    with pytest.raises(type(error)):
+        app.bulk_insert_ingested(tmp_db, rows("a", "b"))
+    tmp_db.commit()
+    assert (count(tmp_db, "ingested"), count(tmp_db, "raw_payloads"), count(tmp_db, "analysis_jobs")) == (0, 0, 0)
+
+
+def test_locked_database_is_retried(tmp_db, monkeypatch):
+    calls = []
+    real = app.enqueue_jobs
+
+    def flaky(conn, item_ids):
+        calls.append(1)
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        return real(conn, item_ids)
+    monkeypatch.setattr(app, "enqueue_jobs", flaky)
+    assert app.bulk_insert_ingested(tmp_db, rows("a"), sleep=0) == {"a"}
+    assert (count(tmp_db, "ingested"), count(tmp_db, "analysis_jobs")) == (1, 1)
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import os
+import time
+
+import httpx
+import pytest
+
+import app
+from app import llm_cache_discard, llm_cache_get, llm_cache_key, llm_cache_put
+
+
+@pytest.fixture
+def cache(tmp_db, monkeypatch):
+    monkeypatch.setattr(app, "LLM_CACHE_TTL_HOURS", 1.0)
+    monkeypatch.setattr(app, "LLM_CACHE_MAX_MB", 64.0)
+    monkeypatch.setattr(app, "LLM_CACHE_STATS", dict.fromkeys(app.LLM_CACHE_STATS, 0))
+    return tmp_db
+
+
+def keys(conn):
+    return {row[0] for row in conn.execute("SELECT key FROM llm_cache")}
+
+
+def set_times(conn, key, created_ago=0.0, used_ago=0.0):
+    now = time.time()
+    conn.execute("UPDATE llm_cache SET created_at = ?, last_used = ? WHERE key = ?", (now - created_ago, now - used_ago, key))
+    conn.commit()
+
+
+def blob_size(content):
+    return len(app.pack_raw(content)[2])
+
+
+def noise(n=20000):
+    return os.urandom(n // 2).hex()  # плохо сжимается — размер записи предсказуем
+
+
+def test_put_get_roundtrip_and_touch(cache):
+    llm_cache_put("k", "openai", "gpt", '{"s": "ответ"}')
+    set_times(cache, "k", used_ago=600)
+    assert llm_cache_get("k") == '{"s": "ответ"}'
+    last_used = cache.execute("SELECT last_used FROM llm_cache WHERE key = 'k'").fetchone()[0]
+    assert time.time() - last_used < 5
+    assert llm_cache_get("missing") is None
+
+
+def test_put_replaces_existing_entry(cache):
+    llm_cache_put("k", "openai", "gpt", "old")
+    llm_cache_put("k", "openai", "gpt", "new")
+    assert llm_cache_get("k") == "new"
+    assert cache.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] == 1
+
+
+def test_get_drops_expired_entry(cache):
+    llm_cache_put("old", "openai", "gpt", "stale")
+    llm_cache_put("fresh", "openai", "gpt", "ok")
+    set_times(cache, "old", created_ago=2 * 3600)  # TTL = 1 ч
+    assert llm_cache_get("old") is None
+    assert keys(cache) == {"fresh"}
+    assert llm_cache_get("fresh") == "ok"
+
+
+def test_eviction_removes_least_recently_used_first(cache, monkeypatch):
+    contents = {k: noise() for k in ("a", "b", "c", "new")}
+    for k in ("a", "b", "c"):
+        llm_cache_put(k, "openai", "gpt", contents[k])
+    set_times(cache, "a", used_ago=100)
+    set_times(cache, "b", used_ago=300)  # самая давняя — вытесняется первой
+    set_times(cache, "c", used_ago=200)
+    # места хватает на всё, кроме одной из старых записей
+    limit = sum(blob_size(v) for v in contents.values()) - 1
+    monkeypatch.setattr(app, "LLM_CACHE_MAX_MB", limit / 1024 / 1024)
+    llm_cache_put("new", "openai", "gpt", contents["new"])
+    assert keys(cache) == {"a", "c", "new"}
+    assert app.LLM_CACHE_STATS["evicted"] == 1
+    assert llm_cache_get("new") == contents["new"]
+
+
+def test_eviction_continues_until_under_limit(cache, monkeypatch):
+    contents = {k: noise() for k in ("a", "b", "c", "new")}
+    for i, k in enumerate(("a", "b", "c")):
+        llm_cache_put(k, "openai", "gpt", contents[k])
+        set_times(cache, k, used_ago=300 - i * 100)
+    monkeypatch.setattr(app, "LLM_CACHE_MAX_MB", (blob_size(contents["c"]) + blob_size(contents["new"])) / 1024 / 1024)
+    llm_cache_put("new", "openai", "gpt", contents["new"])
+    assert keys(cache) == {"c", "new"}
+
+
+def test_eviction_drops_expired_before_recently_used(cache, monkeypatch):
+    contents = {k: noise() for k in ("expired", "lru", "new")}
+    llm_cache_put("expired", "openai", "gpt", contents["expired"])
+    llm_cache_put("lru", "openai", "gpt", contents["lru"])
+    set_times(cache, "expired", created_ago=2 * 3600, used_ago=1)
+    set_times(cache, "lru", used_ago=500)
+    monkeypatch.setattr(app, "LLM_CACHE_MAX_MB", (blob_size(contents["lru"]) + blob_size(contents["new"])) / 1024 / 1024)
+    llm_cache_put("new", "openai", "gpt", contents["new"])
+    assert keys(cache) == {"lru", "new"}
+
+
+def test_discard_removes_only_that_request(cache):
+    payload = {"model": "gpt", "messages": [{"role": "user", "content": "a"}]}
+    other = {"model": "gpt", "messages": [{"role": "user", "content": "b"}]}
+    llm_cache_put(llm_cache_key("openai", payload), "openai", "gpt", "x")
+    llm_cache_put(llm_cache_key("openai", other), "openai", "gpt", "y")
+    llm_cache_put(llm_cache_key("deepseek", payload), "deepseek", "gpt", "z")
+    llm_cache_discard("openai", payload)
+    assert keys(cache) == {llm_cache_key("openai", other), llm_cache_key("deepseek", payload)}
+
+
+def test_key_depends_on_provider_and_payload_but_not_dict_order():
+    a = {"model": "gpt", "temperature": 0.2, "messages": []}
+    b = {"messages": [], "temperature": 0.2, "model": "gpt"}
+    assert llm_cache_key("openai", a) == llm_cache_key("openai", b)
+    assert llm_cache_key("openai", a) != llm_cache_key("deepseek", a)
+    assert llm_cache_key("openai", a) != llm_cache_key("openai", dict(a, temperature=0.3))
+
+
+def test_invalid_pipeline_answer_is_discarded(cache, monkeypatch):
+    monkeypatch.setattr(app, "LLM_OUTPUT_SCHEMA", "compact")
+    payload = app.pipeline_payload("gpt", "news")
+    key = llm_cache_key("openai", payload)
+    llm_cache_put(key, "openai", "gpt", '{"s": "сводка", "i": 500}')
+    with pytest.raises(ValueError):
+        app.pipeline_result("openai", payload, llm_cache_get(key), 25, 50)
+    assert llm_cache_get(key) is None
+
+
+def test_non_json_full_schema_answer_is_discarded_but_parsed(cache, monkeypatch):
+    monkeypatch.setattr(app, "LLM_OUTPUT_SCHEMA", "full")
+    payload = app.pipeline_payload("gpt", "news")
+    key = llm_cache_key("openai", payload)
+    llm_cache_put(key, "openai", "gpt", "Sorry, I cannot help with that.")
+    result = app.pipeline_result("openai", payload, llm_cache_get(key), 25, 50)
+    assert result.label == "other"
+    assert llm_cache_get(key) is None
+
+
+def test_chat_completion_serves_repeat_from_cache(cache, monkeypatch):
+    monkeypatch.setattr(app, "LLM_CACHE_ENABLED", True)
+    monkeypatch.setattr(app, "_provider_limiters", {})
+    sent = []
+
+    def handler(request):
+        sent.append(json.loads(request.content))
+        return httpx.Response(200, json={"choices": [{"message": {"content": "ответ"}}], "usage": {"total_tokens": 5}})
+
+    monkeypatch.setattr(app.http_clients, "get", lambda name: httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    payload = {"model": "gpt", "messages": [{"role": "user", "content": "hi"}]}
+
+    async def scenario():
+        first = await app.chat_completion("openai", "https://llm.test", "key", payload)
+        second = await app.chat_completion("openai", "https://llm.test", "key", payload)
+        bypass = await app.chat_completion("openai", "https://llm.test", "key", payload, bypass_cache=True)
+        return first, second, bypass
+
+    assert asyncio.run(scenario()) == ("ответ", "ответ", "ответ")
+    assert len(sent) == 2
+    stats = app.LLM_CACHE_STATS
+    assert (stats["hits"], stats["misses"], stats["bypassed"]) == (1, 1, 1)
+
+
+def test_chat_completion_does_not_cache_empty_answer(cache, monkeypatch):
+    monkeypatch.setattr(app, "LLM_CACHE_ENABLED", True)
+    monkeypatch.setattr(app, "_provider_limiters", {})
+    response = {"choices": [{"message": {"content": "  "}}]}
+    monkeypatch.setattr(app.http_clients, "get",
+                        lambda name: httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, json=response))))
+    asyncio.run(app.chat_completion("openai", "https://llm.test", "key", {"model": "gpt", "messages": []}))
+    assert keys(cache) == set()
@@ -0,0 +1,93 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import app
+
+TITLE = "Fed raises interest rates by 25 bps amid persistent inflation fears - Reuters"
+
+
+def add_signal(conn, signal_id, title, hours_ago=1, link=None):
+    ts = (datetime.now(timezone.utc) - timedelta(hours=hours_ago)).isoformat()
+    link = link or f"https://{signal_id}.example.com/story"
+    conn.execute("INSERT INTO signals(id, ts_published, ts_ingested, title, url, url_hash, sector) VALUES(?,?,?,?,?,?,?)",
+                 (signal_id, ts, ts, title, link, app.hash_id(link), "TREASURY"))
+    app.index_signal_title(conn, signal_id, ts, title)
+    conn.commit()
+
+
+@pytest.fixture
+def conn(tmp_db, monkeypatch):
+    monkeypatch.setattr(app, "NEAR_DUP_ENABLED", True)
+    monkeypatch.setattr(app, "NEAR_DUP_THRESHOLD", 0.8)
+    monkeypatch.setattr(app, "NEAR_DUP_WINDOW_HOURS", 72.0)
+    add_signal(tmp_db, "s1", TITLE)
+    return tmp_db
+
+
+def test_band_keys_are_stable_signed_64bit():
+    tokens = app.title_tokens(TITLE)
+    keys = app.minhash_band_keys(tokens)
+    assert len(keys) == app.MINHASH_PERMUTATIONS // app.MINHASH_BAND_ROWS
+    assert keys == app.minhash_band_keys(list(tokens))
+    assert all(-(1 << 63) <= k < (1 << 63) for k in keys)
+
+
+def test_source_suffix_and_stopwords_are_ignored():
+    assert app.title_tokens(TITLE) == app.title_tokens("The Fed raises interest rates by 25 bps amid persistent inflation fears | Bloomberg")
+
+
+@pytest.mark.parametrize("title", [
+    "Fed raises interest rates by 25 bps amid persistent inflation fears | Bloomberg",
+    "Fed raises interest rates by 25 bps amid persistent inflation fears again — CNBC",
+])
+def test_near_duplicate_across_sources(conn, title):
+    hit = app.find_near_duplicate(conn, title)
+    assert hit is not None and hit[0] == "s1" and hit[1] >= 0.8
+
+
+def test_numeric_tokens_must_match(conn):
+    assert app.find_near_duplicate(conn, "Fed raises interest rates by 50 bps amid persistent inflation fears - WSJ") is None
+    assert app.token_similarity({"fed", "25", "bps"}, {"fed", "50", "bps"}) == 0.0
+
+
+def test_unrelated_and_short_titles_miss(conn):
+    assert app.find_near_duplicate(conn, "Oil prices slump as OPEC output climbs sharply") is None
+    assert app.find_near_duplicate(conn, "Fed raises") is None
+    assert app.find_near_duplicate(conn, TITLE, exclude_id="s1") is None
+
+
+def test_index_rows_outside_window_expire(conn):
+    add_signal(conn, "old", "Bank of Japan keeps yield curve control unchanged at policy meeting", hours_ago=100)
+    assert app.find_near_duplicate(conn, "Bank of Japan keeps yield curve control unchanged at policy meeting - Nikkei") is None
+    conn.execute("DELETE FROM signals WHERE id = 'old'")
+    app.prune_near_dup_index(conn)
+    assert conn.execute("SELECT COUNT(*) FROM near_dup_bands WHERE signal_id = 'old'").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM near_dup_index WHERE signal_id = 'old'").fetchone()[0] == 0
+
+
+def test_attach_if_duplicate_records_near_duplicate(conn):
+    item = {"id": "i2", "link": "https://other.example.org/fed", "sector": "crypto",
+            "title": "Fed raises interest rates by 25 bps amid persistent inflation fears | Bloomberg"}
+    assert app.attach_if_duplicate(conn, item) is True
+    signal_id, similarity = conn.execute("SELECT signal_id, similarity FROM signal_duplicates WHERE item_id = 'i2'").fetchone()
+    assert signal_id == "s1" and similarity >= 0.8
+    assert json.loads(conn.execute("SELECT merged_of FROM signals WHERE id = 's1'").fetchone()[0]) == ["i2"]
+    assert ("s1", "CRYPTO") in conn.execute("SELECT article_id, sector FROM article_sectors").fetchall()
+    # повторное прикрепление той же записи не дублирует merged_of
+    assert app.attach_if_duplicate(conn, item) is True
+    assert json.loads(conn.execute("SELECT merged_of FROM signals WHERE id = 's1'").fetchone()[0]) == ["i2"]
+
+
+def test_attach_if_duplicate_same_url(conn):
+    item = {"id": "i3", "link": "https://s1.example.com/story", "sector": "energy", "title": "Completely different headline here"}
+    assert app.attach_if_duplicate(conn, item) is True
+    assert conn.execute("SELECT signal_id, similarity FROM signal_duplicates WHERE item_id = 'i3'").fetchone() == ("s1", 1.0)
+
+
+def test_attach_if_duplicate_miss(conn):
+    item = {"id": "i4", "link": "https://x.example.org/oil", "sector": "energy",
+            "title": "Fed raises interest rates by 50 bps amid persistent inflation fears"}
+    assert app.attach_if_duplicate(conn, item) is False
+    assert conn.execute("SELECT COUNT(*) FROM signal_duplicates").fetchone()[0] == 0
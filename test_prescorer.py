@@ -0,0 +1,70 @@
+from app import PreScorer, evaluate_prescorer
+
+
+def row(title, noise, label="macro", sentiment="0"):
+    return PreScorer.features(title, "CRYPTO", "example.com"), {"noise": noise, "label": label, "sentiment": sentiment}
+
+
+ROWS = [
+    row("Bitcoin price update daily roundup", "1", "other"),
+    row("Daily crypto price roundup", "1", "other"),
+    row("Price roundup for altcoins today", "1", "other"),
+    row("SEC approves spot bitcoin ETF", "0", "regulation", "1"),
+    row("SEC sues exchange over securities violations", "0", "regulation", "-1"),
+    row("Exchange hacked, 200 million stolen", "0", "security", "-1"),
+]
+
+
+def test_fit_learns_classes_and_priors():
+    model = PreScorer.fit(ROWS, noise_impact=20)
+    assert model.model["samples"] == 6
+    assert model.model["noise_impact"] == 20
+    assert model.model["targets"]["noise"]["classes"] == ["0", "1"]
+    assert sorted(model.model["targets"]["label"]["classes"]) == ["other", "regulation", "security"]
+
+
+def test_proba_is_normalized_and_separates_seen_patterns():
+    model = PreScorer.fit(ROWS, noise_impact=20)
+    noise = model.proba("noise", PreScorer.features("Daily price roundup", "CRYPTO", "example.com"))
+    assert abs(sum(noise.values()) - 1) < 1e-9
+    assert noise["1"] > 0.5
+    regulation = model.proba("label", PreScorer.features("SEC approves ETF", "CRYPTO", "example.com"))
+    assert max(regulation, key=lambda c: regulation[c]) == "regulation"
+
+
+def test_proba_survives_json_round_trip():
+    import json
+    model = PreScorer.fit(ROWS, noise_impact=20)
+    reloaded = PreScorer(json.loads(json.dumps(model.model)))
+    feats = PreScorer.features("SEC sues exchange", "CRYPTO", "example.com")
+    for target in PreScorer.TARGETS:
+        a, b = model.proba(target, feats), reloaded.proba(target, feats)
+        assert a.keys() == b.keys()
+        assert all(abs(a[c] - b[c]) < 1e-3 for c in a)
+
+
+def test_predict_features_reports_noise_probability_and_label_confidence():
+    model = PreScorer.fit(ROWS, noise_impact=20)
+    p = model.predict_features(PreScorer.features("Daily price roundup", "CRYPTO", "example.com"))
+    assert p["noise"] == "1"
+    assert p["noise_p"] == model.proba("noise", PreScorer.features("Daily price roundup", "CRYPTO", "example.com"))["1"]
+    assert 0 < p["label_p"] <= 1
+
+
+def test_evaluate_prescorer_report():
+    model = PreScorer.fit(ROWS, noise_impact=20)
+    report = evaluate_prescorer(model, ROWS)
+    assert report["samples"] == 6
+    for target in PreScorer.TARGETS:
+        assert 0 <= report[target]["accuracy"] <= 1
+        assert 0 <= report[target]["baseline"] <= 1
+    assert report["noise"]["accuracy"] == 1.0
+    assert report["noise"]["share"] == 0.5
+    assert set(report["noise"]["thresholds"]) == {"0.8", "0.9", "0.95", "0.99"}
+    for m in report["noise"]["thresholds"].values():
+        assert 0 <= m["coverage"] <= 1
+
+
+def test_evaluate_prescorer_empty():
+    model = PreScorer.fit(ROWS, noise_impact=20)
+    assert evaluate_prescorer(model, []) == {"samples": 0}
@@ -0,0 +1,248 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import httpx
+import pytest
+
+import app
+from app import ProviderLimiter, TokenBucket, parse_retry_after
+
+
+@pytest.mark.parametrize("headers, expected", [
+    ({"retry-after": "7"}, 7.0),
+    ({"retry-after": "0.5"}, 0.5),
+    ({"retry-after": "1m30s"}, 90.0),
+    ({"retry-after-ms": "250"}, 0.25),
+    ({"retry-after-ms": "250", "retry-after": "9"}, 0.25),
+    ({"retry-after-ms": "junk", "retry-after": "9"}, 9.0),
+    ({"retry-after": "soon"}, None),
+    ({}, None),
+])
+def test_parse_retry_after_seconds(headers, expected):
+    assert parse_retry_after(httpx.Headers(headers)) == expected
+
+
+def test_parse_retry_after_http_date():
+    when = datetime.now(timezone.utc) + timedelta(seconds=30)
+    delay = parse_retry_after(httpx.Headers({"retry-after": format_datetime(when, usegmt=True)}))
+    assert 28 <= delay <= 31
+
+
+def test_parse_retry_after_http_date_in_past_is_zero():
+    when = datetime.now(timezone.utc) - timedelta(minutes=5)
+    assert parse_retry_after(httpx.Headers({"retry-after": format_datetime(when, usegmt=True)})) == 0.0
+
+
+def test_token_bucket_unknown_limit_never_waits():
+    bucket = TokenBucket(0)
+    bucket.take(10 ** 6)
+    assert bucket.wait_time(10 ** 6, bucket.updated + 1) == 0.0
+
+
+def test_token_bucket_blocks_when_empty_and_refills_over_time():
+    bucket = TokenBucket(60)  # 1 запрос в секунду
+    t0 = bucket.updated
+    bucket.take(60)
+    assert bucket.wait_time(1, t0) == pytest.approx(1.0)
+    assert bucket.wait_time(1, t0 + 0.5) == pytest.approx(0.5)
+    assert bucket.wait_time(1, t0 + 1.0) == 0.0
+    assert bucket.wait_time(1, t0 + 600) == 0.0
+    assert bucket.level == 60  # refill не выше ёмкости
+
+
+def test_token_bucket_request_larger_than_capacity_waits_for_full_bucket():
+    bucket = TokenBucket(100)
+    t0 = bucket.updated
+    bucket.take(100)
+    assert bucket.wait_time(500, t0) == pytest.approx(60.0)
+
+
+def test_token_bucket_sync_with_exhausted_window_blocks_until_reset():
+    bucket = TokenBucket(0)
+    t0 = bucket.updated
+    bucket.sync(limit=60, remaining=0, reset_s=10, now=t0)
+    assert bucket.capacity == 60
+    assert bucket.wait_time(1, t0) == pytest.approx(11.0)
+
+
+def limiter(limit=4):
+    lim = ProviderLimiter("test")
+    lim.limit = float(limit)
+    return lim
+
+
+def test_aimd_halves_limit_on_congestion_once_per_burst():
+    lim = limiter(8)
+    lim.in_flight = 3
+    lim.release(ok=False, congested=True)
+    assert lim.limit == 4.0
+    lim.release(ok=False, congested=True)  # та же пачка 429 — второй раз не режем
+    assert lim.limit == 4.0
+    lim.last_decrease -= 3
+    lim.release(ok=False, congested=True)
+    assert lim.limit == 2.0
+    assert lim.in_flight == 0
+
+
+def test_aimd_limit_never_drops_below_one():
+    lim = limiter(1)
+    lim.release(ok=False, congested=True)
+    assert lim.limit == 1.0
+
+
+def test_aimd_plain_error_does_not_decrease():
+    lim = limiter(4)
+    lim.release(ok=False)
+    assert lim.limit == 4.0
+    assert lim.stats["errors"] == 1
+
+
+def test_aimd_additive_recovery_on_fast_success():
+    lim = limiter(2)
+    lim.release(ok=True, latency=0.1)
+    assert lim.limit == pytest.approx(2.5)
+    for _ in range(10):
+        lim.release(ok=True, latency=0.1)
+    assert 4 < lim.limit < 6  # ~ +1 за «окно» из limit успешных ответов
+
+
+def test_aimd_slow_success_does_not_increase(monkeypatch):
+    monkeypatch.setattr(app, "LLM_LATENCY_TARGET_S", 1.0)
+    lim = limiter(2)
+    lim.release(ok=True, latency=5.0)
+    assert lim.limit == 2.0
+
+
+def test_aimd_capped_by_max_concurrency(monkeypatch):
+    monkeypatch.setattr(app, "LLM_MAX_CONCURRENCY", 3)
+    lim = limiter(3)
+    lim.release(ok=True, latency=0.1)
+    assert lim.limit == 3
+
+
+def test_retry_after_blocks_new_acquires():
+    lim = limiter(4)
+    lim.release(ok=False, congested=True, retry_after=30)
+    assert lim.report()["blocked_for_s"] >= 30
+
+
+def test_acquire_blocks_at_concurrency_limit_until_release():
+    async def scenario():
+        lim = limiter(1)
+        await lim.acquire(10)
+        waiter = asyncio.create_task(lim.acquire(10))
+        await asyncio.sleep(0.1)
+        assert not waiter.done()
+        lim.release(ok=True, latency=0.1)
+        await asyncio.wait_for(waiter, 2)
+        assert lim.in_flight == 1
+
+    asyncio.run(scenario())
+
+
+def test_cancel_frees_slot_without_touching_limit():
+    async def scenario():
+        lim = limiter(2)
+        await lim.acquire(10)
+        lim.cancel()
+        return lim
+
+    lim = asyncio.run(scenario())
+    assert lim.in_flight == 0 and lim.limit == 2.0 and lim.stats["cancelled"] == 1
+
+
+@pytest.fixture
+def llm_transport(tmp_db, monkeypatch):
+    """Подменяет пул llm на MockTransport; handler задаёт тест"""
+    monkeypatch.setattr(app, "_provider_limiters", {})
+    monkeypatch.setattr(app, "LLM_CACHE_ENABLED", False)
+    monkeypatch.setattr(app, "LLM_MAX_RETRIES", 1)
+    monkeypatch.setattr(app, "backoff_delay", lambda attempt: 0.0)
+    state = {}
+
+    def install(handler):
+        state["handler"] = handler
+
+    def get(name):
+        return httpx.AsyncClient(transport=httpx.MockTransport(lambda request: state["handler"](request)))
+
+    monkeypatch.setattr(app.http_clients, "get", get)
+    return install
+
+
+def call():
+    payload = {"model": "m", "messages": [{"role": "user", "content": "hi"}], "max_tokens": 10}
+    return asyncio.run(app.chat_completion("test", "https://llm.test/v1/chat/completions", "key", payload))
+
+
+def ok_body(content="done"):
+    return {"choices": [{"message": {"content": content}}], "usage": {"total_tokens": 20}}
+
+
+def test_slot_released_after_success(llm_transport):
+    llm_transport(lambda request: httpx.Response(200, json=ok_body()))
+    assert call() == "done"
+    lim = app.provider_limiter("test")
+    assert lim.in_flight == 0 and lim.stats["ok"] == 1
+
+
+def test_slot_released_on_html_200(llm_transport):
+    llm_transport(lambda request: httpx.Response(200, text="<html>proxy error</html>"))
+    with pytest.raises(ValueError):
+        call()
+    lim = app.provider_limiter("test")
+    assert lim.in_flight == 0 and lim.stats["errors"] == 1
+
+
+def test_slot_released_on_unexpected_json_shape(llm_transport):
+    llm_transport(lambda request: httpx.Response(200, json={"error": "nope"}))
+    with pytest.raises(KeyError):
+        call()
+    assert app.provider_limiter("test").in_flight == 0
+
+
+def test_slot_released_on_too_many_redirects(llm_transport):
+    def handler(request):
+        raise httpx.TooManyRedirects("loop", request=request)
+
+    llm_transport(handler)
+    with pytest.raises(httpx.TooManyRedirects):
+        call()
+    assert app.provider_limiter("test").in_flight == 0
+
+
+def test_slot_released_on_transport_error_after_retries(llm_transport):
+    def handler(request):
+        raise httpx.ConnectError("refused", request=request)
+
+    llm_transport(handler)
+    with pytest.raises(httpx.ConnectError):
+        call()
+    lim = app.provider_limiter("test")
+    assert lim.in_flight == 0 and lim.stats["retries"] == 1
+
+
+def test_slot_released_on_4xx(llm_transport):
+    llm_transport(lambda request: httpx.Response(400, json={"error": "bad"}))
+    with pytest.raises(httpx.HTTPStatusError):
+        call()
+    assert app.provider_limiter("test").in_flight == 0
+
+
+def test_429_retries_then_halves_limit_and_raises(llm_transport):
+    llm_transport(lambda request: httpx.Response(429, headers={"retry-after-ms": "1"}))
+    with pytest.raises(app.LLMRateLimited):
+        call()
+    lim = app.provider_limiter("test")
+    assert lim.in_flight == 0
+    assert lim.stats["rate_limited"] == 2
+    assert lim.limit == max(app.LLM_CONCURRENCY.get("test", 2), 1) / 2
+
+
+def test_429_then_success(llm_transport):
+    responses = iter([httpx.Response(429, headers={"retry-after-ms": "1"}), httpx.Response(200, json=ok_body("second"))])
+    llm_transport(lambda request: next(responses))
+    assert call() == "second"
+    lim = app.provider_limiter("test")
+    assert lim.in_flight == 0 and lim.stats["retries"] == 1 and lim.stats["ok"] == 1
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Обучение локального пре-скорера на разметке LLM из signals и отчёт о его точности
+"""
+import sys
+from app import PRESCORER_NOISE_IMPACT, PRESCORER_NOISE_PROB, PRESCORER_PATH, db, train_prescorer
+
+def train(save: bool = True, holdout: float = 0.2):
+    conn = db()
+
+    print("=" * 70)
+    print("🧮 ОБУЧЕНИЕ ПРЕ-СКОРЕРА")
+    print("=" * 70)
+
+    model, report = train_prescorer(conn, holdout=holdout)
+    conn.close()
+
+    samples = model.model.get("samples", 0)
+    print(f"   • Сигналов с разметкой LLM: {samples:,}")
+    if not samples:
+        print("\n⚠️  Нет данных для обучения.")
+        return
+
+    if report:
+        print(f"\n📊 Точность на последних {report['samples']:,} сигналах (обучение на более ранних):")
+        for target in ("noise", "label", "sentiment"):
+            print(f"   • {target:10s}: accuracy {report[target]['accuracy']:.1%} (самый частый класс: {report[target]['baseline']:.1%})")
+        print(f"\n🔇 Шум (impact < {PRESCORER_NOISE_IMPACT}): {report['noise']['share']:.1%} сигналов")
+        print("   порог P(noise)   без LLM   precision   recall")
+        for threshold, m in report["noise"]["thresholds"].items():
+            precision = f"{m['precision']:.1%}" if m["precision"] is not None else "—"
+            recall = f"{m['recall']:.1%}" if m["recall"] is not None else "—"
+            marker = "  ← PRESCORER_NOISE_PROB" if float(threshold) == PRESCORER_NOISE_PROB else ""
+            print(f"   {threshold:>14s}   {m['coverage']:>7.1%}   {precision:>9s}   {recall:>6s}{marker}")
+    else:
+        print("\n⚠️  Слишком мало сигналов для отложенной выборки — отчёт о точности пропущен.")
+
+    if not save:
+        print(f"\n💡 Для сохранения модели запустите без --evaluate")
+        return
+
+    model.save(PRESCORER_PATH)
+    print(f"\n✅ Модель сохранена: {PRESCORER_PATH} (подхватится пайплайном без рестарта)")
+    print("\n" + "=" * 70)
+
+if __name__ == "__main__":
+    train(save="--evaluate" not in sys.argv)